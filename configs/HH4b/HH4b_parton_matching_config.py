@@ -41,9 +41,16 @@ parameters = defaults.merge_parameters_from_files(
     update=True,
 )
 
+# a list (tagged by file name) or a dict {tag: model} evaluates several models in the
+# same pass: the first one fills HiggsLeading, ..., and each one HiggsLeading_<tag>, ...
 spanet_model = (
     "params/out_hh4b_5jets_ATLAS_ptreg_c0_lr1e4_wp0_noklininp_oc_300e_kl3p5.onnx"
 )
+# None, "int8_dynamic", "int8_static" or "fp16", see utils/spanet_quantization.py
+spanet_quantization = None
+# attributes of ort.SessionOptions of the SPANet sessions, None for the ones sized
+# by utils/onnx_executor.py from the cores of the worker
+spanet_session_options = None
 
 cfg = Configurator(
     parameters=parameters,
@@ -83,8 +90,17 @@ cfg = Configurator(
         "which_bquark": "last",
         "classification": CLASSIFICATION,  # HERE
         "spanet_model": spanet_model,
+        "spanet_quantization": spanet_quantization,
+        "spanet_session_options": spanet_session_options,
         "tight_cuts": TIGHT_CUTS,
         "fifth_jet": "btag",
+        # events per session.run call and memory ceiling of the SPANet inference
+        "inference_batch_size": None,
+        "max_inference_memory": None,  # e.g. "2GB"
+        # directory of the on-disk cache of the SPANet predictions, None to disable it
+        "spanet_cache_dir": None,
+        # overlap the feature build and the pairing extraction with the inference
+        "pipelined_inference": False,
     },
     skim=[
         get_HLTsel(primaryDatasets=["JetMET"]),
@@ -312,6 +328,7 @@ cfg = Configurator(
                                 "mass",
                                 "dR",
                                 "cos_theta",
+                                "helicity_cos_theta",
                             ],
                         ),
                         ColOut(
@@ -323,6 +340,7 @@ cfg = Configurator(
                                 "mass",
                                 "dR",
                                 "cos_theta",
+                                "helicity_cos_theta",
                             ],
                         ),
                         ColOut(
@@ -333,6 +351,7 @@ cfg = Configurator(
                                 # "phi",
                                 "mass",
                                 "cos_theta_star",
+                                "cos_theta_star_cs",
                                 "dR",
                                 "dPhi",
                                 "dEta",
@@ -217,6 +217,7 @@ cfg = Configurator(
                                 "mass",
                                 "dR",
                                 "cos_theta",
+                                "helicity_cos_theta",
                             ],
                         ),
                         ColOut(
@@ -228,6 +229,7 @@ cfg = Configurator(
                                 "mass",
                                 "dR",
                                 "cos_theta",
+                                "helicity_cos_theta",
                             ],
                         ),
                         ColOut(
@@ -238,6 +240,7 @@ cfg = Configurator(
                                 # "phi",
                                 "mass",
                                 "cos_theta_star",
+                                "cos_theta_star_cs",
                                 "dR",
                                 "dPhi",
                                 "dEta",
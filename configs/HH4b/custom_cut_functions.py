@@ -1,171 +1,144 @@
 from collections.abc import Iterable
+import weakref
+
 import awkward as ak
+import numpy as np
 
 
-def lepton_veto(events, params, **kwargs):
-    no_electron = events.nElectronGood == 0
-    no_muon = events.nMuonGood == 0
+def _first_jets(values, num_jets=4):
+    # (n, num_jets) numpy array of the first values of each event, nan if missing,
+    # so that all the comparisons with the missing jets are False
+    return np.ma.filled(
+        ak.to_numpy(ak.pad_none(values, num_jets, axis=1, clip=True)), np.nan
+    )
 
-    mask = no_electron & no_muon
 
-    return ak.where(ak.is_none(mask), False, mask)
+def _get_cut_memo(events):
+    # The memo is stored in the attrs of the events, and is recomputed when the
+    # events are filtered or a field is added, which replaces their layout.
+    memo = events.attrs.get("@jet_cut_cache")
+    if memo is None or memo["layout"]() is not events.layout:
+        memo = {"layout": weakref.ref(events.layout)}
+        events.attrs["@jet_cut_cache"] = memo
+    return memo
+
+
+def get_lepton_veto(events):
+    """
+    (n,) bool array of the events without good electrons and muons, computed once
+    per chunk and shared by all the cut functions evaluated on the same events.
+    """
+    memo = _get_cut_memo(events)
+    if "lepton_veto" not in memo:
+        mask = (events.nElectronGood == 0) & (events.nMuonGood == 0)
+        memo["lepton_veto"] = ak.to_numpy(ak.fill_none(mask, False))
+    return memo["lepton_veto"]
+
+
+def get_jet_cut_cache(events, collection):
+    """
+    Variables of the jet cuts, computed once per chunk and shared by all the cut
+    functions and categories evaluated on the same events.
+
+    Parameters:
+    events (ak.Array): events of the chunk.
+    collection (str): jet collection, e.g. JetGood or JetGoodHiggs, ordered by b-tag.
+
+    Returns:
+    dict: "pt_sorted" (n, 4) pt of the four leading-pt jets of the collection in
+        decreasing order and "btag" (n, 4) btagPNetB of its first four jets, nan
+        for the missing jets.
+    """
+    memo = _get_cut_memo(events)
+    if collection not in memo:
+        jets = events[collection]
+        memo[collection] = {
+            "pt_sorted": _first_jets(ak.sort(jets.pt, axis=1, ascending=False)),
+            "btag": _first_jets(jets.btagPNetB),
+        }
+    return memo[collection]
+
+
+def _jets_pt_mask(pt_sorted, params):
+    return (
+        (pt_sorted[:, 0] > params["pt_jet0"])
+        & (pt_sorted[:, 1] > params["pt_jet1"])
+        & (pt_sorted[:, 2] > params["pt_jet2"])
+        & (pt_sorted[:, 3] > params["pt_jet3"])
+    )
 
 
-def four_jet(events, params, **kwargs):
-    no_electron = events.nElectronGood == 0
-    no_muon = events.nMuonGood == 0
+def _mean_btag_mask(btag, params):
+    return (btag[:, 0] + btag[:, 1]) / 2 > params["mean_pnet_jet"]
+
+
+def _num_jets_mask(events, params):
+    return ak.to_numpy(ak.fill_none(events.nJetGood >= params["njet"], False))
 
-    mask_4jet = events.nJetGood >= params["njet"]
-    mask = mask_4jet & no_electron & no_muon
 
-    return ak.where(ak.is_none(mask), False, mask)
+def lepton_veto(events, params, **kwargs):
+    return get_lepton_veto(events)
+
+
+def four_jet(events, params, **kwargs):
+    return _num_jets_mask(events, params) & get_lepton_veto(events)
 
 
 def jet_pt(events, params, **kwargs):
-    no_electron = events.nElectronGood == 0
-    no_muon = events.nMuonGood == 0
-    mask_4jet = events.nJetGood >= params["njet"]
-    mask_4jet_nolep = mask_4jet & no_electron & no_muon
-
-    mask_4jet_nolep_none = ak.mask(mask_4jet_nolep, mask_4jet_nolep)
-    jets_btag_order = events[mask_4jet_nolep_none].JetGoodHiggs
-
-    jets_pt_order = jets_btag_order[
-        ak.argsort(jets_btag_order.pt, axis=1, ascending=False)
-    ]
-
-    mask = (
-        (jets_pt_order.pt[:, 0] > params["pt_jet0"])
-        & (jets_pt_order.pt[:, 1] > params["pt_jet1"])
-        & (jets_pt_order.pt[:, 2] > params["pt_jet2"])
-        & (jets_pt_order.pt[:, 3] > params["pt_jet3"])
+    cache = get_jet_cut_cache(events, "JetGoodHiggs")
+    return (
+        _num_jets_mask(events, params)
+        & get_lepton_veto(events)
+        & _jets_pt_mask(cache["pt_sorted"], params)
     )
-    return ak.where(ak.is_none(mask), False, mask)
 
 
 def jet_btag_lead(events, params, **kwargs):
-    no_electron = events.nElectronGood == 0
-    no_muon = events.nMuonGood == 0
-    mask_4jet = events.nJetGood >= params["njet"]
-    mask_4jet_nolep = mask_4jet & no_electron & no_muon
-
-    mask_4jet_nolep_none = ak.mask(mask_4jet_nolep, mask_4jet_nolep)
-    jets_btag_order = events[mask_4jet_nolep_none].JetGoodHiggs
-
-    jets_pt_order = jets_btag_order[
-        ak.argsort(jets_btag_order.pt, axis=1, ascending=False)
-    ]
-
-    mask_pt = (
-        (jets_pt_order.pt[:, 0] > params["pt_jet0"])
-        & (jets_pt_order.pt[:, 1] > params["pt_jet1"])
-        & (jets_pt_order.pt[:, 2] > params["pt_jet2"])
-        & (jets_pt_order.pt[:, 3] > params["pt_jet3"])
+    cache = get_jet_cut_cache(events, "JetGoodHiggs")
+    return (
+        _num_jets_mask(events, params)
+        & get_lepton_veto(events)
+        & _jets_pt_mask(cache["pt_sorted"], params)
+        & _mean_btag_mask(cache["btag"], params)
     )
 
-    mask_btag = (
-        jets_btag_order.btagPNetB[:, 0] + jets_btag_order.btagPNetB[:, 1]
-    ) / 2 > params["mean_pnet_jet"]
-
-    mask = mask_pt & mask_btag
-
-    return ak.where(ak.is_none(mask), False, mask)
-
 
 def jet_btag_all(events, params, **kwargs):
-    no_electron = events.nElectronGood == 0
-    no_muon = events.nMuonGood == 0
-    mask_4jet = events.nJetGood >= params["njet"]
-    mask_4jet_nolep = mask_4jet & no_electron & no_muon
-
-    mask_4jet_nolep_none = ak.mask(mask_4jet_nolep, mask_4jet_nolep)
-    jets_btag_order = events[mask_4jet_nolep_none].JetGoodHiggs
-
-    jets_pt_order = jets_btag_order[
-        ak.argsort(jets_btag_order.pt, axis=1, ascending=False)
-    ]
-
-    mask_pt = (
-        (jets_pt_order.pt[:, 0] > params["pt_jet0"])
-        & (jets_pt_order.pt[:, 1] > params["pt_jet1"])
-        & (jets_pt_order.pt[:, 2] > params["pt_jet2"])
-        & (jets_pt_order.pt[:, 3] > params["pt_jet3"])
+    cache = get_jet_cut_cache(events, "JetGoodHiggs")
+    btag = cache["btag"]
+    return (
+        _num_jets_mask(events, params)
+        & get_lepton_veto(events)
+        & _jets_pt_mask(cache["pt_sorted"], params)
+        & _mean_btag_mask(btag, params)
+        & (btag[:, 2] > params["third_pnet_jet"])
+        & (btag[:, 3] > params["fourth_pnet_jet"])
     )
 
-    mask_btag = (
-        (
-            (jets_btag_order.btagPNetB[:, 0] + jets_btag_order.btagPNetB[:, 1]) / 2
-            > params["mean_pnet_jet"]
-        )
-        & (jets_btag_order.btagPNetB[:, 2] > params["third_pnet_jet"])
-        & (jets_btag_order.btagPNetB[:, 3] > params["fourth_pnet_jet"])
-    )
-
-    mask = mask_pt & mask_btag
-
-    return ak.where(ak.is_none(mask), False, mask)
-
 
 def hh4b_presel_cuts(events, params, **kwargs):
-    at_least_four_jets = events.nJetGood >= params["njet"]
-    no_electron = events.nElectronGood == 0
-    no_muon = events.nMuonGood == 0
-
-    mask_4jet_nolep = at_least_four_jets & no_electron & no_muon
-
-    # convert false to None
-    mask_4jet_nolep_none = ak.mask(mask_4jet_nolep, mask_4jet_nolep)
-    jets_btag_order = (
-        events[mask_4jet_nolep_none].JetGood
-        if not params["tight_cuts"]
-        else events[mask_4jet_nolep_none].JetGoodHiggs
+    cache = get_jet_cut_cache(
+        events, "JetGood" if not params["tight_cuts"] else "JetGoodHiggs"
     )  # HERE_OLD_CUTS JetGoodHiggs
-
-    jets_pt_order = jets_btag_order[
-        ak.argsort(jets_btag_order.pt, axis=1, ascending=False)
-    ]
-
-    mask_pt_none = (
-        (jets_pt_order.pt[:, 0] > params["pt_jet0"])
-        & (jets_pt_order.pt[:, 1] > params["pt_jet1"])
-        & (jets_pt_order.pt[:, 2] > params["pt_jet2"])
-        & (jets_pt_order.pt[:, 3] > params["pt_jet3"])
-    )
-    # convert none to false
-    mask_pt = ak.where(ak.is_none(mask_pt_none), False, mask_pt_none)
-
-    mask_btag = (
-        (jets_btag_order.btagPNetB[:, 0] + jets_btag_order.btagPNetB[:, 1]) / 2
-        > params["mean_pnet_jet"]
-        # & (jets_btag_order.btagPNetB[:, 2] > params["third_pnet_jet"])
-        # & (jets_btag_order.btagPNetB[:, 3] > params["fourth_pnet_jet"])
+    return (
+        _num_jets_mask(events, params)
+        & get_lepton_veto(events)
+        & _jets_pt_mask(cache["pt_sorted"], params)
+        & _mean_btag_mask(cache["btag"], params)
+        # & (cache["btag"][:, 2] > params["third_pnet_jet"])
+        # & (cache["btag"][:, 3] > params["fourth_pnet_jet"])
     )
 
-    mask_btag = ak.where(ak.is_none(mask_btag), False, mask_btag)
-
-    mask = mask_pt & mask_btag
-
-    # Pad None values with False
-    return ak.where(ak.is_none(mask), False, mask)
-
 
 def hh4b_2b_cuts(events, params, **kwargs):
-    jets_btag_order = events.JetGoodHiggs
-
-    mask = (jets_btag_order.btagPNetB[:, 2] < params["third_pnet_jet"]) & (
-        jets_btag_order.btagPNetB[:, 3] < params["fourth_pnet_jet"]
+    btag = get_jet_cut_cache(events, "JetGoodHiggs")["btag"]
+    return (btag[:, 2] < params["third_pnet_jet"]) & (
+        btag[:, 3] < params["fourth_pnet_jet"]
     )
 
-    # Pad None values with False
-    return ak.where(ak.is_none(mask), False, mask)
-
 
 def hh4b_4b_cuts(events, params, **kwargs):
-    jets_btag_order = events.JetGoodHiggs
-
-    mask = (jets_btag_order.btagPNetB[:, 2] > params["third_pnet_jet"]) & (
-        jets_btag_order.btagPNetB[:, 3] > params["fourth_pnet_jet"]
+    btag = get_jet_cut_cache(events, "JetGoodHiggs")["btag"]
+    return (btag[:, 2] > params["third_pnet_jet"]) & (
+        btag[:, 3] > params["fourth_pnet_jet"]
     )
-
-    # Pad None values with False
-    return ak.where(ak.is_none(mask), False, mask)
@@ -1,43 +1,14 @@
-from pocket_coffea.executors.executors_T3_CH_PSI import DaskExecutorFactory
-from dask.distributed import WorkerPlugin, Worker, Client
+import sys
 
-from HH4b_parton_matching_config import spanet_model
+from HH4b_parton_matching_config import spanet_model, spanet_quantization
 
 
-class WorkerInferenceSessionPlugin(WorkerPlugin):
-    async def setup(self, worker: Worker):
-        import onnxruntime as ort
-
-        sess_options = ort.SessionOptions()
-
-        sess_options.graph_optimization_level = (
-            ort.GraphOptimizationLevel.ORT_ENABLE_ALL
-        )
-        sess_options.intra_op_num_threads = 1
-
-        session = ort.InferenceSession(
-            spanet_model, sess_options=sess_options, providers=["CPUExecutionProvider"]
-        )
-
-        worker.data["model_session"] = session
-
-
-# Create an instance of the plugin
-# inference_session_plugin = WorkerInferenceSessionPlugin()
-
-
-class OnnxExecutorFactory(DaskExecutorFactory):
-
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-
-    def setup(self):
-        super().setup()
-        # now setting up and registering the ONNX plugin
-        inference_session_plugin = WorkerInferenceSessionPlugin()
-        # Registering the session plugin
-        self.dask_client.register_worker_plugin(inference_session_plugin)
+sys.path.append("../../")
+from utils.onnx_executor import get_executor_factory as get_onnx_executor_factory
 
 
 def get_executor_factory(executor_name, **kwargs):
-    return OnnxExecutorFactory(**kwargs)
+    # the models of the config, unless the run options define other ones
+    kwargs["run_options"].setdefault("spanet-models", spanet_model)
+    kwargs["run_options"].setdefault("spanet-quantization", spanet_quantization)
+    return get_onnx_executor_factory(executor_name, **kwargs)
@@ -1,6 +1,6 @@
 import awkward as ak
-from dask.distributed import get_worker
 import sys
+import time
 
 from pocket_coffea.workflows.base import BaseProcessorABC
 from pocket_coffea.lib.deltaR_matching import object_matching
@@ -9,9 +9,42 @@ from custom_cut_functions import *
 from custom_cuts import *
 
 sys.path.append("../../")
-from utils.parton_matching_function import get_parton_last_copy
-from utils.spanet_evaluation_functions import get_pairing_information, get_best_pairings
-from utils.basic_functions import add_fields
+from utils.parton_matching_function import FlatGenParticles, gather_genpart_copies
+from utils.spanet_evaluation_functions import (
+    get_pairing_information,
+    get_best_pairings,
+    get_pairings_pipelined,
+    get_spanet_models,
+    tagged_field,
+    build_padded_features,
+    get_feature_buffers,
+    SPANET_INPUT_FIELDS,
+    SPANET_INPUT_TRANSFORMS,
+    SPANET_INPUT_VERSION,
+)
+from utils.spanet_cache import (
+    spanet_cache_key,
+    load_cached_pairings,
+    save_cached_pairings,
+)
+from utils.timing import StageTiming, record_timing
+from utils.spanet_quantization import resolve_spanet_model
+from utils.inference_session import (
+    get_inference_session,
+    get_session_registry_stats,
+    set_numba_num_threads,
+)
+from utils.jet_regression import get_pnet_regression, with_pnet_regression
+from utils.fourvec import (
+    PTETAPHIM_FIELDS,
+    cos_theta_collins_soper,
+    cos_theta_in_rest_frame,
+    delta_r,
+    get_ptetaphim,
+    pair_variables,
+    pairwise_delta_r,
+    zip_ptetaphim,
+)
 from utils.reconstruct_higgs_candidates import (
     reconstruct_higgs_from_provenance,
     reconstruct_higgs_from_idx,
@@ -27,32 +60,133 @@ class HH4bbQuarkMatchingProcessor(BaseProcessorABC):
         self.fifth_jet = self.workflow_options["fifth_jet"]
         self.tight_cuts = self.workflow_options["tight_cuts"]
         self.classification = self.workflow_options["classification"]
-        self.spanet_model = self.workflow_options["spanet_model"]
+        # a model, or a list/dict of models evaluated on the same input tensor,
+        # each one in its full-precision or quantized variant
+        self.spanet_models = {
+            tag: resolve_spanet_model(
+                spanet_model, self.workflow_options.get("spanet_quantization", None)
+            )
+            for tag, spanet_model in get_spanet_models(
+                self.workflow_options["spanet_model"]
+            ).items()
+        }
+        self.spanet_model = next(iter(self.spanet_models.values()), None)
+        # attributes of ort.SessionOptions, the same as in the dask worker plugin
+        self.spanet_session_options = self.workflow_options.get(
+            "spanet_session_options", None
+        ) or {}
+        # micro-batching of the SPANet inference, to bound the memory of the workers
+        self.inference_batch_size = self.workflow_options.get(
+            "inference_batch_size", None
+        )
+        self.max_inference_memory = self.workflow_options.get(
+            "max_inference_memory", None
+        )
+        # directory of the on-disk cache of the SPANet predictions, None to disable it
+        self.spanet_cache_dir = self.workflow_options.get("spanet_cache_dir", None)
+        # overlap the feature build and the pairing extraction with the inference
+        self.pipelined_inference = self.workflow_options.get(
+            "pipelined_inference", False
+        )
+
+    def get_spanet_pairings(self, variation):
+        """
+        Evaluate the SPANet models on the events of the chunk, or read their
+        predictions from the spanet_cache_dir when they were already computed.
+        The input tensor is built once and shared by all the models.
+
+        Parameters:
+        variation (str): systematic variation of the chunk, part of the cache key.
+
+        Returns:
+        dict: tag -> (pairing_predictions, best_pairing_probability,
+            second_best_pairing_probability) of each model, where
+            pairing_predictions are the (n_events, 2, 2) jet indices of the two
+            Higgs candidates.
+        """
+        pairings = {}
+        missing = {}
+        input_buffers = None
+        for tag, spanet_model in self.spanet_models.items():
+            cache_key = None
+            if self.spanet_cache_dir:
+                if input_buffers is None:
+                    input_buffers = get_feature_buffers(
+                        self.events.JetGood, SPANET_INPUT_FIELDS
+                    )
+                cache_key = spanet_cache_key(
+                    self.events.metadata,
+                    spanet_model,
+                    self.max_num_jets,
+                    SPANET_INPUT_VERSION,
+                    ak.to_numpy(self.events.event),
+                    variation,
+                    input_buffers,
+                )
+                pairings[tag] = load_cached_pairings(self.spanet_cache_dir, cache_key)
+            if pairings.get(tag) is None:
+                missing[tag] = (spanet_model, cache_key)
+        if not missing:
+            return pairings
+
+        timing = {}
+        inputs = None
+        if len(missing) > 1:
+            start = time.perf_counter()
+            inputs = build_padded_features(
+                self.events.JetGood,
+                SPANET_INPUT_FIELDS,
+                self.max_num_jets,
+                SPANET_INPUT_TRANSFORMS,
+            )
+            timing["feature_build"] = time.perf_counter() - start
+
+        for tag, (spanet_model, cache_key) in missing.items():
+            # the session is created once per process, and shared by the chunks
+            model_session = get_inference_session(
+                spanet_model, **self.spanet_session_options
+            )
+
+            # compute the pairing information using the spanet model
+            if self.pipelined_inference:
+                pairings[tag] = get_pairings_pipelined(
+                    model_session,
+                    self.events,
+                    self.max_num_jets,
+                    batch_size=self.inference_batch_size,
+                    max_memory=self.max_inference_memory,
+                    timing=timing,
+                    inputs=inputs,
+                )
+            else:
+                assignment_probability, _ = get_pairing_information(
+                    model_session,
+                    self.events,
+                    self.max_num_jets,
+                    batch_size=self.inference_batch_size,
+                    max_memory=self.max_inference_memory,
+                    timing=timing,
+                    inputs=inputs,
+                )
+                start = time.perf_counter()
+                pairings[tag] = get_best_pairings(assignment_probability)
+                timing["pairing"] = (
+                    timing.get("pairing", 0.0) + time.perf_counter() - start
+                )
+
+            if self.spanet_cache_dir:
+                save_cached_pairings(self.spanet_cache_dir, cache_key, *pairings[tag])
+        self.timing.add(timing)
+        # sessions created by the process since the previous chunk, including the
+        # ones of the worker plugin, so that the sum over the chunks is the total
+        self.output["inference_sessions"] = get_session_registry_stats(reset=True)
+
+        return pairings
 
     def apply_object_preselection(self, variation):
-        self.events["Jet"] = ak.with_field(
-            self.events.Jet,
-            ak.where(
-                self.events.Jet.PNetRegPtRawCorr > 0,
-                self.events.Jet.pt
-                * (1 - self.events.Jet.rawFactor)
-                * self.events.Jet.PNetRegPtRawCorr
-                * self.events.Jet.PNetRegPtRawCorrNeutrino,
-                self.events.Jet.pt,
-            ),
-            "pt",
-        )
-        self.events["Jet"] = ak.with_field(
-            self.events.Jet,
-            ak.where(
-                self.events.Jet.PNetRegPtRawCorr > 0,
-                self.events.Jet.mass
-                * (1 - self.events.Jet.rawFactor)
-                * self.events.Jet.PNetRegPtRawCorr
-                * self.events.Jet.PNetRegPtRawCorrNeutrino,
-                self.events.Jet.mass,
-            ),
-            "mass",
+        # PNet-regressed pt and mass, with neutrinos, for the jets with a regression
+        self.events["Jet"] = with_pnet_regression(
+            self.events.Jet, get_pnet_regression(self.events.Jet)
         )
         self.events["JetGood"] = jet_selection_nopu(
             self.events, "Jet", self.params, tight_cuts=self.tight_cuts
@@ -79,6 +213,15 @@ class HH4bbQuarkMatchingProcessor(BaseProcessorABC):
                 (self.events["JetGoodHiggs"], self.events["JetGoodNoHiggsPt"]), axis=1
             )
 
+    def get_flat_genparticles(self):
+        # built once per chunk, shared by the b-quark and VBF-quark matching
+        if self.flat_genparticles is None:
+            with self.timing.stage("genpart_copy_tables"):
+                self.flat_genparticles = FlatGenParticles(self.events.GenPart)
+                # all the matching functions using the buffers need the copy tables
+                self.flat_genparticles.copy_tables
+        return self.flat_genparticles
+
     def get_jet_higgs_provenance(self, which_bquark):  # -> ak.Array:
         # Select b-quarks at Gen level, coming from H->bb decay
         self.events.GenPart = ak.with_field(
@@ -104,63 +247,22 @@ class HH4bbQuarkMatchingProcessor(BaseProcessorABC):
                 bquarks_from_higgs.genPartIdxMother == higgs.index[:, 0], 1, 2
             )
 
-            # define variables to get the last copy
-            children_idxG = ak.without_parameters(genpart.childrenIdxG, behavior={})
-            children_idxG_flat = ak.flatten(children_idxG, axis=1)
-            genpart_pdgId_flat = ak.flatten(
-                ak.without_parameters(genpart.pdgId, behavior={}), axis=1
-            )
-            genpart_LastCopy_flat = ak.flatten(
-                ak.without_parameters(genpart.hasFlags(["isLastCopy"]), behavior={}),
-                axis=1,
-            )
-            genpart_pt_flat = ak.flatten(
-                ak.without_parameters(genpart.pt, behavior={}), axis=1
-            )
-            genparts_flat = ak.flatten(genpart)
-            genpart_offsets = np.concatenate(
-                [
-                    [0],
-                    np.cumsum(ak.to_numpy(ak.num(genpart, axis=1), allow_missing=True)),
-                ]
-            )
-            b_quark_idx = ak.to_numpy(
-                bquarks_from_higgs.index + genpart_offsets[:-1], allow_missing=False
-            )
-            b_quarks_pdgId = ak.to_numpy(bquarks_from_higgs.pdgId, allow_missing=False)
-            nevents = b_quark_idx.shape[0]
-            firstgenpart_idxG = ak.firsts(genpart[:, 0].children).genPartIdxMotherG
-            firstgenpart_idxG_numpy = ak.to_numpy(
-                firstgenpart_idxG, allow_missing=False
-            )
-
-            b_quark_last_idx = get_parton_last_copy(
-                b_quark_idx,
-                b_quarks_pdgId,
-                children_idxG_flat,
-                genpart_pdgId_flat,
-                genpart_offsets,
-                genpart_LastCopy_flat,
-                genpart_pt_flat,
-                nevents,
-                firstgenpart_idxG_numpy,
-            )
-            bquarks = genparts_flat[b_quark_last_idx]
+            # last copy of the b-quarks from the table of the chunk
+            flat_genparts = self.get_flat_genparticles()
+            last_copy, _ = flat_genparts.copy_tables
+            bquarks = flat_genparts.genparts_flat[
+                last_copy[flat_genparts.flat_index(bquarks_from_higgs)]
+            ]
 
         elif which_bquark == "last":
             bquarks = genpart[isB & isLast & isHard]
-            bquarks_first = bquarks
-            while True:
-                b_mother = genpart[bquarks_first.genPartIdxMother]
-                mask_mother = (abs(b_mother.pdgId) == 5) | ((b_mother.pdgId) == 25)
-                bquarks = bquarks[mask_mother]
-                bquarks_first = bquarks_first[mask_mother]
-                b_mother = b_mother[mask_mother]
-                if ak.all((b_mother.pdgId) == 25):
-                    break
-                bquarks_first = ak.where(
-                    abs(b_mother.pdgId) == 5, b_mother, bquarks_first
-                )
+            flat_genparts = self.get_flat_genparticles()
+            _, first_copy = flat_genparts.copy_tables
+            bquarks_first = gather_genpart_copies(flat_genparts, bquarks, first_copy)
+            # keep the b-quarks whose first copy comes from a Higgs
+            from_higgs = genpart[bquarks_first.genPartIdxMother].pdgId == 25
+            bquarks = bquarks[from_higgs]
+            bquarks_first = bquarks_first[from_higgs]
             provenance = ak.where(
                 bquarks_first.genPartIdxMother == higgs.index[:, 0], 1, 2
             )
@@ -248,9 +350,115 @@ class HH4bbQuarkMatchingProcessor(BaseProcessorABC):
         self.events["nJetGood"] = ak.num(self.events.JetGood, axis=1)
         self.events["nJetGoodHiggs"] = ak.num(self.events.JetGoodHiggs, axis=1)
 
+    def fill_higgs_candidates(
+        self,
+        tags,
+        pairing_predictions,
+        best_pairing_probability,
+        second_best_pairing_probability,
+    ):
+        """
+        Fill the pairing probabilities and the Higgs candidates of a SPANet model.
+
+        Parameters:
+        tags (list): the fields are stored as tagged_field(name, tag) for each tag.
+        pairing_predictions (numpy.ndarray): (n_events, 2, 2) jet indices of the
+            two Higgs candidates.
+        best_pairing_probability (numpy.ndarray): best pairing probability.
+        second_best_pairing_probability (numpy.ndarray): second best pairing probability.
+        """
+        # get the probabilities difference between the best and second best jet assignment
+        Delta_pairing_probabilities = (
+            best_pairing_probability - second_best_pairing_probability
+        )
+
+        # Leading-pT H candidate pT , η, φ, and mass
+        # Subleading-pT H candidate pT , η, φ, and mass
+        (
+            HiggsLeading,
+            HiggsSubLeading,
+            JetGoodFromHiggsOrdered,
+        ) = reconstruct_higgs_from_idx(self.events.JetGood, pairing_predictions)
+
+        # the variables are computed on the flat arrays and zipped at the end
+        higgs_leading = get_ptetaphim(HiggsLeading)
+        higgs_subleading = get_ptetaphim(HiggsSubLeading)
+        jets = tuple(
+            ak.to_numpy(JetGoodFromHiggsOrdered[field]) for field in PTETAPHIM_FIELDS
+        )
+        _, jets_eta, jets_phi, _ = jets
+
+        # di-Higgs system, with the cos θ of the candidates and the angular
+        # separation (∆R, ∆η, ∆φ) between them
+        # pT , η, and mass of HH system
+        hh, hh_angles = pair_variables(higgs_leading, higgs_subleading)
+
+        # Angular separation (∆R) between b jets for each H candidate
+        # helicity | cos θ | for each H candidate: cos θ of its leading jet in
+        # the rest frame of the candidate
+        # (the lab-frame cos_theta is kept for the existing DNN inputs)
+        HiggsLeading = zip_ptetaphim(
+            higgs_leading,
+            dR=delta_r(jets_eta[:, 0], jets_phi[:, 0], jets_eta[:, 1], jets_phi[:, 1]),
+            cos_theta=abs(hh_angles["cos_theta_1"]),
+            helicity_cos_theta=abs(
+                cos_theta_in_rest_frame(
+                    higgs_leading, tuple(values[:, 0] for values in jets)
+                )
+            ),
+        )
+        HiggsSubLeading = zip_ptetaphim(
+            higgs_subleading,
+            dR=delta_r(jets_eta[:, 2], jets_phi[:, 2], jets_eta[:, 3], jets_phi[:, 3]),
+            cos_theta=abs(hh_angles["cos_theta_2"]),
+            helicity_cos_theta=abs(
+                cos_theta_in_rest_frame(
+                    higgs_subleading, tuple(values[:, 2] for values in jets)
+                )
+            ),
+        )
+
+        # | cos θ ∗ | of HH system: cos θ of the leading H candidate in the
+        # Collins-Soper frame of HH, and the lab-frame cos θ of HH for the existing
+        # DNN inputs
+        HH = zip_ptetaphim(
+            hh,
+            cos_theta_star=abs(hh_angles["cos_theta"]),
+            cos_theta_star_cs=abs(
+                cos_theta_collins_soper(higgs_leading, higgs_subleading)
+            ),
+            dR=hh_angles["dR"],
+            dEta=abs(hh_angles["dEta"]),
+            dPhi=hh_angles["dPhi"],
+        )
+
+        for tag in tags:
+            self.events[tagged_field("best_pairing_probability", tag)] = (
+                best_pairing_probability
+            )
+            self.events[tagged_field("second_best_pairing_probability", tag)] = (
+                second_best_pairing_probability
+            )
+            self.events[tagged_field("Delta_pairing_probabilities", tag)] = (
+                Delta_pairing_probabilities
+            )
+            self.events[tagged_field("HiggsLeading", tag)] = HiggsLeading
+            self.events[tagged_field("HiggsSubLeading", tag)] = HiggsSubLeading
+            self.events[tagged_field("JetGoodFromHiggsOrdered", tag)] = (
+                JetGoodFromHiggsOrdered
+            )
+            self.events[tagged_field("HH", tag)] = HH
+
     def process_extra_after_presel(self, variation):  # -> ak.Array:
+        # the numba threads are per thread, so they are set by the one running the chunk
+        set_numba_num_threads()
+        # wall time, CPU time and peak RSS of the stages, stored in the output
+        self.timing = StageTiming()
+        self.flat_genparticles = None
+
         if self._isMC and not self.classification:
-            self.get_jet_higgs_provenance(which_bquark=self.which_bquark)
+            with self.timing.stage("parton_matching"):
+                self.get_jet_higgs_provenance(which_bquark=self.which_bquark)
             # NOTE:  ak.num counts even the None values, while ak.count counts only the non-None values
 
             self.events["nbQuarkHiggsMatched"] = ak.num(
@@ -259,65 +467,16 @@ class HH4bbQuarkMatchingProcessor(BaseProcessorABC):
             self.events["nbQuarkMatched"] = ak.num(self.events.bQuarkMatched, axis=1)
 
             # reconstruct the higgs candidates
-            (
-                self.events["HiggsLeading"],
-                self.events["HiggsSubLeading"],
-                self.events["JetGoodFromHiggsOrdered"],
-            ) = reconstruct_higgs_from_provenance(self.events.JetGoodHiggsMatched)
+            with self.timing.stage("higgs_reconstruction"):
+                (
+                    self.events["HiggsLeading"],
+                    self.events["HiggsSubLeading"],
+                    self.events["JetGoodFromHiggsOrdered"],
+                ) = reconstruct_higgs_from_provenance(self.events.JetGoodHiggsMatched)
 
         elif self.classification:
             self.dummy_provenance()
 
-            try:
-                worker = get_worker()
-                # print("found worker", worker)
-            except ValueError:
-                worker = None
-                # print("     >>>>>>>>>>   NOT found worker", worker)
-
-            if worker is None:
-                import onnxruntime as ort
-
-                sess_options = ort.SessionOptions()
-                sess_options.graph_optimization_level = (
-                    ort.GraphOptimizationLevel.ORT_ENABLE_ALL
-                )
-                model_session = ort.InferenceSession(
-                    self.spanet_model,
-                    sess_options=sess_options,
-                    providers=["CPUExecutionProvider"],
-                )
-                # input_name = [input.name for input in model_session.get_inputs()]
-                # output_name = [output.name for output in model_session.get_outputs()]
-                # print("     >>>>>>>>>>   initialize new worker", worker)
-            else:
-                model_session = worker.data["model_session"]
-                # input_name = worker.data['input_name']
-                # output_name = worker.data['output_name']
-                # print("get info from old worker", worker)
-
-            input_name = [input.name for input in model_session.get_inputs()]
-            output_name = [output.name for output in model_session.get_outputs()]
-            # print(model_session)
-
-            # compute the pairing information using the spanet model
-            outputs = get_pairing_information(
-                model_session, input_name, output_name, self.events, self.max_num_jets
-            )
-
-            (
-                pairing_predictions,
-                self.events["best_pairing_probability"],
-                self.events["second_best_pairing_probability"],
-            ) = get_best_pairings(outputs)
-
-            # get the probabilities difference between the best and second best jet assignment
-            self.events["Delta_pairing_probabilities"] = (
-                self.events.best_pairing_probability
-                - self.events.second_best_pairing_probability
-            )
-            # print("\nDelta_pairing_probabilities", self.events["Delta_pairing_probabilities"])
-
             ########################
             # ADDITIONAL VARIABLES #
             ########################
@@ -327,88 +486,21 @@ class HH4bbQuarkMatchingProcessor(BaseProcessorABC):
 
             # Minimum ∆R ( jj ) among all possible pairings of the leading b-tagged jets
             # Maximum ∆R( jj ) among all possible pairings of the leading b-tagged jets
-            _, JetGood2 = ak.unzip(
-                ak.cartesian(
-                    [
-                        self.events.JetGood[:, : self.max_num_jets],
-                        self.events.JetGood[:, : self.max_num_jets],
-                    ],
-                    nested=True,
-                )
-            )
-            dR = self.events.JetGood[:, : self.max_num_jets].delta_r(JetGood2)
-            # remove dR between the same jets
-            dR = ak.mask(dR, dR > 0)
-            # flatten the last 2 dimension of the dR array  to get an array for each event
-            dR = ak.flatten(dR, axis=2)
-            self.events["dR_min"] = ak.min(dR, axis=1)
-            self.events["dR_max"] = ak.max(dR, axis=1)
-
-            # Leading-pT H candidate pT , η, φ, and mass
-            # Subleading-pT H candidate pT , η, φ, and mass
-            (
-                self.events["HiggsLeading"],
-                self.events["HiggsSubLeading"],
-                self.events["JetGoodFromHiggsOrdered"],
-            ) = reconstruct_higgs_from_idx(self.events.JetGood, pairing_predictions)
-
-            # Angular separation (∆R) between b jets for each H candidate
-            self.events["HiggsLeading"] = ak.with_field(
-                self.events.HiggsLeading,
-                self.events["JetGoodFromHiggsOrdered"][:, 0].delta_r(
-                    self.events["JetGoodFromHiggsOrdered"][:, 1]
-                ),
-                "dR",
-            )
-            self.events["HiggsSubLeading"] = ak.with_field(
-                self.events.HiggsSubLeading,
-                self.events["JetGoodFromHiggsOrdered"][:, 2].delta_r(
-                    self.events["JetGoodFromHiggsOrdered"][:, 3]
-                ),
-                "dR",
-            )
-
-            # TODO change the definition
-            # helicity | cos θ | for each H candidate
-            self.events["HiggsLeading"] = ak.with_field(
-                self.events.HiggsLeading,
-                abs(np.cos(self.events.HiggsLeading.theta)),
-                "cos_theta",
-            )
-            self.events["HiggsSubLeading"] = ak.with_field(
-                self.events.HiggsSubLeading,
-                abs(np.cos(self.events.HiggsSubLeading.theta)),
-                "cos_theta",
-            )
-
-            # di-Higgs system
-            # pT , η, and mass of HH system
-            self.events["HH"] = add_fields(
-                self.events.HiggsLeading + self.events.HiggsSubLeading
-            )
-
-            # TODO change the definition
-            # | cos θ ∗ | of HH system
-            self.events["HH"] = ak.with_field(
-                self.events.HH, abs(np.cos(self.events.HH.theta)), "cos_theta_star"
-            )
-
-            # Angular separation (∆R, ∆η, ∆φ) between H candidates
-            self.events["HH"] = ak.with_field(
-                self.events.HH,
-                self.events.HiggsLeading.delta_r(self.events.HiggsSubLeading),
-                "dR",
-            )
-            self.events["HH"] = ak.with_field(
-                self.events.HH,
-                abs(self.events.HiggsLeading.eta - self.events.HiggsSubLeading.eta),
-                "dEta",
-            )
-            self.events["HH"] = ak.with_field(
-                self.events.HH,
-                self.events.HiggsLeading.delta_phi(self.events.HiggsSubLeading),
-                "dPhi",
+            # over the unique pairs, read from the jet arrays without building them
+            dR = pairwise_delta_r(
+                self.events.JetGood.eta, self.events.JetGood.phi, self.max_num_jets
             )
+            self.events["dR_min"] = dR["min"]
+            self.events["dR_max"] = dR["max"]
+
+            # the first model fills the fields without tag, and with several
+            # models each one also fills its own <field>_<tag> fields
+            with self.timing.stage("spanet"):
+                spanet_pairings = self.get_spanet_pairings(variation)
+            for i, (tag, pairings) in enumerate(spanet_pairings.items()):
+                tags = [tag] if i > 0 or not tag else ["", tag]
+                with self.timing.stage("higgs_reconstruction"):
+                    self.fill_higgs_candidates(tags, *pairings)
 
         else:
             self.dummy_provenance()
@@ -418,22 +510,5 @@ class HH4bbQuarkMatchingProcessor(BaseProcessorABC):
         )
         self.events["nJetGoodMatched"] = ak.num(self.events.JetGoodMatched, axis=1)
 
+        record_timing(self.output, self._dataset, self.timing)
 
-# TODO:
-# NEW THETA ANGLE DEFINITION
-
-# float HelicityCosTheta(TLorentzVector Booster, TLorentzVector Boosted)
-# {
-#     TVector3 BoostVector = Booster.BoostVector();
-#     Boosted.Boost( -BoostVector.x(), -BoostVector.y(), -BoostVector.z() );
-#     return Boosted.CosTheta();
-# }
-
-# higgs1_helicityCosTheta =fabs(HelicityCosTheta( leadingHiggsCands.at(best_pairing_index)  ,  leading_higgs_leading_jet ));
-# higgs2_helicityCosTheta =fabs(HelicityCosTheta( subleadingHiggsCands.at(best_pairing_index), subleading_higgs_leading_jet ));
-
-# //Costhetastar in CS frame
-# TLorentzVector higgs1_vec;
-# higgs1_vec =  leadingHiggsCands.at(best_pairing_index);
-# higgs1_vec.Boost( - hh_vec.BoostVector());
-# hh_CosThetaStar_CS = fabs(higgs1_vec.CosTheta());
@@ -34,6 +34,11 @@ parameters = defaults.merge_parameters_from_files(
 SPANET_MODEL = (
     "params/out_hh4b_5jets_ATLAS_ptreg_c0_lr1e4_wp0_noklininp_oc_300e_kl3p5.onnx"
 )
+# None, "int8_dynamic", "int8_static" or "fp16", see utils/spanet_quantization.py
+SPANET_QUANTIZATION = None
+# attributes of ort.SessionOptions of the SPANet sessions, None for the ones sized
+# by utils/onnx_executor.py from the cores of the worker
+SPANET_SESSION_OPTIONS = None
 HIGGS_PARTON_MATCHING=False
 VBF_PARTON_MATCHING = False
 
@@ -95,7 +100,16 @@ cfg = Configurator(
         "max_num_jets": 5,
         "which_bquark": "last",
         "spanet_model": SPANET_MODEL if not HIGGS_PARTON_MATCHING else None,
+        "spanet_quantization": SPANET_QUANTIZATION,
+        "spanet_session_options": SPANET_SESSION_OPTIONS,
         "vbf_parton_matching": VBF_PARTON_MATCHING,
+        # events per session.run call and memory ceiling of the SPANet inference
+        "inference_batch_size": None,
+        "max_inference_memory": None,  # e.g. "2GB"
+        # directory of the on-disk cache of the SPANet predictions, None to disable it
+        "spanet_cache_dir": None,
+        # overlap the feature build and the pairing extraction with the inference
+        "pipelined_inference": False,
     },
     skim=[
         get_HLTsel(primaryDatasets=["JetMET"]),
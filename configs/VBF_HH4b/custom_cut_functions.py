@@ -1,66 +1,103 @@
 from collections.abc import Iterable
+import weakref
+
 import awkward as ak
+import numpy as np
 from vbf_matching import mask_efficiency
 
 
-def vbf_hh4b_presel_cuts(events, params, **kwargs):
-
-    at_least_four_jetgood = events.nJetGood >= params["njetgood"]
-    at_least_six_jetvbf = events.nJetVBF_generalSelection >= params["njetvbf"]  # HERE
-    no_electron = events.nElectronGood == 0
-    no_muon = events.nMuonGood == 0
-
-    mask_6jet_nolep = at_least_four_jetgood & no_electron & no_muon & at_least_six_jetvbf
-
-    # convert false to None
-    mask_6jet_nolep_none = ak.mask(mask_6jet_nolep, mask_6jet_nolep)
-    jets_btag_order = events[mask_6jet_nolep_none].JetGood  # HERE_OLD_CUTS JetGoodHiggs
+def _first_jets(values, num_jets=4):
+    # (n, num_jets) numpy array of the first values of each event, nan if missing,
+    # so that all the comparisons with the missing jets are False
+    return np.ma.filled(
+        ak.to_numpy(ak.pad_none(values, num_jets, axis=1, clip=True)), np.nan
+    )
 
-    jets_pt_order = jets_btag_order[
-        ak.argsort(jets_btag_order.pt, axis=1, ascending=False)
-    ]
 
-    mask_pt_none = (
-        (jets_pt_order.pt[:, 0] > params["pt_jet0"])
-        & (jets_pt_order.pt[:, 1] > params["pt_jet1"])
-        & (jets_pt_order.pt[:, 2] > params["pt_jet2"])
-        & (jets_pt_order.pt[:, 3] > params["pt_jet3"])
+def _get_cut_memo(events):
+    # The memo is stored in the attrs of the events, and is recomputed when the
+    # events are filtered or a field is added, which replaces their layout.
+    memo = events.attrs.get("@jet_cut_cache")
+    if memo is None or memo["layout"]() is not events.layout:
+        memo = {"layout": weakref.ref(events.layout)}
+        events.attrs["@jet_cut_cache"] = memo
+    return memo
+
+
+def get_lepton_veto(events):
+    """
+    (n,) bool array of the events without good electrons and muons, computed once
+    per chunk and shared by all the cut functions evaluated on the same events.
+    """
+    memo = _get_cut_memo(events)
+    if "lepton_veto" not in memo:
+        mask = (events.nElectronGood == 0) & (events.nMuonGood == 0)
+        memo["lepton_veto"] = ak.to_numpy(ak.fill_none(mask, False))
+    return memo["lepton_veto"]
+
+
+def get_jet_cut_cache(events, collection):
+    """
+    Variables of the jet cuts, computed once per chunk and shared by all the cut
+    functions and categories evaluated on the same events.
+
+    Parameters:
+    events (ak.Array): events of the chunk.
+    collection (str): jet collection, e.g. JetGood or JetGoodHiggs, ordered by b-tag.
+
+    Returns:
+    dict: "pt_sorted" (n, 4) pt of the four leading-pt jets of the collection in
+        decreasing order and "btag" (n, 4) btagPNetB of its first four jets, nan
+        for the missing jets.
+    """
+    memo = _get_cut_memo(events)
+    if collection not in memo:
+        jets = events[collection]
+        memo[collection] = {
+            "pt_sorted": _first_jets(ak.sort(jets.pt, axis=1, ascending=False)),
+            "btag": _first_jets(jets.btagPNetB),
+        }
+    return memo[collection]
+
+
+def _jets_pt_mask(pt_sorted, params):
+    return (
+        (pt_sorted[:, 0] > params["pt_jet0"])
+        & (pt_sorted[:, 1] > params["pt_jet1"])
+        & (pt_sorted[:, 2] > params["pt_jet2"])
+        & (pt_sorted[:, 3] > params["pt_jet3"])
     )
-    # convert none to false
-    mask_pt = ak.where(ak.is_none(mask_pt_none), False, mask_pt_none)
 
-    mask_btag = (
-        jets_btag_order.btagPNetB[:, 0] + jets_btag_order.btagPNetB[:, 1]
-    ) / 2 > params["mean_pnet_jet"]
 
-    mask_btag = ak.where(ak.is_none(mask_btag), False, mask_btag)
+def _mean_btag_mask(btag, params):
+    return (btag[:, 0] + btag[:, 1]) / 2 > params["mean_pnet_jet"]
 
-    mask = mask_pt & mask_btag
 
-    # Pad None values with False
-    return ak.where(ak.is_none(mask), False, mask)
+def vbf_hh4b_presel_cuts(events, params, **kwargs):
+    cache = get_jet_cut_cache(events, "JetGood")  # HERE_OLD_CUTS JetGoodHiggs
+    at_least_four_jetgood = events.nJetGood >= params["njetgood"]
+    at_least_six_jetvbf = events.nJetVBF_generalSelection >= params["njetvbf"]  # HERE
+    return (
+        ak.to_numpy(ak.fill_none(at_least_four_jetgood & at_least_six_jetvbf, False))
+        & get_lepton_veto(events)
+        & _jets_pt_mask(cache["pt_sorted"], params)
+        & _mean_btag_mask(cache["btag"], params)
+    )
 
 
 def hh4b_2b_cuts(events, params, **kwargs):
-    jets_btag_order = events.JetGoodHiggs
-
-    mask = (jets_btag_order.btagPNetB[:, 2] < params["third_pnet_jet"]) & (
-        jets_btag_order.btagPNetB[:, 3] < params["fourth_pnet_jet"]
+    btag = get_jet_cut_cache(events, "JetGoodHiggs")["btag"]
+    return (btag[:, 2] < params["third_pnet_jet"]) & (
+        btag[:, 3] < params["fourth_pnet_jet"]
     )
 
-    # Pad None values with False
-    return ak.where(ak.is_none(mask), False, mask)
-
 
 def hh4b_4b_cuts(events, params, **kwargs):
-    jets_btag_order = events.JetGoodHiggs
-
-    mask = (jets_btag_order.btagPNetB[:, 2] > params["third_pnet_jet"]) & (
-        jets_btag_order.btagPNetB[:, 3] > params["fourth_pnet_jet"]
+    btag = get_jet_cut_cache(events, "JetGoodHiggs")["btag"]
+    return (btag[:, 2] > params["third_pnet_jet"]) & (
+        btag[:, 3] > params["fourth_pnet_jet"]
     )
 
-    # Pad None values with False
-    return ak.where(ak.is_none(mask), False, mask)
 
 def semiTight_leadingPt(events, params, **kwargs):
     mask_mjj = (events.JetVBFLeadingPtNotFromHiggs_jjMass > params['mjj'])
@@ -1,6 +1,6 @@
 import awkward as ak
-from dask.distributed import get_worker
 import sys
+import time
 import numpy as np
 
 from pocket_coffea.workflows.base import BaseProcessorABC
@@ -10,9 +10,34 @@ from custom_cut_functions import *
 from custom_cuts import *
 
 sys.path.append("../../")
-from utils.parton_matching_function import get_parton_last_copy
-from utils.spanet_evaluation_functions import get_pairing_information, get_best_pairings
+from utils.parton_matching_function import FlatGenParticles, gather_genpart_copies
+from utils.spanet_evaluation_functions import (
+    get_pairing_information,
+    get_best_pairings,
+    get_pairings_pipelined,
+    get_spanet_models,
+    tagged_field,
+    build_padded_features,
+    get_feature_buffers,
+    SPANET_INPUT_FIELDS,
+    SPANET_INPUT_TRANSFORMS,
+    SPANET_INPUT_VERSION,
+)
+from utils.spanet_cache import (
+    spanet_cache_key,
+    load_cached_pairings,
+    save_cached_pairings,
+)
 from utils.basic_functions import add_fields
+from utils.timing import StageTiming, record_timing
+from utils.spanet_quantization import resolve_spanet_model
+from utils.inference_session import (
+    get_inference_session,
+    get_session_registry_stats,
+    set_numba_num_threads,
+)
+from utils.jet_regression import get_pnet_regression, with_pnet_regression
+from utils.fourvec import add, delta_r_pairs, get_ptetaphim, zip_ptetaphim
 from utils.reconstruct_higgs_candidates import (
     reconstruct_higgs_from_provenance,
     reconstruct_higgs_from_idx,
@@ -26,54 +51,143 @@ class VBFHH4bbQuarkMatchingProcessor(BaseProcessorABC):
         self.dr_min = self.workflow_options["parton_jet_min_dR"]
         self.max_num_jets = self.workflow_options["max_num_jets"]
         self.which_bquark = self.workflow_options["which_bquark"]
-        self.spanet_model = self.workflow_options["spanet_model"]
+        # a model, or a list/dict of models evaluated on the same input tensor,
+        # each one in its full-precision or quantized variant
+        self.spanet_models = {
+            tag: resolve_spanet_model(
+                spanet_model, self.workflow_options.get("spanet_quantization", None)
+            )
+            for tag, spanet_model in get_spanet_models(
+                self.workflow_options["spanet_model"]
+            ).items()
+        }
+        self.spanet_model = next(iter(self.spanet_models.values()), None)
+        # attributes of ort.SessionOptions, the same as in the dask worker plugin
+        self.spanet_session_options = self.workflow_options.get(
+            "spanet_session_options", None
+        ) or {}
         self.vbf_parton_matching = self.workflow_options["vbf_parton_matching"]
+        # micro-batching of the SPANet inference, to bound the memory of the workers
+        self.inference_batch_size = self.workflow_options.get(
+            "inference_batch_size", None
+        )
+        self.max_inference_memory = self.workflow_options.get(
+            "max_inference_memory", None
+        )
+        # directory of the on-disk cache of the SPANet predictions, None to disable it
+        self.spanet_cache_dir = self.workflow_options.get("spanet_cache_dir", None)
+        # overlap the feature build and the pairing extraction with the inference
+        self.pipelined_inference = self.workflow_options.get(
+            "pipelined_inference", False
+        )
+
+    def get_spanet_pairings(self, variation):
+        """
+        Evaluate the SPANet models on the events of the chunk, or read their
+        predictions from the spanet_cache_dir when they were already computed.
+        The input tensor is built once and shared by all the models.
+
+        Parameters:
+        variation (str): systematic variation of the chunk, part of the cache key.
+
+        Returns:
+        dict: tag -> (pairing_predictions, best_pairing_probability,
+            second_best_pairing_probability) of each model, where
+            pairing_predictions are the (n_events, 2, 2) jet indices of the two
+            Higgs candidates.
+        """
+        pairings = {}
+        missing = {}
+        input_buffers = None
+        for tag, spanet_model in self.spanet_models.items():
+            cache_key = None
+            if self.spanet_cache_dir:
+                if input_buffers is None:
+                    input_buffers = get_feature_buffers(
+                        self.events.JetGood, SPANET_INPUT_FIELDS
+                    )
+                cache_key = spanet_cache_key(
+                    self.events.metadata,
+                    spanet_model,
+                    self.max_num_jets,
+                    SPANET_INPUT_VERSION,
+                    ak.to_numpy(self.events.event),
+                    variation,
+                    input_buffers,
+                )
+                pairings[tag] = load_cached_pairings(self.spanet_cache_dir, cache_key)
+            if pairings.get(tag) is None:
+                missing[tag] = (spanet_model, cache_key)
+        if not missing:
+            return pairings
+
+        timing = {}
+        inputs = None
+        if len(missing) > 1:
+            start = time.perf_counter()
+            inputs = build_padded_features(
+                self.events.JetGood,
+                SPANET_INPUT_FIELDS,
+                self.max_num_jets,
+                SPANET_INPUT_TRANSFORMS,
+            )
+            timing["feature_build"] = time.perf_counter() - start
+
+        for tag, (spanet_model, cache_key) in missing.items():
+            # the session is created once per process, and shared by the chunks
+            model_session = get_inference_session(
+                spanet_model, **self.spanet_session_options
+            )
+
+            # compute the pairing information using the spanet model
+            if self.pipelined_inference:
+                pairings[tag] = get_pairings_pipelined(
+                    model_session,
+                    self.events,
+                    self.max_num_jets,
+                    batch_size=self.inference_batch_size,
+                    max_memory=self.max_inference_memory,
+                    timing=timing,
+                    inputs=inputs,
+                )
+            else:
+                assignment_probability, _ = get_pairing_information(
+                    model_session,
+                    self.events,
+                    self.max_num_jets,
+                    batch_size=self.inference_batch_size,
+                    max_memory=self.max_inference_memory,
+                    timing=timing,
+                    inputs=inputs,
+                )
+                start = time.perf_counter()
+                pairings[tag] = get_best_pairings(assignment_probability)
+                timing["pairing"] = (
+                    timing.get("pairing", 0.0) + time.perf_counter() - start
+                )
+
+            if self.spanet_cache_dir:
+                save_cached_pairings(self.spanet_cache_dir, cache_key, *pairings[tag])
+        self.timing.add(timing)
+        # sessions created by the process since the previous chunk, including the
+        # ones of the worker plugin, so that the sum over the chunks is the total
+        self.output["inference_sessions"] = get_session_registry_stats(reset=True)
+
+        return pairings
 
     def apply_object_preselection(self, variation):
-        self.events["Jet"] = ak.with_field(
-            self.events.Jet,
-            ak.where(
-                self.events.Jet.PNetRegPtRawCorr > 0,
-                self.events.Jet.pt
-                * (1 - self.events.Jet.rawFactor)
-                * self.events.Jet.PNetRegPtRawCorr,
-                self.events.Jet.pt,
-            ),
-            "pt",
-        )
-        self.events["Jet"] = ak.with_field(
-            self.events.Jet,
-            ak.where(
-                self.events.Jet.PNetRegPtRawCorr > 0,
-                self.events.Jet.mass
-                * (1 - self.events.Jet.rawFactor)
-                * self.events.Jet.PNetRegPtRawCorr,
-                self.events.Jet.mass,
-            ),
-            "mass",
+        # PNet-regressed pt and mass of the jets, without neutrinos for the VBF jets
+        # and with neutrinos for the b jets
+        jet_regression = get_pnet_regression(self.events.Jet)
+        self.events["Jet"] = with_pnet_regression(
+            self.events.Jet, jet_regression, "PNetReg"
         )
         self.events["Jet"] = ak.with_field(
             self.events.Jet, ak.local_index(self.events.Jet, axis=1), "index"
         )
 
-        self.events["JetGood"] = self.events.Jet
-        self.events["JetGood"] = ak.with_field(
-            self.events.JetGood,
-            ak.where(
-                self.events.JetGood.PNetRegPtRawCorr > 0,
-                self.events.JetGood.pt * self.events.JetGood.PNetRegPtRawCorrNeutrino,
-                self.events.JetGood.pt,
-            ),
-            "pt",
-        )
-        self.events["JetGood"] = ak.with_field(
-            self.events.JetGood,
-            ak.where(
-                self.events.JetGood.PNetRegPtRawCorr > 0,
-                self.events.JetGood.mass * self.events.JetGood.PNetRegPtRawCorrNeutrino,
-                self.events.JetGood.mass,
-            ),
-            "mass",
+        self.events["JetGood"] = with_pnet_regression(
+            self.events.Jet, jet_regression, "PNetRegNeutrino"
         )
 
         self.events["JetGood"] = jet_selection_nopu(self.events, "JetGood", self.params)
@@ -108,6 +222,15 @@ class VBFHH4bbQuarkMatchingProcessor(BaseProcessorABC):
             ak.argsort(self.events.JetGoodHiggs.pt, axis=1, ascending=False)
         ]
 
+    def get_flat_genparticles(self):
+        # built once per chunk, shared by the b-quark and VBF-quark matching
+        if self.flat_genparticles is None:
+            with self.timing.stage("genpart_copy_tables"):
+                self.flat_genparticles = FlatGenParticles(self.events.GenPart)
+                # all the matching functions using the buffers need the copy tables
+                self.flat_genparticles.copy_tables
+        return self.flat_genparticles
+
     def get_jet_higgs_provenance(self, which_bquark):  # -> ak.Array:
         # Select b-quarks at Gen level, coming from H->bb decay
         self.events["GenPart"] = ak.with_field(
@@ -134,63 +257,22 @@ class VBFHH4bbQuarkMatchingProcessor(BaseProcessorABC):
                 bquarks_from_higgs.genPartIdxMother == higgs.index[:, 0], 1, 2
             )
 
-            # define variables to get the last copy
-            children_idxG = ak.without_parameters(genpart.childrenIdxG, behavior={})
-            children_idxG_flat = ak.flatten(children_idxG, axis=1)
-            genpart_pdgId_flat = ak.flatten(
-                ak.without_parameters(genpart.pdgId, behavior={}), axis=1
-            )
-            genpart_LastCopy_flat = ak.flatten(
-                ak.without_parameters(genpart.hasFlags(["isLastCopy"]), behavior={}),
-                axis=1,
-            )
-            genpart_pt_flat = ak.flatten(
-                ak.without_parameters(genpart.pt, behavior={}), axis=1
-            )
-            genparts_flat = ak.flatten(genpart)
-            genpart_offsets = np.concatenate(
-                [
-                    [0],
-                    np.cumsum(ak.to_numpy(ak.num(genpart, axis=1), allow_missing=True)),
-                ]
-            )
-            b_quark_idx = ak.to_numpy(
-                bquarks_from_higgs.index + genpart_offsets[:-1], allow_missing=False
-            )
-            b_quarks_pdgId = ak.to_numpy(bquarks_from_higgs.pdgId, allow_missing=False)
-            nevents = b_quark_idx.shape[0]
-            firstgenpart_idxG = ak.firsts(genpart[:, 0].children).genPartIdxMotherG
-            firstgenpart_idxG_numpy = ak.to_numpy(
-                firstgenpart_idxG, allow_missing=False
-            )
-
-            b_quark_last_idx = get_parton_last_copy(
-                b_quark_idx,
-                b_quarks_pdgId,
-                children_idxG_flat,
-                genpart_pdgId_flat,
-                genpart_offsets,
-                genpart_LastCopy_flat,
-                genpart_pt_flat,
-                nevents,
-                firstgenpart_idxG_numpy,
-            )
-            bquarks = genparts_flat[b_quark_last_idx]
+            # last copy of the b-quarks from the table of the chunk
+            flat_genparts = self.get_flat_genparticles()
+            last_copy, _ = flat_genparts.copy_tables
+            bquarks = flat_genparts.genparts_flat[
+                last_copy[flat_genparts.flat_index(bquarks_from_higgs)]
+            ]
 
         elif which_bquark == "last":
             bquarks = genpart[isB & isLast & isHard]
-            bquarks_first = bquarks
-            while True:
-                b_mother = genpart[bquarks_first.genPartIdxMother]
-                mask_mother = (abs(b_mother.pdgId) == 5) | ((b_mother.pdgId) == 25)
-                bquarks = bquarks[mask_mother]
-                bquarks_first = bquarks_first[mask_mother]
-                b_mother = b_mother[mask_mother]
-                if ak.all((b_mother.pdgId) == 25):
-                    break
-                bquarks_first = ak.where(
-                    abs(b_mother.pdgId) == 5, b_mother, bquarks_first
-                )
+            flat_genparts = self.get_flat_genparticles()
+            _, first_copy = flat_genparts.copy_tables
+            bquarks_first = gather_genpart_copies(flat_genparts, bquarks, first_copy)
+            # keep the b-quarks whose first copy comes from a Higgs
+            from_higgs = genpart[bquarks_first.genPartIdxMother].pdgId == 25
+            bquarks = bquarks[from_higgs]
+            bquarks_first = bquarks_first[from_higgs]
             provenance = ak.where(
                 bquarks_first.genPartIdxMother == higgs.index[:, 0], 1, 2
             )
@@ -279,42 +361,12 @@ class VBFHH4bbQuarkMatchingProcessor(BaseProcessorABC):
         )
         vbf_quarks = quarks[quarks_mother_children_isH]
 
-        children_idxG = ak.without_parameters(genpart.childrenIdxG, behavior={})
-        children_idxG_flat = ak.flatten(children_idxG, axis=1)
-        genpart_pdgId_flat = ak.flatten(
-            ak.without_parameters(genpart.pdgId, behavior={}), axis=1
-        )
-        genpart_LastCopy_flat = ak.flatten(
-            ak.without_parameters(genpart.hasFlags(["isLastCopy"]), behavior={}), axis=1
-        )
-        genpart_pt_flat = ak.flatten(
-            ak.without_parameters(genpart.pt, behavior={}), axis=1
-        )
-        genparts_flat = ak.flatten(genpart)
-        genpart_offsets = np.concatenate(
-            [[0], np.cumsum(ak.to_numpy(ak.num(genpart, axis=1), allow_missing=True))]
-        )
-        vbf_quark_idx = ak.to_numpy(
-            vbf_quarks.index + genpart_offsets[:-1], allow_missing=False
-        )
-        vbf_quarks_pdgId = ak.to_numpy(vbf_quarks.pdgId, allow_missing=False)
-        nevents = vbf_quark_idx.shape[0]
-        firstgenpart_idxG = ak.firsts(genpart[:, 0].children).genPartIdxMotherG
-        firstgenpart_idxG_numpy = ak.to_numpy(firstgenpart_idxG, allow_missing=False)
-
-        vbf_quark_last_idx = get_parton_last_copy(
-            vbf_quark_idx,
-            vbf_quarks_pdgId,
-            children_idxG_flat,
-            genpart_pdgId_flat,
-            genpart_offsets,
-            genpart_LastCopy_flat,
-            genpart_pt_flat,
-            nevents,
-            firstgenpart_idxG_numpy,
-        )
-
-        vbf_quark_last = genparts_flat[vbf_quark_last_idx]
+        # last copy of the VBF quarks from the table of the chunk
+        flat_genparts = self.get_flat_genparticles()
+        last_copy, _ = flat_genparts.copy_tables
+        vbf_quark_last = flat_genparts.genparts_flat[
+            last_copy[flat_genparts.flat_index(vbf_quarks)]
+        ]
 
         matched_vbf_quarks, matched_vbf_jets, deltaR_matched_vbf = object_matching(
             vbf_quark_last,
@@ -385,10 +437,17 @@ class VBFHH4bbQuarkMatchingProcessor(BaseProcessorABC):
         )
 
     def process_extra_after_presel(self, variation):  # -> ak.Array:
+        # the numba threads are per thread, so they are set by the one running the chunk
+        set_numba_num_threads()
+        # wall time, CPU time and peak RSS of the stages, stored in the output
+        self.timing = StageTiming()
+        self.flat_genparticles = None
+
         if self._isMC:
             if not self.spanet_model:
                 # do truth matching to get b-jet from Higgs
-                self.get_jet_higgs_provenance(which_bquark=self.which_bquark)
+                with self.timing.stage("parton_matching"):
+                    self.get_jet_higgs_provenance(which_bquark=self.which_bquark)
                 self.events["nbQuarkHiggsMatched"] = ak.num(
                     self.events.bQuarkHiggsMatched, axis=1
                 )
@@ -397,11 +456,16 @@ class VBFHH4bbQuarkMatchingProcessor(BaseProcessorABC):
                 )
 
                 # reconstruct the higgs candidates
-                (
-                    self.events["HiggsLeading"],
-                    self.events["HiggsSubLeading"],
-                    self.events["JetGoodFromHiggsOrdered"],
-                ) = reconstruct_higgs_from_provenance(self.events.JetGoodMatched)
+                with self.timing.stage("higgs_reconstruction"):
+                    (
+                        self.events["HiggsLeading"],
+                        self.events["HiggsSubLeading"],
+                        self.events["JetGoodFromHiggsOrdered"],
+                    ) = reconstruct_higgs_from_provenance(self.events.JetGoodMatched)
+                # the matched candidates can be missing, so the behaviours are used
+                self.events["HH"] = add_fields(
+                    self.events.HiggsLeading + self.events.HiggsSubLeading
+                )
 
                 matched_jet_higgs_idx_not_none = self.events.JetGoodMatched.index[
                     ~ak.is_none(self.events.JetGoodMatched.index, axis=1)
@@ -410,169 +474,152 @@ class VBFHH4bbQuarkMatchingProcessor(BaseProcessorABC):
                 # apply spanet model to get the pairing prediction for the b-jets from Higgs
                 self.dummy_provenance()
 
-                try:
-                    worker = get_worker()
-                    # print("found worker", worker)
-                except ValueError:
-                    worker = None
-                    # print("     >>>>>>>>>>   NOT found worker", worker)
-
-                if worker is None:
-                    import onnxruntime as ort
-
-                    sess_options = ort.SessionOptions()
-                    sess_options.graph_optimization_level = (
-                        ort.GraphOptimizationLevel.ORT_ENABLE_ALL
-                    )
-                    model_session = ort.InferenceSession(
-                        self.spanet_model,
-                        sess_options=sess_options,
-                        providers=["CPUExecutionProvider"],
+                # the first model fills the fields without tag, used for the selection
+                # of the VBF jets, and with several models each one also fills
+                # its own <field>_<tag> fields
+                with self.timing.stage("spanet"):
+                    spanet_pairings = self.get_spanet_pairings(variation)
+                for i, (tag, pairings) in enumerate(spanet_pairings.items()):
+                    (
+                        pairing_predictions,
+                        best_pairing_probability,
+                        second_best_pairing_probability,
+                    ) = pairings
+                    with self.timing.stage("higgs_reconstruction"):
+                        higgs_candidates = reconstruct_higgs_from_idx(
+                            self.events.JetGood, pairing_predictions
+                        )
+                    for field_tag in [tag] if i > 0 or not tag else ["", tag]:
+                        self.events[
+                            tagged_field("best_pairing_probability", field_tag)
+                        ] = best_pairing_probability
+                        self.events[
+                            tagged_field("second_best_pairing_probability", field_tag)
+                        ] = second_best_pairing_probability
+                        (
+                            self.events[tagged_field("HiggsLeading", field_tag)],
+                            self.events[tagged_field("HiggsSubLeading", field_tag)],
+                            self.events[
+                                tagged_field("JetGoodFromHiggsOrdered", field_tag)
+                            ],
+                        ) = higgs_candidates
+
+                self.events["HH"] = zip_ptetaphim(
+                    add(
+                        get_ptetaphim(self.events.HiggsLeading),
+                        get_ptetaphim(self.events.HiggsSubLeading),
                     )
-                    # input_name = [input.name for input in model_session.get_inputs()]
-                    # output_name = [output.name for output in model_session.get_outputs()]
-                    # print("     >>>>>>>>>>   initialize new worker", worker)
-                else:
-                    model_session = worker.data["model_session"]
-                    # input_name = worker.data['input_name']
-                    # output_name = worker.data['output_name']
-                    # print("get info from old worker", worker)
-
-                input_name = [input.name for input in model_session.get_inputs()]
-                output_name = [output.name for output in model_session.get_outputs()]
-                # print(model_session)
-
-                # compute the pairing information using the spanet model
-                outputs = get_pairing_information(
-                    model_session,
-                    input_name,
-                    output_name,
-                    self.events,
-                    self.max_num_jets,
                 )
 
-                (
-                    pairing_predictions,
-                    self.events["best_pairing_probability"],
-                    self.events["second_best_pairing_probability"],
-                ) = get_best_pairings(outputs)
-
-                (
-                    self.events["HiggsLeading"],
-                    self.events["HiggsSubLeading"],
-                    self.events["JetGoodFromHiggsOrdered"],
-                ) = reconstruct_higgs_from_idx(self.events.JetGood, pairing_predictions)
-
                 matched_jet_higgs_idx_not_none = self.events.JetGoodFromHiggsOrdered.index
 
 
-            jet_offsets = np.concatenate(
-                [
-                    [0],
-                    np.cumsum(
-                        ak.to_numpy(ak.num(self.events.Jet, axis=1), allow_missing=True)
-                    ),
+            with self.timing.stage("vbf_jet_selection"):
+                jet_offsets = np.concatenate(
+                    [
+                        [0],
+                        np.cumsum(
+                            ak.to_numpy(ak.num(self.events.Jet, axis=1), allow_missing=True)
+                        ),
+                    ]
+                )
+                local_index_all = ak.local_index(self.events.Jet, axis=1)
+                jets_index_all = ak.to_numpy(
+                    ak.flatten(local_index_all + jet_offsets[:-1]), allow_missing=True
+                )
+                jets_from_higgs_idx = ak.to_numpy(
+                    ak.flatten(matched_jet_higgs_idx_not_none + jet_offsets[:-1]),
+                    allow_missing=False,
+                )
+                jets_no_higgs_idx = get_jets_no_higgs(jets_index_all, jets_from_higgs_idx)
+                jets_no_higgs_idx_unflat = (
+                    ak.unflatten(jets_no_higgs_idx, ak.num(self.events.Jet, axis=1))
+                    - jet_offsets[:-1]
+                )
+                self.events["JetVBFNotFromHiggs"] = self.events.Jet[
+                    jets_no_higgs_idx_unflat >= 0
                 ]
-            )
-            local_index_all = ak.local_index(self.events.Jet, axis=1)
-            jets_index_all = ak.to_numpy(
-                ak.flatten(local_index_all + jet_offsets[:-1]), allow_missing=True
-            )
-            jets_from_higgs_idx = ak.to_numpy(
-                ak.flatten(matched_jet_higgs_idx_not_none + jet_offsets[:-1]),
-                allow_missing=False,
-            )
-            jets_no_higgs_idx = get_jets_no_higgs(jets_index_all, jets_from_higgs_idx)
-            jets_no_higgs_idx_unflat = (
-                ak.unflatten(jets_no_higgs_idx, ak.num(self.events.Jet, axis=1))
-                - jet_offsets[:-1]
-            )
-            self.events["JetVBFNotFromHiggs"] = self.events.Jet[
-                jets_no_higgs_idx_unflat >= 0
-            ]
-            # apply selection to the jets not from Higgs
-            self.events["JetVBFNotFromHiggs"]=jet_selection_nopu(self.events, "JetVBFNotFromHiggs", self.params)
+                # apply selection to the jets not from Higgs
+                self.events["JetVBFNotFromHiggs"]=jet_selection_nopu(self.events, "JetVBFNotFromHiggs", self.params)
 
-            # order in pt
-            self.events["JetVBFNotFromHiggs"] = self.events.JetVBFNotFromHiggs[
-                ak.argsort(self.events.JetVBFNotFromHiggs.pt, axis=1, ascending=False)
-            ]
-
-            self.events["HH"] = add_fields(
-                self.events.HiggsLeading + self.events.HiggsSubLeading
-            )
+                # order in pt
+                self.events["JetVBFNotFromHiggs"] = self.events.JetVBFNotFromHiggs[
+                    ak.argsort(self.events.JetVBFNotFromHiggs.pt, axis=1, ascending=False)
+                ]
 
             if self.vbf_parton_matching:
-                self.do_vbf_parton_matching(which_bquark=self.which_bquark)
-
-                self.events["nJetVBF_matched"] = ak.num(
-                    self.events.JetVBF_matched, axis=1
-                )
+                with self.timing.stage("vbf_parton_matching"):
+                    self.do_vbf_parton_matching(which_bquark=self.which_bquark)
+                with self.timing.stage("vbf_jet_selection"):
+                    self.events["nJetVBF_matched"] = ak.num(
+                        self.events.JetVBF_matched, axis=1
+                    )
 
-                # Create new variable delta eta and invariant mass of the jets
-                JetVBF_matched_padded = ak.pad_none(
-                    self.events.JetVBF_matched, 2
-                )  # Adds none jets to events that have less than 2 jets
+                    # Create new variable delta eta and invariant mass of the jets
+                    JetVBF_matched_padded = ak.pad_none(
+                        self.events.JetVBF_matched, 2
+                    )  # Adds none jets to events that have less than 2 jets
 
-                self.events["deltaEta_matched"] = abs(
-                    JetVBF_matched_padded.eta[:, 0]
-                    - JetVBF_matched_padded.eta[:, 1]
-                )
+                    self.events["deltaEta_matched"] = abs(
+                        JetVBF_matched_padded.eta[:, 0]
+                        - JetVBF_matched_padded.eta[:, 1]
+                    )
                 
-                self.events["jj_mass_matched"] = (
-                    JetVBF_matched_padded[:, 0] + JetVBF_matched_padded[:, 1]
-                ).mass
+                    self.events["jj_mass_matched"] = (
+                        JetVBF_matched_padded[:, 0] + JetVBF_matched_padded[:, 1]
+                    ).mass
                 
-                # This product will give only -1 or 1 values, as it's needed to see if the two jets are in the same side or not
-                self.events["etaProduct"] = (
-                    JetVBF_matched_padded.eta[:, 0]
-                    * JetVBF_matched_padded.eta[:, 1]
-                ) / abs(
-                    JetVBF_matched_padded.eta[:, 0]
-                    * JetVBF_matched_padded.eta[:, 1]
-                )
+                    # This product will give only -1 or 1 values, as it's needed to see if the two jets are in the same side or not
+                    self.events["etaProduct"] = (
+                        JetVBF_matched_padded.eta[:, 0]
+                        * JetVBF_matched_padded.eta[:, 1]
+                    ) / abs(
+                        JetVBF_matched_padded.eta[:, 0]
+                        * JetVBF_matched_padded.eta[:, 1]
+                    )
 
-            # choose vbf jets as the two jets with the highest pt that are not from higgs decay
-            self.events["JetVBFLeadingPtNotFromHiggs"] = self.events.JetVBFNotFromHiggs[
-                :, :2
-            ]
+            with self.timing.stage("vbf_jet_selection"):
+                # choose vbf jets as the two jets with the highest pt that are not from higgs decay
+                self.events["JetVBFLeadingPtNotFromHiggs"] = self.events.JetVBFNotFromHiggs[
+                    :, :2
+                ]
 
-            # choose higgs jets as the two jets with the highest mjj that are not from higgs decay
-            jet_combinations = ak.combinations(self.events.JetVBFNotFromHiggs, 2)
-            jet_combinations_mass = (jet_combinations["0"] + jet_combinations["1"]).mass
-            jet_combinations_mass_max_idx = ak.to_numpy(
-                ak.argsort(jet_combinations_mass, axis=1, ascending=False)[:, 0]
-            )
+                # choose higgs jets as the two jets with the highest mjj that are not from higgs decay
+                jet_combinations = ak.combinations(self.events.JetVBFNotFromHiggs, 2)
+                jet_combinations_mass = (jet_combinations["0"] + jet_combinations["1"]).mass
+                jet_combinations_mass_max_idx = ak.to_numpy(
+                    ak.argsort(jet_combinations_mass, axis=1, ascending=False)[:, 0]
+                )
 
-            jets_max_mass = jet_combinations[
-                ak.local_index(jet_combinations, axis=0), jet_combinations_mass_max_idx
-            ]
-            vbf_jets_max_mass_0 = ak.unflatten(
-                self.events.Jet[
-                    ak.local_index(self.events.Jet, axis=0),
-                    ak.to_numpy(jets_max_mass["0"].index),
-                ],1
-            )
-            vbf_jets_max_mass_1 = ak.unflatten(
-                self.events.Jet[
-                    ak.local_index(self.events.Jet, axis=0),
-                    ak.to_numpy(jets_max_mass["1"].index),
-                ],1
-            )
+                jets_max_mass = jet_combinations[
+                    ak.local_index(jet_combinations, axis=0), jet_combinations_mass_max_idx
+                ]
+                vbf_jets_max_mass_0 = ak.unflatten(
+                    self.events.Jet[
+                        ak.local_index(self.events.Jet, axis=0),
+                        ak.to_numpy(jets_max_mass["0"].index),
+                    ],1
+                )
+                vbf_jets_max_mass_1 = ak.unflatten(
+                    self.events.Jet[
+                        ak.local_index(self.events.Jet, axis=0),
+                        ak.to_numpy(jets_max_mass["1"].index),
+                    ],1
+                )
 
-            vbf_jet_leading_mjj = ak.with_name(
-                ak.concatenate([vbf_jets_max_mass_0, vbf_jets_max_mass_1], axis=1),
-                name="PtEtaPhiMCandidate",
-            )
+                vbf_jet_leading_mjj = ak.with_name(
+                    ak.concatenate([vbf_jets_max_mass_0, vbf_jets_max_mass_1], axis=1),
+                    name="PtEtaPhiMCandidate",
+                )
 
-            vbf_jet_leading_mjj_fields_dict = {
-                field: getattr(vbf_jet_leading_mjj, field)
-                for field in vbf_jet_leading_mjj.fields
-                if ("muon" not in field and "electron" not in field)
-            }
-            self.events["JetVBFLeadingMjjNotFromHiggs"] = add_fields(
-                vbf_jet_leading_mjj, vbf_jet_leading_mjj_fields_dict
-            )
+                vbf_jet_leading_mjj_fields_dict = {
+                    field: getattr(vbf_jet_leading_mjj, field)
+                    for field in vbf_jet_leading_mjj.fields
+                    if ("muon" not in field and "electron" not in field)
+                }
+                self.events["JetVBFLeadingMjjNotFromHiggs"] = add_fields(
+                    vbf_jet_leading_mjj, vbf_jet_leading_mjj_fields_dict
+                )
 
 
             self.events["JetVBFLeadingPtNotFromHiggs_deltaEta"] = abs(
@@ -598,28 +645,22 @@ class VBFHH4bbQuarkMatchingProcessor(BaseProcessorABC):
 
 
 
-            self.events["HH_deltaR"] = (
-                    self.events.HiggsLeading.delta_r(self.events.HiggsSubLeading)
-            )
-
-            self.events["jj_deltaR"] = (
-                    self.events.JetVBFLeadingPtNotFromHiggs[:,0].delta_r(self.events.JetVBFLeadingPtNotFromHiggs[:,1])
-            )
-
-            self.events["H1j1_deltaR"] = (
-                    self.events.HiggsLeading.delta_r(self.events.JetVBFLeadingPtNotFromHiggs[:,0])
-            )
-            
-            self.events["H1j2_deltaR"] = (
-                    self.events.HiggsLeading.delta_r(self.events.JetVBFLeadingPtNotFromHiggs[:,1])
-            )
-
-            self.events["H2j1_deltaR"] = (
-                    self.events.HiggsSubLeading.delta_r(self.events.JetVBFLeadingPtNotFromHiggs[:,0])
-            )
-
-            self.events["H2j2_deltaR"] = (
-                    self.events.HiggsSubLeading.delta_r(self.events.JetVBFLeadingPtNotFromHiggs[:,1])
+            # delta R of all the pairs of the H candidates and the VBF jets
+            vbf_objects = [
+                self.events.HiggsLeading,
+                self.events.HiggsSubLeading,
+                self.events.JetVBFLeadingPtNotFromHiggs[:,0],
+                self.events.JetVBFLeadingPtNotFromHiggs[:,1],
+            ]
+            (
+                self.events["HH_deltaR"],
+                self.events["H1j1_deltaR"],
+                self.events["H1j2_deltaR"],
+                self.events["H2j1_deltaR"],
+                self.events["H2j2_deltaR"],
+                self.events["jj_deltaR"],
+            ) = delta_r_pairs(
+                [obj.eta for obj in vbf_objects], [obj.phi for obj in vbf_objects]
             )
 
             JetVBFLeadingPtNotFromHiggs_etaAverage = (
@@ -650,3 +691,5 @@ class VBFHH4bbQuarkMatchingProcessor(BaseProcessorABC):
             self.events.JetGoodHiggsMatched, axis=1
         )
         self.events["nJetGoodMatched"] = ak.num(self.events.JetGoodMatched, axis=1)
+
+        record_timing(self.output, self._dataset, self.timing)
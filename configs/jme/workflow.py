@@ -12,6 +12,10 @@ from params.binning import *
 
 from time import sleep
 import os
+import sys
+
+sys.path.append("../../")
+from utils.jet_regression import get_pnet_regression
 
 flav_dict = (
     {
@@ -389,16 +393,17 @@ class QCDBaseProcessor(BaseProcessorABC):
 
             if int(os.environ.get("PNET", 0)) == 1:
                 # PNetReg
+                jet_regression = get_pnet_regression(
+                    self.events.JetMatched, fallback=False
+                )
                 self.events[f"MatchedJets"] = ak.with_field(
                     self.events.MatchedJets,
-                    self.events.MatchedJets.ResponseRaw
-                    * self.events.JetMatched.PNetRegPtRawCorr,
+                    jet_regression.ptPNetReg / self.events.GenJetMatched.pt,
                     "ResponsePNetReg",
                 )
                 self.events[f"MatchedJets"] = ak.with_field(
                     self.events.MatchedJets,
-                    self.events.MatchedJets.JetPtRaw
-                    * self.events.JetMatched.PNetRegPtRawCorr,
+                    jet_regression.ptPNetReg,
                     "JetPtPNetReg",
                 )
                 if int(os.environ.get("SPLITPNETREG15", 0)) == 1:
@@ -483,10 +488,12 @@ class QCDBaseProcessor(BaseProcessorABC):
 
                 # PNetRegNeutrino
                 if int(os.environ.get("NEUTRINO", 1)) == 1:
+                    jet_neutrino_regression = get_pnet_regression(
+                        self.events.JetNeutrinoMatched, fallback=False
+                    )
                     self.events[f"MatchedJetsNeutrino"] = ak.with_field(
                         self.events.MatchedJetsNeutrino,
-                        self.events.JetNeutrinoMatched.pt
-                        * (1 - self.events.JetNeutrinoMatched.rawFactor),
+                        jet_neutrino_regression.ptRaw,
                         "JetPtRaw",
                     )
                     self.events[f"MatchedJetsNeutrino"] = ak.with_field(
@@ -533,9 +540,7 @@ class QCDBaseProcessor(BaseProcessorABC):
 
                     self.events[f"MatchedJetsNeutrino"] = ak.with_field(
                         self.events.MatchedJetsNeutrino,
-                        self.events.MatchedJetsNeutrino.JetPtRaw
-                        * self.events.JetNeutrinoMatched.PNetRegPtRawCorr
-                        * self.events.JetNeutrinoMatched.PNetRegPtRawCorrNeutrino,
+                        jet_neutrino_regression.ptPNetRegNeutrino,
                         "JetPtPNetRegNeutrino",
                     )
 
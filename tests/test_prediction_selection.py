@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from utils import prediction_selection
+from utils.prediction_selection import (
+    extract_pairings,
+    extract_predictions,
+    extract_predictions_reference,
+)
+
+NUM_EVENTS = 2000
+
+
+def random_predictions(max_jets, seed):
+    rng = np.random.default_rng(seed)
+    return rng.random((2, NUM_EVENTS, max_jets, max_jets), dtype=np.float32)
+
+
+def tied_predictions(max_jets, seed):
+    # few distinct values, so that most events have ties within and across targets
+    return np.round(random_predictions(max_jets, seed) * 4) / 4
+
+
+def nan_predictions(max_jets, seed):
+    predictions = random_predictions(max_jets, seed)
+    rng = np.random.default_rng(seed + 1)
+    predictions[rng.random(predictions.shape) < 0.02] = np.nan
+    # events with a whole target, or both targets, set to NaN
+    predictions[0, :10] = np.nan
+    predictions[:, 10:20] = np.nan
+    return predictions
+
+
+def non_finite_predictions(max_jets, seed):
+    predictions = nan_predictions(max_jets, seed)
+    rng = np.random.default_rng(seed + 2)
+    predictions[rng.random(predictions.shape) < 0.01] = np.inf
+    predictions[rng.random(predictions.shape) < 0.05] = -np.inf
+    return predictions
+
+
+@pytest.fixture
+def no_fallback(monkeypatch):
+    # the closed form must be used for all the inputs below
+    def fallback(predictions):
+        raise AssertionError("extract_pairings fell back to extract_predictions")
+
+    monkeypatch.setattr(prediction_selection, "extract_predictions", fallback)
+
+
+@pytest.mark.parametrize("max_jets", range(4, prediction_selection.MAX_PAIRING_JETS + 1))
+@pytest.mark.parametrize(
+    "make_predictions",
+    [random_predictions, tied_predictions, nan_predictions, non_finite_predictions],
+)
+def test_extract_pairings(no_fallback, make_predictions, max_jets):
+    predictions = make_predictions(max_jets, seed=max_jets)
+    expected = extract_predictions_reference(list(predictions))
+
+    for result in (extract_pairings(predictions), extract_pairings(list(predictions))):
+        assert len(result) == len(expected)
+        for target, reference in zip(result, expected):
+            np.testing.assert_array_equal(target, reference)
+
+
+@pytest.mark.parametrize(
+    "make_predictions", [random_predictions, tied_predictions, nan_predictions]
+)
+def test_extract_predictions(make_predictions):
+    predictions = make_predictions(6, seed=0)
+    expected = extract_predictions_reference(list(predictions))
+    for target, reference in zip(extract_predictions(predictions), expected):
+        np.testing.assert_array_equal(target, reference)
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from utils.spanet_cache import load_cached_pairings, save_cached_pairings
+
+KEY = "0123abcd"
+
+
+def save_pairings(cache_dir):
+    pairings = (
+        np.arange(16, dtype=np.int64).reshape((2, 4, 2)),
+        np.linspace(0, 1, 4),
+        np.linspace(0, 0.5, 4),
+    )
+    save_cached_pairings(str(cache_dir), KEY, *pairings)
+    return pairings
+
+
+def test_round_trip(tmp_path):
+    pairings = save_pairings(tmp_path)
+    for cached, expected in zip(load_cached_pairings(str(tmp_path), KEY), pairings):
+        np.testing.assert_array_equal(cached, expected)
+
+
+def test_missing(tmp_path):
+    assert load_cached_pairings(str(tmp_path), KEY) is None
+
+
+@pytest.mark.parametrize("size", [0, 10, 200, -10])
+def test_truncated(tmp_path, size):
+    # a file left by a killed worker or a full disk is recomputed
+    save_pairings(tmp_path)
+    path = tmp_path / f"{KEY}.npz"
+    data = path.read_bytes()
+    path.write_bytes(data[:size] if size >= 0 else data[: len(data) + size])
+    assert load_cached_pairings(str(tmp_path), KEY) is None
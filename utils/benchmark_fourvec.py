@@ -0,0 +1,126 @@
+# Benchmark of the fourvec kernels against the coffea vector behaviours, on the
+# variables of the Higgs candidates and of the HH system
+# python utils/benchmark_fourvec.py -n 1000000
+
+import argparse
+import os
+import sys
+import time
+
+import awkward as ak
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.basic_functions import add_fields
+from utils.fourvec import (
+    get_ptetaphim,
+    invariant_mass,
+    pair_variables,
+    zip_ptetaphim,
+)
+
+
+def generate_candidates(num_events, seed=42):
+    """Two PtEtaPhiMLorentzVector Higgs candidates per event, in float32."""
+    from coffea.nanoevents.methods import vector
+
+    rng = np.random.default_rng(seed)
+    return tuple(
+        zip_ptetaphim(
+            (
+                rng.exponential(100, num_events) + 20,
+                rng.normal(0, 1.5, num_events),
+                rng.uniform(-np.pi, np.pi, num_events),
+                rng.normal(125, 15, num_events),
+            ),
+            behavior=vector.behavior,
+        )
+        for _ in range(2)
+    )
+
+
+def awkward_variables(higgs_leading, higgs_subleading):
+    hh = add_fields(higgs_leading + higgs_subleading)
+    return {
+        "HH pt": hh.pt,
+        "HH mass": hh.mass,
+        "HH cos_theta_star": abs(np.cos(hh.theta)),
+        "H cos_theta": abs(np.cos(higgs_leading.theta)),
+        "HH dR": higgs_leading.delta_r(higgs_subleading),
+        "HH dPhi": higgs_leading.delta_phi(higgs_subleading),
+        "HH mass (invariant_mass)": (higgs_leading + higgs_subleading).mass,
+    }
+
+
+def fourvec_variables(higgs_leading, higgs_subleading):
+    leading = get_ptetaphim(higgs_leading)
+    subleading = get_ptetaphim(higgs_subleading)
+    hh, angles = pair_variables(leading, subleading)
+    variables = {
+        "HH pt": hh[0],
+        "HH mass": hh[3],
+        "HH cos_theta_star": abs(angles["cos_theta"]),
+        "H cos_theta": abs(angles["cos_theta_1"]),
+        "HH dR": angles["dR"],
+        "HH dPhi": angles["dPhi"],
+        "HH mass (invariant_mass)": invariant_mass(leading, subleading),
+    }
+    # the records are only built for the output
+    zip_ptetaphim(hh)
+    return variables
+
+
+def time_path(path, candidates, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        variables = path(*candidates)
+    elapsed = (time.perf_counter() - start) / repeat
+    return variables, len(candidates[0]) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the fourvec kernels against the coffea vector behaviours"
+    )
+    parser.add_argument(
+        "-n",
+        "--num-events",
+        type=int,
+        nargs="+",
+        default=[1000000],
+        help="Number of events per chunk",
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="Number of timed repetitions"
+    )
+    args = parser.parse_args()
+
+    # compile outside of the timing
+    fourvec_variables(*generate_candidates(10))
+
+    for num_events in args.num_events:
+        candidates = generate_candidates(num_events)
+        reference, awkward_rate = time_path(awkward_variables, candidates, args.repeat)
+        result, fourvec_rate = time_path(fourvec_variables, candidates, args.repeat)
+
+        # the coffea vectors compute in float32, which limits the agreement of the
+        # masses of boosted systems to ~1e-3
+        for name, values in reference.items():
+            difference = np.max(
+                np.abs(np.asarray(result[name]) - ak.to_numpy(values))
+                / np.maximum(np.abs(ak.to_numpy(values)), 1)
+            )
+            if difference > 1e-2:
+                raise RuntimeError(
+                    f"{name} differs from the coffea one by {difference:.2e}"
+                )
+            print(f"  {name:<26s} max relative difference {difference:.1e}")
+
+        print(
+            f"{num_events:>9d} events: awkward {awkward_rate:11.0f} ev/s, "
+            f"fourvec {fourvec_rate:11.0f} ev/s (x{fourvec_rate / awkward_rate:.1f})"
+        )
+
+
+if __name__ == "__main__":
+    main()
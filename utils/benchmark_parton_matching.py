@@ -0,0 +1,190 @@
+# Scaling of the GenPart copy pointers with the number of numba threads, on synthetic
+# GenPart decay chains
+# python utils/benchmark_parton_matching.py -n 100000 1000000 -t 1 2 4 8 16
+
+import argparse
+import os
+import sys
+import time
+
+import awkward as ak
+import numba
+import numpy as np
+from numba import njit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.parton_matching_function import (
+    _get_copy_pointers_parallel,
+    _get_copy_pointers_serial,
+)
+
+
+@njit(cache=True)
+def _fill_genpart_chains(
+    depths,
+    pt_draws,
+    genpart_offsets,
+    firstgenpart_idxG,
+    pdgId,
+    last_copy,
+    pt,
+    children,
+    mother_idx,
+):
+    for iev in range(depths.shape[0]):
+        start = genpart_offsets[iev]
+        firstG = firstgenpart_idxG[iev]
+        # H -> b bbar, at the local indices 0, 1, 2
+        pdgId[start] = 25
+        last_copy[start] = True
+        pt[start] = 100.0
+        children[start, 0] = firstG + 1
+        children[start, 1] = firstG + 2
+        mother_idx[start] = -1
+        local = 3
+        for iquark in range(2):
+            quark = start + 1 + iquark
+            pdgId[quark] = 5 if iquark == 0 else -5
+            pt[quark] = pt_draws[iev, iquark, 0]
+            mother_idx[quark] = start
+            mother = quark
+            # each copy radiates a gluon, the two are the children of the previous copy
+            for icopy in range(depths[iev, iquark]):
+                copy = start + local
+                gluon = copy + 1
+                pdgId[copy] = pdgId[quark]
+                pt[copy] = pt_draws[iev, iquark, icopy + 1]
+                pdgId[gluon] = 21
+                last_copy[gluon] = True
+                pt[gluon] = 1.0
+                children[mother, 0] = firstG + local
+                children[mother, 1] = firstG + local + 1
+                mother_idx[copy] = mother
+                mother_idx[gluon] = mother
+                mother = copy
+                local += 2
+            last_copy[mother] = True
+
+
+def generate_genpart_chains(num_events, max_depth=6, seed=42):
+    """
+    Build GenPart collections with a H -> b bbar decay per event, where each quark
+    has a chain of up to max_depth copies, each radiating a gluon.
+
+    The global indices have gaps between the events, as after a preselection.
+
+    Returns:
+    dict: the arguments of the copy pointer kernels.
+    """
+    rng = np.random.default_rng(seed)
+    depths = rng.integers(0, max_depth + 1, size=(num_events, 2))
+    pt_draws = rng.exponential(60, size=(num_events, 2, max_depth + 1))
+
+    counts = 3 + 2 * depths.sum(axis=1)
+    genpart_offsets = np.concatenate([[0], np.cumsum(counts)])
+    gaps = rng.integers(0, 100, size=num_events)
+    firstgenpart_idxG = genpart_offsets[:-1] + np.cumsum(gaps)
+
+    num_genparts = genpart_offsets[-1]
+    pdgId = np.zeros(num_genparts, dtype=np.int32)
+    last_copy = np.zeros(num_genparts, dtype=np.bool_)
+    pt = np.zeros(num_genparts, dtype=np.float32)
+    children = np.full((num_genparts, 2), -1, dtype=np.int64)
+    mother_idx = np.full(num_genparts, -1, dtype=np.int64)
+    _fill_genpart_chains(
+        depths,
+        pt_draws,
+        genpart_offsets,
+        firstgenpart_idxG,
+        pdgId,
+        last_copy,
+        pt,
+        children,
+        mother_idx,
+    )
+
+    num_children = np.where(children[:, 0] >= 0, 2, 0)
+    return {
+        "children_idxG_flat": ak.unflatten(children[children >= 0], num_children),
+        "genpart_pdgId_flat": pdgId,
+        "genpart_LastCopy_flat": last_copy,
+        "genpart_pt_flat": pt,
+        "genpart_mother_flat": mother_idx,
+        "genpart_offsets": genpart_offsets,
+        # shift from the global to the flat indices, as FlatGenParticles.reverse_index
+        "genpart_reverse_index": genpart_offsets[:-1] - firstgenpart_idxG,
+    }
+
+
+def time_kernel(kernel, chains, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = kernel(**chains)
+    elapsed = (time.perf_counter() - start) / repeat
+    return result, (len(chains["genpart_offsets"]) - 1) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the serial and parallel GenPart copy pointer kernels"
+    )
+    parser.add_argument(
+        "-n",
+        "--num-events",
+        type=int,
+        nargs="+",
+        default=[10000, 100000, 1000000],
+        help="Number of events per chunk",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16],
+        help="Numbers of numba threads of the parallel kernel",
+    )
+    parser.add_argument(
+        "-d", "--max-depth", type=int, default=6, help="Maximum copies per quark"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="Number of timed repetitions"
+    )
+    args = parser.parse_args()
+
+    threads = [t for t in args.threads if t <= numba.config.NUMBA_NUM_THREADS]
+    if len(threads) < len(args.threads):
+        print(f"only {numba.config.NUMBA_NUM_THREADS} threads available")
+
+    # compile outside of the timing
+    warmup = generate_genpart_chains(10, args.max_depth)
+    _get_copy_pointers_serial(**warmup)
+    _get_copy_pointers_parallel(**warmup)
+
+    for num_events in args.num_events:
+        chains = generate_genpart_chains(num_events, args.max_depth)
+        reference, serial_rate = time_kernel(
+            _get_copy_pointers_serial, chains, args.repeat
+        )
+        rates = {}
+        for num_threads in threads:
+            numba.set_num_threads(num_threads)
+            result, rates[num_threads] = time_kernel(
+                _get_copy_pointers_parallel, chains, args.repeat
+            )
+            if not all(map(np.array_equal, reference, result)):
+                raise RuntimeError(
+                    f"The parallel kernel with {num_threads} threads differs from the serial one"
+                )
+
+        print(
+            f"{num_events:>9d} events: serial {serial_rate:11.0f} ev/s, "
+            + ", ".join(
+                f"{num_threads} threads x{rate / serial_rate:.2f}"
+                for num_threads, rate in rates.items()
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
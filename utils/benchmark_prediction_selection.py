@@ -0,0 +1,138 @@
+# Micro-benchmark of the SPANet jet assignment selectors on synthetic predictions
+# python utils/benchmark_prediction_selection.py -n 10000 100000 1000000
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from numba import njit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.prediction_selection import (
+    mask_2,
+    mask_3,
+    mask_jet,
+    extract_predictions_reference,
+    extract_predictions,
+    extract_pairings,
+)
+
+SELECTORS = {
+    "typed list": extract_predictions_reference,
+    "contiguous": extract_predictions,
+    "closed-form": extract_pairings,
+}
+
+
+def generate_predictions(num_events, max_jets, min_jets=4, seed=42):
+    """
+    Build SPANet-like assignment probabilities for two 2-parton targets.
+
+    The matrices are symmetric with a null diagonal and null entries for
+    padded jets, so that ties are as frequent as in the real model outputs.
+    """
+    rng = np.random.default_rng(seed)
+    predictions = rng.random((2, num_events, max_jets, max_jets), dtype=np.float32)
+    predictions = predictions + np.swapaxes(predictions, 2, 3)
+
+    num_jets = rng.integers(min_jets, max_jets + 1, size=num_events)
+    jet_mask = np.arange(max_jets)[np.newaxis, :] < num_jets[:, np.newaxis]
+    pair_mask = jet_mask[:, :, np.newaxis] & jet_mask[:, np.newaxis, :]
+    pair_mask &= ~np.eye(max_jets, dtype=bool)[np.newaxis]
+    predictions *= pair_mask[np.newaxis]
+    predictions /= predictions.sum(axis=(2, 3), keepdims=True)
+
+    return np.ascontiguousarray(predictions, dtype=np.float32)
+
+
+def time_selector(selector, predictions, repeat):
+    # run once to exclude the JIT compilation from the timing
+    selector(predictions[:, :10])
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = selector(predictions)
+    elapsed = (time.perf_counter() - start) / repeat
+    return np.stack(result), predictions.shape[1] / elapsed
+
+
+@njit
+def _repeat_mask_jet(data, num_partons, max_jets, num_calls):
+    for call in range(num_calls):
+        mask_jet(data, num_partons, max_jets, call % max_jets, np.float32(call))
+
+
+@njit
+def _repeat_mask_unrolled(data, num_partons, max_jets, num_calls):
+    for call in range(num_calls):
+        if num_partons == 2:
+            mask_2(data, max_jets, call % max_jets, np.float32(call))
+        else:
+            mask_3(data, max_jets, call % max_jets, np.float32(call))
+
+
+def time_masking(max_jets, num_calls=1000000):
+    """Return the time per call in ns of mask_jet and of mask_2/mask_3."""
+    timings = {}
+    for num_partons in (2, 3):
+        for name, repeat_mask in (
+            ("mask_jet", _repeat_mask_jet),
+            (f"mask_{num_partons}", _repeat_mask_unrolled),
+        ):
+            data = np.zeros(max_jets**num_partons, dtype=np.float32)
+            repeat_mask(data, num_partons, max_jets, 10)
+            start = time.perf_counter()
+            repeat_mask(data, num_partons, max_jets, num_calls)
+            timings[num_partons, name] = (time.perf_counter() - start) / num_calls * 1e9
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the SPANet assignment selectors against the original one"
+    )
+    parser.add_argument(
+        "-n",
+        "--num-events",
+        type=int,
+        nargs="+",
+        default=[10000, 100000, 1000000],
+        help="Number of events per chunk",
+    )
+    parser.add_argument(
+        "-j", "--max-jets", type=int, default=5, help="Number of jets per event"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="Number of timed repetitions"
+    )
+    args = parser.parse_args()
+
+    for (num_partons, name), timing in time_masking(args.max_jets).items():
+        print(f"{num_partons} partons: {name:>8s} {timing:6.1f} ns/call")
+
+    for num_events in args.num_events:
+        predictions = generate_predictions(num_events, args.max_jets)
+
+        rates = {}
+        for name, selector in SELECTORS.items():
+            result, rates[name] = time_selector(selector, predictions, args.repeat)
+            if name == "typed list":
+                reference = result
+            elif not np.array_equal(reference, result):
+                mismatches = np.any(reference != result, axis=(0, 2)).sum()
+                raise RuntimeError(
+                    f"The {name} selector differs from the original one in {mismatches} events"
+                )
+
+        print(
+            f"{num_events:>9d} events: "
+            + ", ".join(
+                f"{name} {rate:11.0f} ev/s (x{rate / rates['typed list']:.1f})"
+                for name, rate in rates.items()
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,586 @@
+# Lorentz-vector kernels on contiguous pt/eta/phi/mass arrays, one entry per event.
+# They replace the awkward behaviours (add_fields, +, .delta_r, .mass) in the hot
+# paths of the workflows, and the records are only zipped when stored in the events.
+
+import awkward as ak
+import numpy as np
+from numba import njit
+
+PTETAPHIM_FIELDS = ("pt", "eta", "phi", "mass")
+
+
+# The scalar kernels evaluate the math functions at the precision of the inputs,
+# float32 for the NanoAOD branches, and accumulate in double precision. sinh and
+# cosh come from a single exp and arcsinh from a log.
+# The array kernels only do the arithmetic: exp(eta), cos(phi) and sin(phi) are
+# computed before with the vectorised numpy ufuncs, and eta and phi of the results
+# after, since the scalar libm calls of numba dominate the time on large chunks.
+
+
+@njit(cache=True)
+def cartesian_from_trig(pt, mass, exp_eta, cos_phi, sin_phi):
+    """(px, py, pz, E) of a vector from its pt, mass, exp(eta), cos(phi) and sin(phi)."""
+    pt = np.float64(pt)
+    exp_eta = np.float64(exp_eta)
+    pz = 0.5 * pt * (exp_eta - 1.0 / exp_eta)
+    return (
+        pt * np.float64(cos_phi),
+        pt * np.float64(sin_phi),
+        pz,
+        np.sqrt(pt * pt + pz * pz + np.float64(mass) ** 2),
+    )
+
+
+@njit(cache=True)
+def to_cartesian(pt, eta, phi, mass):
+    """(px, py, pz, E) of a (pt, eta, phi, mass) vector."""
+    return cartesian_from_trig(pt, mass, np.exp(eta), np.cos(phi), np.sin(phi))
+
+
+@njit(cache=True)
+def from_cartesian(px, py, pz, energy):
+    """(pt, eta, phi, mass) of a (px, py, pz, E) vector, with the mass clipped at 0."""
+    pt2 = px * px + py * py
+    pt = np.sqrt(pt2)
+    p = np.sqrt(pt2 + pz * pz)
+    # arcsinh(pz / pt) = log((p + |pz|) / pt), odd in pz
+    eta = np.log((p + abs(pz)) / pt)
+    return (
+        pt,
+        eta if pz >= 0 else -eta,
+        np.arctan2(py, px),
+        np.sqrt(max(energy * energy - p * p, 0.0)),
+    )
+
+
+@njit(cache=True)
+def sum_ptetaphim(pt_1, eta_1, phi_1, mass_1, pt_2, eta_2, phi_2, mass_2):
+    """(pt, eta, phi, mass) of the sum of two (pt, eta, phi, mass) vectors."""
+    px_1, py_1, pz_1, energy_1 = to_cartesian(pt_1, eta_1, phi_1, mass_1)
+    px_2, py_2, pz_2, energy_2 = to_cartesian(pt_2, eta_2, phi_2, mass_2)
+    return from_cartesian(px_1 + px_2, py_1 + py_2, pz_1 + pz_2, energy_1 + energy_2)
+
+
+@njit(cache=True)
+def store_cartesian(out, px_out, i, px, py, pz, energy):
+    """
+    Store pt, pz / pt, py and the mass of a (px, py, pz, E) vector in out[:, i] and
+    px in px_out[i], to be converted to (pt, eta, phi, mass) by _finish_ptetaphim.
+    """
+    pt2 = px * px + py * py
+    pt = np.sqrt(pt2)
+    out[0, i] = pt
+    out[1, i] = pz / pt
+    out[2, i] = py
+    out[3, i] = np.sqrt(max(energy * energy - pt2 - pz * pz, 0.0))
+    px_out[i] = px
+
+
+def _finish_ptetaphim(out, px):
+    # eta = arcsinh(pz / pt) and phi = arctan2(py, px), in place
+    np.arcsinh(out[1], out=out[1])
+    np.arctan2(out[2], px, out=out[2])
+    return out
+
+
+@njit(cache=True)
+def _add(
+    pt_1, mass_1, exp_eta_1, cos_phi_1, sin_phi_1,
+    pt_2, mass_2, exp_eta_2, cos_phi_2, sin_phi_2,
+    out, px_out,
+):
+    for i in range(pt_1.shape[0]):
+        px_1, py_1, pz_1, energy_1 = cartesian_from_trig(
+            pt_1[i], mass_1[i], exp_eta_1[i], cos_phi_1[i], sin_phi_1[i]
+        )
+        px_2, py_2, pz_2, energy_2 = cartesian_from_trig(
+            pt_2[i], mass_2[i], exp_eta_2[i], cos_phi_2[i], sin_phi_2[i]
+        )
+        store_cartesian(
+            out, px_out, i, px_1 + px_2, py_1 + py_2, pz_1 + pz_2, energy_1 + energy_2
+        )
+    return out
+
+
+def add(vector_1, vector_2):
+    """
+    Sum of two vectors per event.
+
+    Parameters:
+    vector_1 (tuple): (pt, eta, phi, mass) arrays.
+    vector_2 (tuple): (pt, eta, phi, mass) arrays.
+
+    Returns:
+    numpy.ndarray: (4, n_events) pt, eta, phi and mass of the sum, in float64.
+    """
+    trig_1 = _trig_arrays(vector_1)
+    num_events = trig_1[0].shape[0]
+    px = np.empty(num_events, np.float64)
+    out = _add(
+        *trig_1,
+        *_trig_arrays(vector_2),
+        np.empty((4, num_events), np.float64),
+        px,
+    )
+    return _finish_ptetaphim(out, px)
+
+
+@njit(cache=True)
+def _invariant_mass(
+    pt_1, mass_1, exp_eta_1, cos_phi_1, sin_phi_1,
+    pt_2, mass_2, exp_eta_2, cos_phi_2, sin_phi_2,
+):
+    out = np.empty(pt_1.shape[0], np.float64)
+    for i in range(pt_1.shape[0]):
+        px_1, py_1, pz_1, energy_1 = cartesian_from_trig(
+            pt_1[i], mass_1[i], exp_eta_1[i], cos_phi_1[i], sin_phi_1[i]
+        )
+        px_2, py_2, pz_2, energy_2 = cartesian_from_trig(
+            pt_2[i], mass_2[i], exp_eta_2[i], cos_phi_2[i], sin_phi_2[i]
+        )
+        px = px_1 + px_2
+        py = py_1 + py_2
+        pz = pz_1 + pz_2
+        energy = energy_1 + energy_2
+        out[i] = np.sqrt(max(energy * energy - px * px - py * py - pz * pz, 0.0))
+    return out
+
+
+def invariant_mass(vector_1, vector_2):
+    """Invariant mass of the sum of two (pt, eta, phi, mass) vectors per event."""
+    return _invariant_mass(*_trig_arrays(vector_1), *_trig_arrays(vector_2))
+
+
+@njit(cache=True)
+def delta_phi_scalar(phi_1, phi_2):
+    """phi_1 - phi_2 in [-pi, pi), as the coffea vectors."""
+    # (dphi + pi) % (2 pi) - pi, with floor instead of the slower fmod
+    dphi = np.float64(phi_1) - np.float64(phi_2)
+    return dphi - 2 * np.pi * np.floor((dphi + np.pi) / (2 * np.pi))
+
+
+@njit(cache=True)
+def delta_r_scalar(eta_1, phi_1, eta_2, phi_2):
+    delta_eta = np.float64(eta_1) - np.float64(eta_2)
+    dphi = delta_phi_scalar(phi_1, phi_2)
+    return np.sqrt(delta_eta * delta_eta + dphi * dphi)
+
+
+@njit(cache=True)
+def _delta_phi(phi_1, phi_2):
+    out = np.empty(phi_1.shape[0], np.float64)
+    for i in range(phi_1.shape[0]):
+        out[i] = delta_phi_scalar(phi_1[i], phi_2[i])
+    return out
+
+
+@njit(cache=True)
+def _delta_r(eta_1, phi_1, eta_2, phi_2):
+    out = np.empty(eta_1.shape[0], np.float64)
+    for i in range(eta_1.shape[0]):
+        out[i] = delta_r_scalar(eta_1[i], phi_1[i], eta_2[i], phi_2[i])
+    return out
+
+
+def delta_phi(phi_1, phi_2):
+    """Difference in phi per event, in [-pi, pi)."""
+    return _delta_phi(*_as_arrays((phi_1, phi_2)))
+
+
+def delta_r(eta_1, phi_1, eta_2, phi_2):
+    """Distance in the (eta, phi) plane per event."""
+    return _delta_r(*_as_arrays((eta_1, phi_1, eta_2, phi_2)))
+
+
+@njit(cache=True)
+def _pairwise_delta_r(offsets, eta, phi, max_num_objects, out):
+    for iev in range(offsets.shape[0] - 1):
+        start = offsets[iev]
+        stop = min(offsets[iev + 1], start + max_num_objects)
+        dr_min = np.inf
+        dr_max = -np.inf
+        dr_sum = 0.0
+        for i in range(start, stop):
+            for j in range(i + 1, stop):
+                dr = delta_r_scalar(eta[i], phi[i], eta[j], phi[j])
+                dr_min = min(dr_min, dr)
+                dr_max = max(dr_max, dr)
+                dr_sum += dr
+        num_pairs = (stop - start) * (stop - start - 1) // 2
+        if num_pairs > 0:
+            out[0, iev] = dr_min
+            out[1, iev] = dr_max
+            out[2, iev] = dr_sum / num_pairs
+        else:
+            out[:, iev] = np.nan
+    return out
+
+
+def pairwise_delta_r(eta, phi, max_num_objects=None):
+    """
+    Minimum, maximum and mean delta R over the unique pairs of objects of each event,
+    read from the jagged eta and phi arrays of a collection.
+
+    Parameters:
+    eta (ak.Array): jagged eta of the collection.
+    phi (ak.Array): jagged phi of the collection.
+    max_num_objects (int): only the first max_num_objects objects of each event are
+        paired, all of them if None.
+
+    Returns:
+    dict: "min", "max" and "mean" arrays, None for the events with less than two
+        objects.
+    """
+    offsets = np.zeros(len(eta) + 1, dtype=np.int64)
+    np.cumsum(ak.to_numpy(ak.num(eta, axis=1)), out=offsets[1:])
+    out = _pairwise_delta_r(
+        offsets,
+        *_as_arrays((ak.flatten(eta, axis=1), ak.flatten(phi, axis=1))),
+        np.iinfo(np.int64).max if max_num_objects is None else max_num_objects,
+        np.empty((3, len(eta)), np.float64),
+    )
+    return {
+        name: ak.Array(np.ma.masked_invalid(values))
+        for name, values in zip(("min", "max", "mean"), out)
+    }
+
+
+@njit(cache=True)
+def _delta_r_pairs(eta, phi, out):
+    num_objects = eta.shape[0]
+    for iev in range(eta.shape[1]):
+        pair = 0
+        for i in range(num_objects):
+            for j in range(i + 1, num_objects):
+                out[pair, iev] = delta_r_scalar(
+                    eta[i, iev], phi[i, iev], eta[j, iev], phi[j, iev]
+                )
+                pair += 1
+    return out
+
+
+def delta_r_pairs(eta, phi):
+    """
+    Delta R of all the unique pairs of a list of objects with one entry per event,
+    in the order (0, 1), (0, 2), ..., (1, 2), ...
+
+    Parameters:
+    eta (list): eta arrays of the objects, which can have missing entries.
+    phi (list): phi arrays of the objects.
+
+    Returns:
+    list: delta R array of each pair, masked where one of the objects is missing.
+    """
+    eta, phi = (
+        np.ma.stack(
+            [
+                ak.to_numpy(values, allow_missing=True)
+                if isinstance(values, ak.Array)
+                else values
+                for values in arrays
+            ]
+        )
+        for arrays in (eta, phi)
+    )
+    missing = np.ma.getmaskarray(eta) | np.ma.getmaskarray(phi)
+    out = _delta_r_pairs(
+        np.ascontiguousarray(eta.filled(0)),
+        np.ascontiguousarray(phi.filled(0)),
+        np.empty((len(eta) * (len(eta) - 1) // 2, eta.shape[1]), np.float64),
+    )
+    if not missing.any():
+        return list(out)
+    return [
+        np.ma.masked_array(out[pair], missing[i] | missing[j])
+        for pair, (i, j) in enumerate(
+            (i, j) for i in range(len(eta)) for j in range(i + 1, len(eta))
+        )
+    ]
+
+
+@njit(cache=True)
+def boost_cartesian(px, py, pz, energy, beta_x, beta_y, beta_z):
+    """
+    (px, py, pz, E) of a vector in the frame moving with velocity beta with
+    respect to the current one.
+    """
+    beta2 = beta_x * beta_x + beta_y * beta_y + beta_z * beta_z
+    if beta2 == 0.0:
+        return px, py, pz, energy
+    gamma = 1.0 / np.sqrt(1.0 - beta2)
+    beta_p = beta_x * px + beta_y * py + beta_z * pz
+    factor = (gamma - 1.0) * beta_p / beta2 - gamma * energy
+    return (
+        px + factor * beta_x,
+        py + factor * beta_y,
+        pz + factor * beta_z,
+        gamma * (energy - beta_p),
+    )
+
+
+@njit(cache=True)
+def _boost(pt, mass, exp_eta, cos_phi, sin_phi, beta_x, beta_y, beta_z):
+    out = np.empty((4, pt.shape[0]), np.float64)
+    for i in range(pt.shape[0]):
+        px, py, pz, energy = cartesian_from_trig(
+            pt[i], mass[i], exp_eta[i], cos_phi[i], sin_phi[i]
+        )
+        out[0, i], out[1, i], out[2, i], out[3, i] = boost_cartesian(
+            px, py, pz, energy, beta_x[i], beta_y[i], beta_z[i]
+        )
+    return out
+
+
+def boost(vector, beta):
+    """
+    Boost of a vector per event.
+
+    Parameters:
+    vector (tuple): (pt, eta, phi, mass) arrays.
+    beta (tuple): (beta_x, beta_y, beta_z) arrays, velocity of the new frame.
+
+    Returns:
+    numpy.ndarray: (4, n_events) px, py, pz and E in the new frame.
+    """
+    return _boost(*_trig_arrays(vector), *_as_arrays(beta))
+
+
+@njit(cache=True)
+def _boost_vector(pt, mass, exp_eta, cos_phi, sin_phi):
+    out = np.empty((3, pt.shape[0]), np.float64)
+    for i in range(pt.shape[0]):
+        px, py, pz, energy = cartesian_from_trig(
+            pt[i], mass[i], exp_eta[i], cos_phi[i], sin_phi[i]
+        )
+        out[0, i] = px / energy
+        out[1, i] = py / energy
+        out[2, i] = pz / energy
+    return out
+
+
+def boost_vector(vector):
+    """(3, n_events) velocity of the rest frame of a (pt, eta, phi, mass) vector."""
+    return _boost_vector(*_trig_arrays(vector))
+
+
+@njit(cache=True)
+def cos_theta_in_rest_frame_scalar(
+    pt_booster, eta_booster, phi_booster, mass_booster, pt, eta, phi, mass
+):
+    """
+    cos(theta) of a vector in the rest frame of the booster, with respect to the
+    z axis of the lab, as TLorentzVector::CosTheta after a Boost(-BoostVector()).
+    """
+    return cos_theta_in_rest_frame_cartesian(
+        to_cartesian(pt_booster, eta_booster, phi_booster, mass_booster),
+        to_cartesian(pt, eta, phi, mass),
+    )
+
+
+@njit(cache=True)
+def cos_theta_in_rest_frame_cartesian(booster, vector):
+    """cos_theta_in_rest_frame_scalar of two (px, py, pz, E) tuples."""
+    px_b, py_b, pz_b, energy_b = booster
+    px, py, pz, energy = boost_cartesian(
+        *vector, px_b / energy_b, py_b / energy_b, pz_b / energy_b
+    )
+    return pz / np.sqrt(px * px + py * py + pz * pz)
+
+
+@njit(cache=True)
+def _cos_theta_in_rest_frame(
+    pt_booster, mass_booster, exp_eta_booster, cos_phi_booster, sin_phi_booster,
+    pt, mass, exp_eta, cos_phi, sin_phi,
+    out,
+):
+    for i in range(pt.shape[0]):
+        out[i] = cos_theta_in_rest_frame_cartesian(
+            cartesian_from_trig(
+                pt_booster[i], mass_booster[i], exp_eta_booster[i],
+                cos_phi_booster[i], sin_phi_booster[i],
+            ),
+            cartesian_from_trig(pt[i], mass[i], exp_eta[i], cos_phi[i], sin_phi[i]),
+        )
+    return out
+
+
+def cos_theta_in_rest_frame(booster, vector, out=None):
+    """
+    cos(theta) of a vector in the rest frame of the booster per event, e.g. the
+    helicity angle of a jet in the rest frame of its Higgs candidate.
+
+    Parameters:
+    booster (tuple): (pt, eta, phi, mass) arrays of the rest frame.
+    vector (tuple): (pt, eta, phi, mass) arrays of the boosted vector.
+    out (numpy.ndarray): float64 array filled with the result, allocated if None.
+
+    Returns:
+    numpy.ndarray: cos(theta) per event.
+    """
+    vector = _trig_arrays(vector)
+    if out is None:
+        out = np.empty(vector[0].shape[0], np.float64)
+    return _cos_theta_in_rest_frame(*_trig_arrays(booster), *vector, out)
+
+
+@njit(cache=True)
+def cos_theta_collins_soper_cartesian(vector_1, vector_2):
+    """
+    cos(theta) of the first of two (px, py, pz, E) tuples in the Collins-Soper frame
+    of their sum, whose z axis bisects the beam axes boosted in its rest frame,
+    oriented along the pz of the sum.
+    """
+    px = vector_1[0] + vector_2[0]
+    py = vector_1[1] + vector_2[1]
+    pz = vector_1[2] + vector_2[2]
+    energy = vector_1[3] + vector_2[3]
+    beta_x, beta_y, beta_z = px / energy, py / energy, pz / energy
+
+    px_1, py_1, pz_1, _ = boost_cartesian(*vector_1, beta_x, beta_y, beta_z)
+    # directions of the two beams in the rest frame, massless so |p| = E
+    bx_1, by_1, bz_1, be_1 = boost_cartesian(0.0, 0.0, 1.0, 1.0, beta_x, beta_y, beta_z)
+    bx_2, by_2, bz_2, be_2 = boost_cartesian(0.0, 0.0, -1.0, 1.0, beta_x, beta_y, beta_z)
+    axis_x = bx_1 / be_1 - bx_2 / be_2
+    axis_y = by_1 / be_1 - by_2 / be_2
+    axis_z = bz_1 / be_1 - bz_2 / be_2
+
+    cos_theta = (px_1 * axis_x + py_1 * axis_y + pz_1 * axis_z) / np.sqrt(
+        (px_1 * px_1 + py_1 * py_1 + pz_1 * pz_1)
+        * (axis_x * axis_x + axis_y * axis_y + axis_z * axis_z)
+    )
+    return cos_theta if pz >= 0 else -cos_theta
+
+
+@njit(cache=True)
+def _cos_theta_collins_soper(
+    pt_1, mass_1, exp_eta_1, cos_phi_1, sin_phi_1,
+    pt_2, mass_2, exp_eta_2, cos_phi_2, sin_phi_2,
+    out,
+):
+    for i in range(pt_1.shape[0]):
+        out[i] = cos_theta_collins_soper_cartesian(
+            cartesian_from_trig(
+                pt_1[i], mass_1[i], exp_eta_1[i], cos_phi_1[i], sin_phi_1[i]
+            ),
+            cartesian_from_trig(
+                pt_2[i], mass_2[i], exp_eta_2[i], cos_phi_2[i], sin_phi_2[i]
+            ),
+        )
+    return out
+
+
+def cos_theta_collins_soper(vector_1, vector_2):
+    """
+    cos(theta*) of the first vector in the Collins-Soper frame of the pair per event,
+    e.g. of the leading Higgs candidate in the HH system.
+
+    Parameters:
+    vector_1 (tuple): (pt, eta, phi, mass) arrays of the vector whose angle is computed.
+    vector_2 (tuple): (pt, eta, phi, mass) arrays of the other vector of the pair.
+
+    Returns:
+    numpy.ndarray: cos(theta*) per event, in float64.
+    """
+    vector_1 = _trig_arrays(vector_1)
+    return _cos_theta_collins_soper(
+        *vector_1,
+        *_trig_arrays(vector_2),
+        np.empty(vector_1[0].shape[0], np.float64),
+    )
+
+
+@njit(cache=True)
+def _pair_variables(
+    eta_1, phi_1, pt_1, mass_1, exp_eta_1, cos_phi_1, sin_phi_1,
+    eta_2, phi_2, pt_2, mass_2, exp_eta_2, cos_phi_2, sin_phi_2,
+    pair, px_out,
+):
+    num_events = pt_1.shape[0]
+    # cos(theta) of the two vectors and of their sum, dR, dEta and dPhi
+    angles = np.empty((6, num_events), np.float64)
+    for i in range(num_events):
+        px_1, py_1, pz_1, energy_1 = cartesian_from_trig(
+            pt_1[i], mass_1[i], exp_eta_1[i], cos_phi_1[i], sin_phi_1[i]
+        )
+        px_2, py_2, pz_2, energy_2 = cartesian_from_trig(
+            pt_2[i], mass_2[i], exp_eta_2[i], cos_phi_2[i], sin_phi_2[i]
+        )
+        px = px_1 + px_2
+        py = py_1 + py_2
+        pz = pz_1 + pz_2
+        store_cartesian(pair, px_out, i, px, py, pz, energy_1 + energy_2)
+        angles[0, i] = pz_1 / np.sqrt(px_1 * px_1 + py_1 * py_1 + pz_1 * pz_1)
+        angles[1, i] = pz_2 / np.sqrt(px_2 * px_2 + py_2 * py_2 + pz_2 * pz_2)
+        angles[2, i] = pz / np.sqrt(px * px + py * py + pz * pz)
+        angles[3, i] = delta_r_scalar(eta_1[i], phi_1[i], eta_2[i], phi_2[i])
+        angles[4, i] = np.float64(eta_1[i]) - np.float64(eta_2[i])
+        angles[5, i] = delta_phi_scalar(phi_1[i], phi_2[i])
+    return angles
+
+
+def pair_variables(vector_1, vector_2):
+    """
+    Sum of two vectors per event and their angular variables, in a single pass.
+
+    Parameters:
+    vector_1 (tuple): (pt, eta, phi, mass) arrays.
+    vector_2 (tuple): (pt, eta, phi, mass) arrays.
+
+    Returns:
+    numpy.ndarray: (4, n_events) pt, eta, phi and mass of the sum.
+    dict: "cos_theta_1", "cos_theta_2" and "cos_theta" (of the sum) in the lab
+        frame, "dR", "dEta" (eta_1 - eta_2) and "dPhi" (phi_1 - phi_2) arrays.
+    """
+    vector_1 = _as_arrays(vector_1)
+    vector_2 = _as_arrays(vector_2)
+    num_events = vector_1[0].shape[0]
+    px = np.empty(num_events, np.float64)
+    pair = np.empty((4, num_events), np.float64)
+    angles = _pair_variables(
+        *vector_1[1:3],
+        *_trig_arrays(vector_1),
+        *vector_2[1:3],
+        *_trig_arrays(vector_2),
+        pair,
+        px,
+    )
+    _finish_ptetaphim(pair, px)
+    return pair, dict(
+        zip(("cos_theta_1", "cos_theta_2", "cos_theta", "dR", "dEta", "dPhi"), angles)
+    )
+
+
+def get_ptetaphim(collection):
+    """(pt, eta, phi, mass) numpy arrays of a collection with one object per event."""
+    return _as_arrays(tuple(collection[field] for field in PTETAPHIM_FIELDS))
+
+
+def zip_ptetaphim(vector, dtype=np.float32, behavior=None, **fields):
+    """
+    PtEtaPhiMLorentzVector records from (pt, eta, phi, mass) arrays, with the
+    additional fields given as keyword arguments, all stored as dtype.
+
+    The records get the behaviours of the events once stored in them, or the given
+    behavior, e.g. the one of the collection they were computed from.
+    """
+    fields = {**dict(zip(PTETAPHIM_FIELDS, vector)), **fields}
+    return ak.zip(
+        {field: np.asarray(values, dtype=dtype) for field, values in fields.items()},
+        with_name="PtEtaPhiMLorentzVector",
+        behavior=behavior,
+    )
+
+
+def _trig_arrays(vector):
+    # pt, mass, exp(eta), cos(phi) and sin(phi) of a vector, for the array kernels
+    pt, eta, phi, mass = _as_arrays(vector)
+    return pt, mass, np.exp(eta), np.cos(phi), np.sin(phi)
+
+
+def _as_arrays(arrays):
+    return tuple(
+        np.ascontiguousarray(ak.to_numpy(array, allow_missing=False))
+        if isinstance(array, ak.Array)
+        else np.ascontiguousarray(array)
+        for array in arrays
+    )
@@ -0,0 +1,237 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+# numpy type of the ONNX tensor types used by the models
+ONNX_NUMPY_TYPES = {
+    "tensor(float)": np.float32,
+    "tensor(double)": np.float64,
+    "tensor(bool)": np.bool_,
+    "tensor(int64)": np.int64,
+    "tensor(int32)": np.int32,
+}
+
+
+def resolve_shape(tensor, num_events, max_num_jets):
+    # the first dimension is the batch, the other dynamic ones are the jets
+    return (num_events,) + tuple(
+        dim if isinstance(dim, int) else max_num_jets for dim in tensor.shape[1:]
+    )
+
+
+class InferenceSessionHolder:
+    """
+    ONNX Runtime session bound to growable buffers reused across chunks.
+
+    The inputs are read from, and the outputs written to, preallocated numpy
+    buffers through an IOBinding, so that ONNX Runtime does not allocate new
+    output tensors at every call. The first num_assignments outputs are written
+    in a single (num_assignments, n_events, ...) buffer, which is the layout
+    expected by extract_predictions.
+
+    The buffers are owned by the thread calling the session, so the arrays
+    returned by run are valid until the next call from the same thread.
+    """
+
+    def __init__(self, session, num_assignments=2):
+        self.session = session
+        self.num_assignments = num_assignments
+        self.inputs = session.get_inputs()
+        self.outputs = session.get_outputs()
+        self.input_name = [tensor.name for tensor in self.inputs]
+        self.output_name = [tensor.name for tensor in self.outputs]
+        self._local = threading.local()
+
+    @property
+    def _buffers(self):
+        if not hasattr(self._local, "buffers"):
+            self._local.buffers = {}
+            self._local.io_binding = self.session.io_binding()
+        return self._local.buffers
+
+    @property
+    def _io_binding(self):
+        self._buffers
+        return self._local.io_binding
+
+    def get_buffer(self, name, shape, dtype):
+        """
+        Return a contiguous (shape) view of the buffer called name.
+
+        The buffer is only reallocated when it is too small, and then with some
+        headroom to avoid growing it at every chunk.
+        """
+        size = int(np.prod(shape))
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.dtype != dtype or buffer.size < size:
+            buffer = np.empty(int(size * 1.25) + 1, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer[:size].reshape(shape)
+
+    def get_input_buffers(self, shapes):
+        """Input buffers of the model, with the given shapes."""
+        return [
+            self.get_buffer(tensor.name, shape, ONNX_NUMPY_TYPES[tensor.type])
+            for tensor, shape in zip(self.inputs, shapes)
+        ]
+
+    def get_output_buffers(self, num_events, max_num_jets):
+        """
+        Output buffers of the model for num_events events.
+
+        Returns:
+        numpy.ndarray: (num_assignments, n_events, ...) assignment outputs.
+        list: views of all the outputs of the model.
+        """
+        assignment_tensor = self.outputs[0]
+        assignment = self.get_buffer(
+            "assignment",
+            (self.num_assignments,)
+            + resolve_shape(assignment_tensor, num_events, max_num_jets),
+            ONNX_NUMPY_TYPES[assignment_tensor.type],
+        )
+        outputs = [assignment[i] for i in range(self.num_assignments)] + [
+            self.get_buffer(
+                tensor.name,
+                resolve_shape(tensor, num_events, max_num_jets),
+                ONNX_NUMPY_TYPES[tensor.type],
+            )
+            for tensor in self.outputs[self.num_assignments :]
+        ]
+        return assignment, outputs
+
+    def run_batch(self, inputs, outputs, start, stop):
+        """Evaluate the model on the events [start, stop) of the buffers."""
+        io_binding = self._io_binding
+        io_binding.clear_binding_inputs()
+        io_binding.clear_binding_outputs()
+        for name, array in zip(self.input_name, inputs):
+            self._bind(io_binding.bind_input, name, array[start:stop])
+        for name, array in zip(self.output_name, outputs):
+            self._bind(io_binding.bind_output, name, array[start:stop])
+        self.session.run_with_iobinding(io_binding)
+
+    def run(self, inputs, max_num_jets, batch_size=None):
+        """
+        Evaluate the model in slices of batch_size events.
+
+        Parameters:
+        inputs (list): input arrays, e.g. from get_input_buffers.
+        max_num_jets (int): size of the dynamic dimensions of the outputs.
+        batch_size (int): number of events per call, None for a single call.
+
+        Returns:
+        numpy.ndarray: (num_assignments, n_events, ...) assignment outputs.
+        list: views of all the outputs of the model.
+        """
+        num_events = inputs[0].shape[0]
+        assignment, outputs = self.get_output_buffers(num_events, max_num_jets)
+
+        batch_size = batch_size or max(num_events, 1)
+        for start in range(0, num_events, batch_size):
+            self.run_batch(inputs, outputs, start, min(start + batch_size, num_events))
+
+        return assignment, outputs
+
+    @staticmethod
+    def _bind(bind, name, array):
+        bind(name, "cpu", 0, array.dtype.type, array.shape, array.ctypes.data)
+
+
+# Sessions of the process, shared by all the executors and threads
+_session_registry = {}
+_session_registry_lock = threading.Lock()
+_session_registry_stats = {"created": 0, "creation_time": 0.0}
+_default_session_options = {}
+
+
+def set_default_session_options(**session_options):
+    """
+    Session options used when get_inference_session is called without any, e.g.
+    the ones sized by the executor for the cores of the worker process.
+    """
+    with _session_registry_lock:
+        _default_session_options.clear()
+        _default_session_options.update(session_options)
+
+
+def set_numba_num_threads():
+    """
+    Set the numba threads of the calling thread to the intra-op threads of the
+    default session options, if any.
+
+    numba.set_num_threads only applies to the calling thread, so it has to be called
+    by the thread processing the chunk, e.g. at the start of the workflow.
+    """
+    with _session_registry_lock:
+        num_threads = _default_session_options.get("intra_op_num_threads")
+    if num_threads:
+        import numba
+
+        numba.set_num_threads(min(num_threads, numba.config.NUMBA_NUM_THREADS))
+
+
+def get_inference_session(
+    model_path, providers=("CPUExecutionProvider",), **session_options
+):
+    """
+    InferenceSessionHolder of a model, created once per process.
+
+    The sessions are keyed by model path, session options and providers, so that
+    the dask worker plugin and the workflows on any executor share the same one.
+
+    Parameters:
+    model_path (str): path of the onnx model.
+    providers (tuple): execution providers of ONNX Runtime.
+    session_options: attributes of ort.SessionOptions, e.g. intra_op_num_threads=1.
+        graph_optimization_level is ORT_ENABLE_ALL by default. If none is given,
+        the ones of set_default_session_options are used.
+
+    Returns:
+    InferenceSessionHolder: session of the model.
+    """
+    if not session_options:
+        with _session_registry_lock:
+            session_options = dict(_default_session_options)
+    key = (
+        os.path.abspath(model_path),
+        tuple(providers),
+        tuple(sorted(session_options.items())),
+    )
+    with _session_registry_lock:
+        holder = _session_registry.get(key)
+        if holder is None:
+            import onnxruntime as ort
+
+            start = time.perf_counter()
+            sess_options = ort.SessionOptions()
+            sess_options.graph_optimization_level = (
+                ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            )
+            for name, value in session_options.items():
+                setattr(sess_options, name, value)
+            holder = InferenceSessionHolder(
+                ort.InferenceSession(
+                    model_path, sess_options=sess_options, providers=list(providers)
+                )
+            )
+            _session_registry[key] = holder
+            _session_registry_stats["created"] += 1
+            _session_registry_stats["creation_time"] += time.perf_counter() - start
+    return holder
+
+
+def get_session_registry_stats(reset=False):
+    """
+    Number of sessions created by the process and seconds spent creating them.
+
+    With reset=True the counters restart from zero, so that each creation is
+    reported once when the statistics are collected at every chunk.
+    """
+    with _session_registry_lock:
+        stats = dict(_session_registry_stats)
+        if reset:
+            _session_registry_stats.update(created=0, creation_time=0.0)
+    return stats
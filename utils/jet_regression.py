@@ -0,0 +1,81 @@
+# PNet regression of the jet pt and mass. All the variants used by the workflows are
+# computed in a single pass over the flat jet buffers and zipped once, instead of
+# recomputing (1 - rawFactor) * PNetRegPtRawCorr in each ak.where.
+
+import awkward as ak
+import numpy as np
+from numba import njit
+
+PNET_REGRESSION_VARIANTS = ("Raw", "PNetReg", "PNetRegNeutrino")
+PNET_REGRESSION_FIELDS = tuple(
+    f"{field}{variant}"
+    for variant in PNET_REGRESSION_VARIANTS
+    for field in ("pt", "mass")
+)
+PNET_REGRESSION_INPUTS = (
+    "pt",
+    "mass",
+    "rawFactor",
+    "PNetRegPtRawCorr",
+    "PNetRegPtRawCorrNeutrino",
+)
+
+
+@njit(cache=True)
+def _pnet_regression(pt, mass, raw_factor, reg_corr, reg_corr_neutrino, fallback, out):
+    for i in range(pt.shape[0]):
+        raw = 1.0 - raw_factor[i]
+        out[0, i] = pt[i] * raw
+        out[1, i] = mass[i] * raw
+        if fallback and not reg_corr[i] > 0:
+            # no regression for this jet, the corrected pt and mass are kept
+            out[2, i] = out[4, i] = pt[i]
+            out[3, i] = out[5, i] = mass[i]
+        else:
+            out[2, i] = out[0, i] * reg_corr[i]
+            out[3, i] = out[1, i] * reg_corr[i]
+            out[4, i] = out[2, i] * reg_corr_neutrino[i]
+            out[5, i] = out[3, i] * reg_corr_neutrino[i]
+    return out
+
+
+def get_pnet_regression(jets, fallback=True):
+    """
+    Raw, PNet-regressed and PNet-regressed with neutrinos pt and mass of the jets.
+
+    Parameters:
+    jets (ak.Array): jagged jet collection with the PNET_REGRESSION_INPUTS fields.
+    fallback (bool): if True, the jets with PNetRegPtRawCorr <= 0 keep their
+        corrected pt and mass in the regressed variants, as in the HH4b workflows.
+        If False, the regression factors are always applied, as in the JME workflow.
+
+    Returns:
+    ak.Array: jagged records with the PNET_REGRESSION_FIELDS fields, e.g. ptRaw,
+        massPNetReg, ptPNetRegNeutrino, in the dtype of the jet pt.
+    """
+    inputs = [
+        np.ascontiguousarray(
+            ak.to_numpy(ak.flatten(jets[field], axis=1), allow_missing=False)
+        )
+        for field in PNET_REGRESSION_INPUTS
+    ]
+    out = _pnet_regression(
+        *inputs,
+        fallback,
+        np.empty((len(PNET_REGRESSION_FIELDS), len(inputs[0])), dtype=inputs[0].dtype),
+    )
+    return ak.unflatten(
+        ak.zip(dict(zip(PNET_REGRESSION_FIELDS, out))), ak.num(jets, axis=1)
+    )
+
+
+def with_pnet_regression(jets, regression, variant="PNetRegNeutrino"):
+    """
+    Jets with the pt and mass of a variant of get_pnet_regression.
+
+    The fields are replaced with ak.with_field, which does not copy the other
+    fields of the jets.
+    """
+    for field in ("pt", "mass"):
+        jets = ak.with_field(jets, regression[f"{field}{variant}"], field)
+    return jets
@@ -0,0 +1,209 @@
+# Warm-up of the numba kernels used by the HH4b workflows.
+# The kernels are compiled with cache=True, so pointing NUMBA_CACHE_DIR to a shared
+# directory and filling it once ahead of time, e.g. on the submission node with
+#   python utils/numba_warmup.py --cache-dir /work/$USER/numba_cache
+# lets every worker load the compiled machine code instead of running the JIT.
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numba
+import numpy as np
+import awkward as ak
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+# modules defining numba kernels with cache=True
+NUMBA_KERNEL_MODULES = (
+    "utils.prediction_selection",
+    "utils.parton_matching_function",
+    "utils.spanet_evaluation_functions",
+    "utils.reconstruct_higgs_candidates",
+    "utils.fourvec",
+    "utils.jet_regression",
+)
+
+
+def set_numba_cache_dir(cache_dir):
+    """
+    Store the numba cache in cache_dir instead of the __pycache__ of the sources.
+
+    Numba fixes the cache location of a kernel when it is defined, so this only
+    applies to the modules imported afterwards. When some of them are already
+    imported, e.g. by the config in the iterative executor or the futures thread
+    pool, a warning is issued: export NUMBA_CACHE_DIR before Python starts instead.
+    """
+    cache_dir = os.path.abspath(cache_dir)
+    imported = [module for module in NUMBA_KERNEL_MODULES if module in sys.modules]
+    current = numba.config.CACHE_DIR
+    if imported and (not current or os.path.abspath(current) != cache_dir):
+        warnings.warn(
+            f"The numba cache directory {cache_dir} is not used by the kernels of "
+            f"{', '.join(imported)}, which were imported before it was set. "
+            "Export NUMBA_CACHE_DIR before starting Python instead.",
+            RuntimeWarning,
+            stacklevel=2,
+        )
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ["NUMBA_CACHE_DIR"] = cache_dir
+    numba.config.CACHE_DIR = cache_dir
+
+
+def _warmup_prediction_selection(max_num_jets):
+    from utils.prediction_selection import (
+        extract_predictions,
+        extract_pairings,
+        extract_topk_predictions,
+    )
+
+    predictions = np.random.default_rng(0).random(
+        (2, 2, max_num_jets, max_num_jets), dtype=np.float32
+    )
+    extract_predictions(predictions)
+    extract_pairings(predictions)
+    extract_topk_predictions(predictions, 2)
+
+
+def _warmup_parton_matching():
+    from utils.parton_matching_function import (
+        _get_copy_pointers_parallel,
+        _get_copy_pointers_serial,
+    )
+
+    # Two events with the chain H -> b b and b -> b for the first b-quark,
+    # built with the same types as the flattened NanoAOD GenPart collection
+    children_idxG = ak.Array([[[1, 2], [3], [], []], [[1, 2], [3], [], []]])
+    children_idxG = ak.values_astype(children_idxG, np.int64) + np.array([0, 4])
+    genpart_pdgId = ak.values_astype(ak.Array([[25, 5, -5, 5]] * 2), np.int32)
+    genpart_LastCopy = ak.Array([[True, False, True, True]] * 2)
+    genpart_pt = ak.values_astype(ak.Array([[100.0, 50.0, 40.0, 45.0]] * 2), np.float32)
+
+    genpart_offsets = np.concatenate(
+        [[0], np.cumsum(ak.to_numpy(ak.num(genpart_pdgId, axis=1)))]
+    )
+    # contiguous global indices, as FlatGenParticles.reverse_index
+    genpart_reverse_index = np.zeros(len(genpart_offsets) - 1, dtype=np.int64)
+
+    # both kernels, since the serial one is used for the small chunks, with the
+    # same types as in get_genpart_copy_tables
+    for kernel in (_get_copy_pointers_serial, _get_copy_pointers_parallel):
+        kernel(
+            ak.flatten(children_idxG, axis=1),
+            ak.to_numpy(ak.flatten(genpart_pdgId)),
+            ak.to_numpy(ak.flatten(genpart_LastCopy)),
+            ak.to_numpy(ak.flatten(genpart_pt)),
+            np.array([-1, 0, 0, 1, -1, 4, 4, 5], dtype=np.int64),
+            genpart_offsets,
+            genpart_reverse_index,
+        )
+
+
+def _warmup_higgs_reconstruction():
+    from utils.reconstruct_higgs_candidates import _reconstruct_higgs_from_idx
+
+    # one event with four jets, with the types of the NanoAOD Jet collection
+    jet_features = [
+        np.array(values, dtype=np.float32)
+        for values in (
+            [80.0, 60.0, 50.0, 40.0],
+            [0.5, -1.0, 1.2, 0.1],
+            [0.3, 2.0, -1.5, -2.8],
+            [10.0, 8.0, 7.0, 6.0],
+        )
+    ]
+    _reconstruct_higgs_from_idx(
+        np.array([0, 4], dtype=np.int64),
+        *jet_features,
+        np.array([[[0, 2], [1, 3]]], dtype=np.int64),
+    )
+
+    from utils.fourvec import (
+        add,
+        cos_theta_collins_soper,
+        cos_theta_in_rest_frame,
+        delta_r,
+        delta_r_pairs,
+        pair_variables,
+        pairwise_delta_r,
+    )
+
+    # the Higgs candidates, stored in float32 as the jets
+    leading = tuple(values[:1] for values in jet_features)
+    subleading = tuple(values[1:2] for values in jet_features)
+    pair_variables(leading, subleading)
+    cos_theta_in_rest_frame(leading, subleading)
+    cos_theta_collins_soper(leading, subleading)
+    add(leading, subleading)
+    delta_r(leading[1], leading[2], subleading[1], subleading[2])
+    delta_r_pairs([leading[1], subleading[1]], [leading[2], subleading[2]])
+    pairwise_delta_r(
+        ak.unflatten(jet_features[1], [4]), ak.unflatten(jet_features[2], [4]), 4
+    )
+
+
+def _warmup_jet_regression():
+    from utils.jet_regression import PNET_REGRESSION_INPUTS, get_pnet_regression
+
+    # one event with two jets, one without regression
+    values = {
+        "pt": [50.0, 20.0],
+        "mass": [8.0, 4.0],
+        "rawFactor": [0.1, 0.2],
+        "PNetRegPtRawCorr": [1.05, 0.0],
+        "PNetRegPtRawCorrNeutrino": [1.02, 1.0],
+    }
+    jets = ak.zip(
+        {
+            field: ak.unflatten(np.array(values[field], dtype=np.float32), [2])
+            for field in PNET_REGRESSION_INPUTS
+        }
+    )
+    get_pnet_regression(jets)
+
+
+def warmup_numba_kernels(cache_dir=None, max_num_jets=5):
+    """
+    Compile, or load from the cache, the numba kernels of the workflows.
+
+    Parameters:
+    cache_dir (str): shared numba cache directory. If None, NUMBA_CACHE_DIR or the
+        default __pycache__ directories are used.
+    max_num_jets (int): number of jets of the SPANet model.
+
+    Returns:
+    float: time spent in seconds.
+    """
+    start = time.perf_counter()
+    if cache_dir:
+        set_numba_cache_dir(cache_dir)
+
+    _warmup_prediction_selection(max_num_jets)
+    _warmup_parton_matching()
+    _warmup_higgs_reconstruction()
+    _warmup_jet_regression()
+
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fill the numba cache of the HH4b kernels ahead of time"
+    )
+    parser.add_argument(
+        "-c",
+        "--cache-dir",
+        type=str,
+        default=os.environ.get("NUMBA_CACHE_DIR"),
+        help="Shared numba cache directory (default: NUMBA_CACHE_DIR)",
+    )
+    parser.add_argument(
+        "-j", "--max-num-jets", type=int, default=5, help="Number of jets per event"
+    )
+    args = parser.parse_args()
+
+    elapsed = warmup_numba_kernels(args.cache_dir, args.max_num_jets)
+    print(f"numba kernels ready in {elapsed:.1f} s")
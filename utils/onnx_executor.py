@@ -0,0 +1,166 @@
+# Executor factory creating the ONNX sessions of the SPANet models once per worker
+# process, for the iterative, futures and dask executors. Use it with
+#   pocket-coffea run --cfg <config> -e dask@T3_CH_PSI --custom-run-options <run_options>.yaml
+#       --executor-custom-setup onnx_executor.py
+# where onnx_executor.py imports get_executor_factory from this module.
+# Run options (all optional):
+#   spanet-models: model, list of models or {tag: model}, as the spanet_model workflow option
+#   spanet-quantization: quantized variant of the models, see utils/spanet_quantization.py
+#   spanet-max-num-jets: number of jets of the warm-up inference (default 5)
+#   onnx-session-options: attributes of ort.SessionOptions, overriding the automatic ones
+#   numba-cache-dir: shared numba cache directory
+#   executor-site: module of pocket_coffea.executors providing the dask executor
+#   futures-pool: "process" (default) or "thread" pool of the futures executor
+
+import asyncio
+import functools
+import importlib
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from dask.distributed import WorkerPlugin, Worker
+from pocket_coffea.executors import executors_base
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def get_onnx_setup(run_options, concurrent_tasks=1):
+    """
+    Setup of the ONNX sessions of a worker process, from the run options.
+
+    The intra-op threads of ONNX Runtime are the cores-per-worker shared by the
+    chunks processed at the same time by the process, and the inter-op ones are
+    not used by the sequential execution of the SPANet models.
+
+    Parameters:
+    run_options (dict): run options of pocket-coffea.
+    concurrent_tasks (int): number of chunks processed at the same time by a process.
+
+    Returns:
+    dict: setup passed to setup_worker_sessions.
+    """
+    cores = max(int(run_options.get("cores-per-worker", 1) or 1), 1)
+    session_options = {
+        "intra_op_num_threads": max(cores // concurrent_tasks, 1),
+        "inter_op_num_threads": 1,
+    }
+    session_options.update(run_options.get("onnx-session-options", None) or {})
+    return {
+        "models": run_options.get("spanet-models", None),
+        "quantization": run_options.get("spanet-quantization", None),
+        "max_num_jets": run_options.get("spanet-max-num-jets", 5),
+        "session_options": session_options,
+        "numba_cache_dir": run_options.get(
+            "numba-cache-dir", os.environ.get("NUMBA_CACHE_DIR")
+        ),
+    }
+
+
+def setup_worker_sessions(onnx_setup):
+    """
+    Prepare a worker process: load the numba kernels, create the sessions of the
+    models in the process-wide registry, with the given options as the default ones
+    of the workflows, and run a warm-up inference on each of them.
+
+    The numba threads are not set here: numba.set_num_threads only applies to the
+    calling thread, so the workflows set them from the default session options in
+    the thread processing each chunk (see set_numba_num_threads).
+    """
+    from utils.numba_warmup import warmup_numba_kernels
+
+    # compile (or load from the cache) the numba kernels before the first chunk
+    warmup_numba_kernels(onnx_setup["numba_cache_dir"], onnx_setup["max_num_jets"])
+
+    from utils.inference_session import (
+        get_inference_session,
+        set_default_session_options,
+    )
+    from utils.spanet_evaluation_functions import get_spanet_models
+    from utils.spanet_quantization import generate_spanet_inputs, resolve_spanet_model
+
+    set_default_session_options(**onnx_setup["session_options"])
+    inputs = generate_spanet_inputs(16, onnx_setup["max_num_jets"])
+    for model in get_spanet_models(onnx_setup["models"]).values():
+        session = get_inference_session(
+            resolve_spanet_model(model, onnx_setup["quantization"])
+        )
+        session.run(inputs, onnx_setup["max_num_jets"])
+
+
+class WorkerInferenceSessionPlugin(WorkerPlugin):
+    def __init__(self, run_options):
+        self.run_options = run_options
+
+    async def setup(self, worker: Worker):
+        # the chunks run in the threads of the worker, sharing its cores.
+        # The numba compilation and the warm-up inference are blocking, so they run
+        # in a thread, not to stall the event loop and the heartbeats of the worker.
+        await asyncio.get_running_loop().run_in_executor(
+            None,
+            setup_worker_sessions,
+            get_onnx_setup(self.run_options, worker.nthreads),
+        )
+
+
+class OnnxSessionsMixin:
+    """Create the sessions of the SPANet models once per worker process."""
+
+    def setup(self):
+        super().setup()
+        self.setup_sessions()
+
+    def setup_sessions(self):
+        # a single process runs the chunks
+        setup_worker_sessions(get_onnx_setup(self.run_options))
+
+
+class IterativeOnnxExecutorFactory(OnnxSessionsMixin, executors_base.IterativeExecutorFactory):
+    pass
+
+
+class FuturesOnnxExecutorFactory(OnnxSessionsMixin, executors_base.FuturesExecutorFactory):
+    def setup_sessions(self):
+        if self.run_options.get("futures-pool", "process") == "thread":
+            # the threads of the pool share the sessions of the main process
+            setup_worker_sessions(
+                get_onnx_setup(self.run_options, self.run_options["scaleout"])
+            )
+
+    def customized_args(self):
+        args = super().customized_args()
+        if self.run_options.get("futures-pool", "process") == "thread":
+            args["pool"] = ThreadPoolExecutor
+        else:
+            # every process of the pool prepares its sessions once, at start-up
+            args["pool"] = functools.partial(
+                ProcessPoolExecutor,
+                initializer=setup_worker_sessions,
+                initargs=(get_onnx_setup(self.run_options),),
+            )
+        return args
+
+
+@functools.lru_cache(maxsize=None)
+def get_dask_factory_class(site):
+    """Dask executor factory of a site, registering the session plugin on the workers."""
+    site_executors = importlib.import_module(f"pocket_coffea.executors.executors_{site}")
+
+    class DaskOnnxExecutorFactory(OnnxSessionsMixin, site_executors.DaskExecutorFactory):
+        def setup_sessions(self):
+            self.dask_client.register_worker_plugin(
+                WorkerInferenceSessionPlugin(self.run_options)
+            )
+
+    return DaskOnnxExecutorFactory
+
+
+def get_executor_factory(executor_name, **kwargs):
+    if executor_name == "iterative":
+        return IterativeOnnxExecutorFactory(**kwargs)
+    elif executor_name == "futures":
+        return FuturesOnnxExecutorFactory(**kwargs)
+    elif executor_name == "dask":
+        site = kwargs["run_options"].get("executor-site", "T3_CH_PSI")
+        return get_dask_factory_class(site)(**kwargs)
+    raise ValueError(f"Executor {executor_name} not supported by the ONNX executor")
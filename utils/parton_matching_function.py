@@ -2,93 +2,250 @@ import awkward as ak
 import numpy as np
 import numba
 from numba import njit
-from pocket_coffea.lib.parton_provenance import reverse_index_array
 
 
-@njit
-def get_parton_last_copy(
-    partons_idx,
-    partons_pdgId,
+# Below this number of events the threads cost more than they save
+PARALLEL_MIN_EVENTS = 5000
+
+
+@njit(cache=True)
+def fill_copy_pointers(
+    start,
+    stop,
+    shift,
+    children_idxG_flat,
+    genpart_pdgId_flat,
+    genpart_LastCopy_flat,
+    genpart_pt_flat,
+    genpart_mother_flat,
+    next_copy,
+    previous_copy,
+):
+    """
+    Point each gen particle of an event to its next and previous copy.
+
+    The next copy is the child with the same PDG ID and the highest pT, the
+    previous copy the mother with the same PDG ID. The particles without them
+    keep pointing to themselves.
+
+    Parameters:
+    start (int): Flat index of the first gen particle of the event.
+    stop (int): Flat index after the last gen particle of the event.
+    shift (int): Shift from the global to the flat indices of the event.
+    """
+    for p_id in range(start, stop):
+        pdgId = genpart_pdgId_flat[p_id]
+        mother = genpart_mother_flat[p_id]
+        if mother >= 0 and genpart_pdgId_flat[mother] == pdgId:
+            previous_copy[p_id] = mother
+        if genpart_LastCopy_flat[p_id]:
+            continue
+        max_pt = -1
+        for child_idxG in children_idxG_flat[p_id]:
+            child_idx = child_idxG + shift
+            if genpart_pdgId_flat[child_idx] != pdgId:
+                continue
+            if genpart_pt_flat[child_idx] > max_pt:
+                next_copy[p_id] = child_idx
+                max_pt = genpart_pt_flat[child_idx]
+
+
+@njit(cache=True)
+def _get_copy_pointers_serial(
     children_idxG_flat,
     genpart_pdgId_flat,
+    genpart_LastCopy_flat,
+    genpart_pt_flat,
+    genpart_mother_flat,
     genpart_offsets,
+    genpart_reverse_index,
+):
+    num_genparts = genpart_pdgId_flat.shape[0]
+    next_copy = np.arange(num_genparts)
+    previous_copy = np.arange(num_genparts)
+    for iev in range(genpart_offsets.shape[0] - 1):
+        fill_copy_pointers(
+            genpart_offsets[iev],
+            genpart_offsets[iev + 1],
+            genpart_reverse_index[iev],
+            children_idxG_flat,
+            genpart_pdgId_flat,
+            genpart_LastCopy_flat,
+            genpart_pt_flat,
+            genpart_mother_flat,
+            next_copy,
+            previous_copy,
+        )
+    return next_copy, previous_copy
+
+
+@njit(cache=True, parallel=True)
+def _get_copy_pointers_parallel(
+    children_idxG_flat,
+    genpart_pdgId_flat,
     genpart_LastCopy_flat,
     genpart_pt_flat,
-    nevents,
-    firstgenpart_idxG_numpy,
+    genpart_mother_flat,
+    genpart_offsets,
+    genpart_reverse_index,
 ):
+    num_genparts = genpart_pdgId_flat.shape[0]
+    next_copy = np.arange(num_genparts)
+    previous_copy = np.arange(num_genparts)
+    # each event writes only the pointers of its own particles
+    for iev in numba.prange(genpart_offsets.shape[0] - 1):
+        fill_copy_pointers(
+            genpart_offsets[iev],
+            genpart_offsets[iev + 1],
+            genpart_reverse_index[iev],
+            children_idxG_flat,
+            genpart_pdgId_flat,
+            genpart_LastCopy_flat,
+            genpart_pt_flat,
+            genpart_mother_flat,
+            next_copy,
+            previous_copy,
+        )
+    return next_copy, previous_copy
+
+
+def resolve_pointers(pointers):
     """
-    Get the last copy of partons in the event.
+    Follow each pointer to the end of its chain, the element pointing to itself.
 
-    This function iteratively finds the last copy of partons by following their children
-    until the last copy is reached. The last copy is defined as the particle with the same
-    PDG ID as the mother and no further children or marked as the last copy.
-    If multiple children have the same PDG ID as the mother, the one with the highest
-    pT is chose.
+    Each pass replaces the pointers by the pointers of their targets (pointer
+    jumping), doubling the length of the followed chains, so that a chain of
+    length d is resolved in log2(d) vectorized passes.
 
     Parameters:
-    partons_idx (numpy.ndarray): Indices of partons in the event.
-    partons_pdgId (numpy.ndarray): PDG IDs of the partons.
-    children_idxG_flat (numpy.ndarray): Flattened array of children indices.
-    genpart_pdgId_flat (numpy.ndarray): Flattened array of PDG IDs of gen particles.
-    genpart_offsets (numpy.ndarray): Offsets for the gen particles.
-    genpart_LastCopy_flat (numpy.ndarray): Flattened array indicating if a particle is the last copy.
-    genpart_pt_flat (numpy.ndarray): Flattened array of pt of gen particles.
-    nevents (int): Number of events.
-    firstgenpart_idxG_numpy (numpy.ndarray): Indices of the first gen particles in each event.
+    pointers (numpy.ndarray): index of the next element of each element.
 
     Returns:
-    numpy.ndarray: Indices of the last copy of partons.
+    numpy.ndarray: index of the last element of the chain of each element.
     """
+    for _ in range(max(int(pointers.shape[0]).bit_length(), 1) + 1):
+        jumped = pointers[pointers]
+        if np.array_equal(jumped, pointers):
+            return pointers
+        pointers = jumped
+    raise RuntimeError("The pointers contain a cycle")
 
-    out = np.zeros(partons_idx.shape, dtype="int64") - 1
 
-    for iev in range(partons_idx.shape[0]):
-        for ipart in range(partons_idx.shape[1]):
-            p_id = partons_idx[iev][ipart]
-            # if the particle is already the last copy or has no children, it is the last copy
-            if genpart_LastCopy_flat[p_id] or len(children_idxG_flat[p_id]) == 0:
-                out[iev][ipart] = p_id
-                continue
-            # loop until the last copy is found
-            while (not genpart_LastCopy_flat[p_id]) and (
-                not len(children_idxG_flat[p_id]) == 0
-            ):
-                # get the correct children idx
-                children_idxs = reverse_index_array(
-                    children_idxG_flat[p_id],
-                    firstgenpart_idxG_numpy,
-                    genpart_offsets,
-                    nevents,
-                )
-
-                # get the children with the same pdgId as the mother with highest pt
-                max_pt = -1
-                max_pt_idx = p_id
-
-                # loop over children
-                for child_idx in children_idxs:
-                    # if PDG ID is not the same as the mother, skip
-                    if genpart_pdgId_flat[child_idx] != partons_pdgId[iev][ipart]:
-                        continue
-                    child_pt = genpart_pt_flat[child_idx]
-                    # get highest pt among children
-                    if child_pt > max_pt:
-                        max_pt_idx = child_idx
-                        max_pt = child_pt
-
-                # if the last copy is found, set the index
-                if (
-                    genpart_LastCopy_flat[max_pt_idx]
-                    or len(children_idxG_flat[max_pt_idx]) == 0
-                    or max_pt == -1
-                ):
-                    out[iev][ipart] = max_pt_idx
-
-                # update the particle id with the children
-                p_id = max_pt_idx
-
-                # if last copy is found, break
-                if out[iev][ipart] != -1:
-                    break
-    return out
+class FlatGenParticles:
+    """
+    Flat NumPy buffers of the GenPart collection of a chunk.
+
+    The flattening of the collection, and the hasFlags decoding, are done once per
+    chunk and shared by all the parton matching functions of the processor.
+    """
+
+    __slots__ = (
+        "genparts_flat",
+        "offsets",
+        "pdgId",
+        "pt",
+        "is_last_copy",
+        "mother",
+        "children_idxG",
+        "reverse_index",
+        "_copy_tables",
+    )
+
+    def __init__(self, genpart):
+        """
+        Parameters:
+        genpart (ak.Array): GenPart collection of the chunk.
+        """
+        self.genparts_flat = ak.flatten(genpart)
+        self.offsets = np.concatenate(
+            [[0], np.cumsum(ak.to_numpy(ak.num(genpart, axis=1), allow_missing=True))]
+        )
+        self.pdgId = ak.to_numpy(ak.flatten(genpart.pdgId))
+        self.pt = ak.to_numpy(ak.flatten(genpart.pt))
+        self.is_last_copy = ak.to_numpy(ak.flatten(genpart.hasFlags(["isLastCopy"])))
+
+        mother = ak.to_numpy(ak.flatten(genpart.genPartIdxMother), allow_missing=False)
+        self.mother = np.where(
+            mother >= 0, mother + np.repeat(self.offsets[:-1], np.diff(self.offsets)), -1
+        )
+        self.children_idxG = ak.flatten(
+            ak.without_parameters(genpart.childrenIdxG, behavior={}), axis=1
+        )
+        # The global indices (e.g. childrenIdxG) of the particles of an event are
+        # contiguous, so the flat index of a particle is its global index plus the
+        # shift of its event
+        firstgenpart_idxG = ak.firsts(genpart[:, 0].children).genPartIdxMotherG
+        self.reverse_index = self.offsets[:-1] - ak.to_numpy(
+            firstgenpart_idxG, allow_missing=False
+        ).astype(np.int64)
+        self._copy_tables = None
+
+    def flat_index(self, particles):
+        """Flat indices of a regular (n_events, n) selection of gen particles."""
+        return ak.to_numpy(particles.index + self.offsets[:-1], allow_missing=False)
+
+    @property
+    def copy_tables(self):
+        """Last and first copy of every gen particle, see get_genpart_copy_tables."""
+        if self._copy_tables is None:
+            self._copy_tables = get_genpart_copy_tables(self)
+        return self._copy_tables
+
+
+def get_genpart_copy_tables(flat_genparts, min_parallel_events=PARALLEL_MIN_EVENTS):
+    """
+    Last and first copy of every GenPart of a chunk.
+
+    The last copy of a particle follows its children with the same PDG ID, choosing
+    the one with the highest pT, until a particle marked as the last copy or without
+    such children. The first copy follows its mothers with the same PDG ID. Once the
+    tables are built, the copies of any selection of particles are a gather, see
+    gather_genpart_copies.
+
+    The events are split among the numba threads (numba.set_num_threads) when there
+    are at least min_parallel_events of them, and processed serially otherwise.
+
+    Parameters:
+    flat_genparts (FlatGenParticles): GenPart collection of the chunk.
+    min_parallel_events (int): Minimum number of events to use the parallel kernel.
+
+    Returns:
+    numpy.ndarray: Flat index of the last copy of each gen particle.
+    numpy.ndarray: Flat index of the first copy of each gen particle.
+    """
+    if (
+        flat_genparts.offsets.shape[0] - 1 >= min_parallel_events
+        and numba.get_num_threads() > 1
+    ):
+        kernel = _get_copy_pointers_parallel
+    else:
+        kernel = _get_copy_pointers_serial
+    next_copy, previous_copy = kernel(
+        flat_genparts.children_idxG,
+        flat_genparts.pdgId,
+        flat_genparts.is_last_copy,
+        flat_genparts.pt,
+        flat_genparts.mother,
+        flat_genparts.offsets,
+        flat_genparts.reverse_index,
+    )
+    return resolve_pointers(next_copy), resolve_pointers(previous_copy)
+
+
+def gather_genpart_copies(flat_genparts, particles, table):
+    """
+    Copies of a jagged selection of gen particles, from a table of
+    get_genpart_copy_tables.
+
+    Parameters:
+    flat_genparts (FlatGenParticles): GenPart collection of the chunk.
+    particles (ak.Array): selected gen particles, with their local "index" field.
+    table (numpy.ndarray): flat index of the copy of each gen particle.
+
+    Returns:
+    ak.Array: the copies of the particles, with the same structure.
+    """
+    counts = ak.to_numpy(ak.num(particles, axis=1))
+    event_offsets = np.repeat(flat_genparts.offsets[:-1], counts)
+    copies = table[ak.to_numpy(ak.flatten(particles.index)) + event_offsets]
+    return ak.unflatten(flat_genparts.genparts_flat[copies], counts)
@@ -5,6 +5,7 @@ import numpy as np
 import numba
 from numba import njit
 from typing import List
+from functools import lru_cache
 
 TArray = np.ndarray
 
@@ -27,19 +28,19 @@ if NUMBA_DEBUG:
         return wrapper
 
 
-@njit("void(float32[::1], int64, int64, float32)")
+@njit("void(float32[::1], int64, int64, float32)", cache=True)
 def mask_1(data, size, index, value):
     data[index] = value
 
 
-@njit("void(float32[::1], int64, int64, float32)")
+@njit("void(float32[::1], int64, int64, float32)", cache=True)
 def mask_2(flat_data, size, index, value):
     data = flat_data.reshape((size, size))
     data[index, :] = value
     data[:, index] = value
 
 
-@njit("void(float32[::1], int64, int64, float32)")
+@njit("void(float32[::1], int64, int64, float32)", cache=True)
 def mask_3(flat_data, size, index, value):
     data = flat_data.reshape((size, size, size))
     data[index, :, :] = value
@@ -47,82 +48,28 @@ def mask_3(flat_data, size, index, value):
     data[:, :, index] = value
 
 
-# @njit("void(float32[::1], int64, int64, float32)")
-# def mask_4(flat_data, size, index, value):
-#     data = flat_data.reshape((size, size, size, size))
-#     data[index, :, :, :] = value
-#     data[:, index, :, :] = value
-#     data[:, :, index, :] = value
-#     data[:, :, :, index] = value
-
-
-# @njit("void(float32[::1], int64, int64, float32)")
-# def mask_5(flat_data, size, index, value):
-#     data = flat_data.reshape((size, size, size, size, size))
-#     data[index, :, :, :, :] = value
-#     data[:, index, :, :, :] = value
-#     data[:, :, index, :, :] = value
-#     data[:, :, :, index, :] = value
-#     data[:, :, :, :, index] = value
-#
-#
-# @njit("void(float32[::1], int64, int64, float32)")
-# def mask_6(flat_data, size, index, value):
-#     data = flat_data.reshape((size, size, size, size, size, size))
-#     data[index, :, :, :, :, :] = value
-#     data[:, index, :, :, :, :] = value
-#     data[:, :, index, :, :, :] = value
-#     data[:, :, :, index, :, :] = value
-#     data[:, :, :, :, index, :] = value
-#     data[:, :, :, :, :, index] = value
-
-
-# @njit("void(float32[::1], int64, int64, float32)")
-# def mask_7(flat_data, size, index, value):
-#     data = flat_data.reshape((size, size, size, size, size, size, size))
-#     data[index, :, :, :, :, :, :] = value
-#     data[:, index, :, :, :, :, :] = value
-#     data[:, :, index, :, :, :, :] = value
-#     data[:, :, :, index, :, :, :] = value
-#     data[:, :, :, :, index, :, :] = value
-#     data[:, :, :, :, :, index, :] = value
-#     data[:, :, :, :, :, :, index] = value
-#
-#
-# @njit("void(float32[::1], int64, int64, float32)")
-# def mask_8(flat_data, size, index, value):
-#     data = flat_data.reshape((size, size, size, size, size, size, size, size))
-#     data[index, :, :, :, :, :, :, :] = value
-#     data[:, index, :, :, :, :, :, :] = value
-#     data[:, :, index, :, :, :, :, :] = value
-#     data[:, :, :, index, :, :, :, :] = value
-#     data[:, :, :, :, index, :, :, :] = value
-#     data[:, :, :, :, :, index, :, :] = value
-#     data[:, :, :, :, :, :, index, :] = value
-#     data[:, :, :, :, :, :, :, index] = value
-
-
-@njit("void(float32[::1], int64, int64, int64, float32)")
+@njit("void(float32[::1], int64, int64, int64, float32)", cache=True)
 def mask_jet(data, num_partons, max_jets, index, value):
-    if num_partons == 1:
-        mask_1(data, max_jets, index, value)
-    elif num_partons == 2:
-        mask_2(data, max_jets, index, value)
-    elif num_partons == 3:
-        mask_3(data, max_jets, index, value)
-    # elif num_partons == 4:
-    #     mask_4(data, max_jets, index, value)
-    # elif num_partons == 5:
-    #     mask_5(data, max_jets, index, value)
-    # elif num_partons == 6:
-    #     mask_6(data, max_jets, index, value)
-    # elif num_partons == 7:
-    #     mask_7(data, max_jets, index, value)
-    # elif num_partons == 8:
-    #     mask_8(data, max_jets, index, value)
-
-
-@njit("int64[::1](int64, int64)")
+    # The flat buffer is a (max_jets,) * num_partons tensor: along each axis the
+    # entries with the given index are contiguous runs of length stride, spaced by
+    # stride * max_jets, where stride is the one given by compute_strides.
+    # No reshaped view is needed, so any number of partons is supported.
+    size = data.shape[0]
+    block = size
+    for _ in range(num_partons - 1):
+        stride = block // max_jets
+        offset = index * stride
+        for outer in range(size // block):
+            start = outer * block + offset
+            data[start : start + stride] = value
+        block = stride
+
+    # last axis, with unit stride
+    for position in range(index, size, max_jets):
+        data[position] = value
+
+
+@njit("int64[::1](int64, int64)", cache=True)
 def compute_strides(num_partons, max_jets):
     strides = np.zeros(num_partons, dtype=np.int64)
     strides[-1] = 1
@@ -132,7 +79,7 @@ def compute_strides(num_partons, max_jets):
     return strides
 
 
-@njit(TInt64[::1](TInt64, TInt64[::1]))
+@njit(TInt64[::1](TInt64, TInt64[::1]), cache=True)
 def unravel_index(index, strides):
     num_partons = strides.shape[0]
     result = np.zeros(num_partons, dtype=np.int64)
@@ -144,12 +91,12 @@ def unravel_index(index, strides):
     return result
 
 
-@njit(TInt64(TInt64[::1], TInt64[::1]))
+@njit(TInt64(TInt64[::1], TInt64[::1]), cache=True)
 def ravel_index(index, strides):
     return (index * strides).sum()
 
 
-@njit(numba.types.Tuple((TInt64, TInt64, TFloat32))(TPrediction))
+@njit(numba.types.Tuple((TInt64, TInt64, TFloat32))(TPrediction), cache=True)
 def maximal_prediction(predictions):
     best_jet = -1
     best_prediction = -1
@@ -167,7 +114,7 @@ def maximal_prediction(predictions):
     return best_jet, best_prediction, best_value
 
 
-@njit(TResult(TPrediction, TInt64[::1], TInt64))
+@njit(TResult(TPrediction, TInt64[::1], TInt64), cache=True)
 def extract_prediction(predictions, num_partons, max_jets):
     float_negative_inf = -np.float32(np.inf)
     max_partons = num_partons.max()
@@ -204,8 +151,8 @@ def extract_prediction(predictions, num_partons, max_jets):
     return results
 
 
-@njit(TResults(TPredictions, TInt64[::1], TInt64, TInt64), parallel=True)
-def _extract_predictions(predictions, num_partons, max_jets, batch_size):
+@njit(TResults(TPredictions, TInt64[::1], TInt64, TInt64), parallel=True, cache=True)
+def _extract_predictions_list(predictions, num_partons, max_jets, batch_size):
     output = np.zeros((batch_size, len(predictions), num_partons.max()), np.int64)
     predictions = [p.copy() for p in predictions]
 
@@ -216,11 +163,352 @@ def _extract_predictions(predictions, num_partons, max_jets, batch_size):
     return np.ascontiguousarray(output.transpose((1, 0, 2)))#, predictions_new
 
 
-def extract_predictions(predictions: List[TArray]):
+def extract_predictions_reference(predictions: List[TArray]):
+    # Original SPANet implementation, building a typed list per event.
+    # Kept as a reference for the validation and the benchmark of the other selectors.
     flat_predictions = numba.typed.List([p.reshape((p.shape[0], -1)) for p in predictions])
     num_partons = np.array([len(p.shape) - 1 for p in predictions])
     max_jets = max(max(p.shape[1:]) for p in predictions)
     batch_size = max(p.shape[0] for p in predictions)
 
-    results = _extract_predictions(flat_predictions, num_partons, max_jets, batch_size)
+    results = _extract_predictions_list(flat_predictions, num_partons, max_jets, batch_size)
     return [result[:, :partons] for result, partons in zip(results, num_partons)]
+
+
+## Batched implementation on a single contiguous buffer
+# The predictions of all the targets are stored in one (targets, batch, flat) buffer,
+# padded with -inf. Each thread copies one event at a time in its own scratch space,
+# runs the greedy algorithm there and writes the result in the preallocated output.
+
+
+@njit(
+    "void(float32[:, ::1], int64[::1], int64[::1], int64, int64[:, ::1], int64[:, ::1], int64[::1])",
+    cache=True,
+)
+def extract_prediction_buffer(
+    predictions, sizes, num_partons, max_jets, strides, results, best_jets
+):
+    float_negative_inf = -np.float32(np.inf)
+    num_targets = predictions.shape[0]
+
+    # -2 : Not yet assigned
+    # -1 : Masked value
+    # else : The actual index value
+    results[:, :] = -2
+
+    for _ in range(num_targets):
+        # Same selection as maximal_prediction: np.argmax returns the first NaN, if
+        # any, so that a target with NaN entries left is never selected.
+        best_value = float_negative_inf
+        best_prediction = -1
+        best_jet = -1
+        for i in range(num_targets):
+            jet = np.argmax(predictions[i, : sizes[i]])
+            if predictions[i, jet] > best_value:
+                best_value = predictions[i, jet]
+                best_prediction = i
+                best_jet = jet
+
+        if not np.isfinite(best_value):
+            return
+
+        partons = num_partons[best_prediction]
+        remainder = best_jet
+        for i in range(partons):
+            best_jets[i] = remainder // strides[best_prediction, i]
+            remainder %= strides[best_prediction, i]
+
+        results[best_prediction, :] = -1
+        results[best_prediction, :partons] = best_jets[:partons]
+
+        predictions[best_prediction, :] = float_negative_inf
+        for i in range(num_targets):
+            for jet in best_jets[:partons]:
+                mask_jet(
+                    predictions[i, : sizes[i]],
+                    num_partons[i],
+                    max_jets,
+                    jet,
+                    float_negative_inf,
+                )
+
+
+@njit(
+    "void(float32[:, :, ::1], int64[::1], int64, int64[:, :, ::1], int64)",
+    parallel=True,
+    cache=True,
+)
+def _extract_predictions(predictions, num_partons, max_jets, output, num_threads):
+    num_targets, batch_size, max_size = predictions.shape
+    max_partons = output.shape[2]
+
+    sizes = np.zeros(num_targets, np.int64)
+    strides = np.zeros((num_targets, max_partons), np.int64)
+    for i in range(num_targets):
+        sizes[i] = max_jets ** num_partons[i]
+        strides[i, : num_partons[i]] = compute_strides(num_partons[i], max_jets)
+
+    # The events are split in one block per thread, each with its own scratch space
+    num_blocks = max(1, min(num_threads, batch_size))
+    block_size = (batch_size + num_blocks - 1) // num_blocks
+
+    for block in numba.prange(num_blocks):
+        scratch = np.empty((num_targets, max_size), np.float32)
+        results = np.empty((num_targets, max_partons), np.int64)
+        best_jets = np.empty(max_partons, np.int64)
+        for batch in range(
+            block * block_size, min(batch_size, (block + 1) * block_size)
+        ):
+            scratch[:, :] = predictions[:, batch, :]
+            extract_prediction_buffer(
+                scratch, sizes, num_partons, max_jets, strides, results, best_jets
+            )
+            output[:, batch, :] = results
+
+
+def extract_predictions(predictions: List[TArray]):
+    num_partons = np.array([len(p.shape) - 1 for p in predictions], dtype=np.int64)
+    max_jets = max(max(p.shape[1:]) for p in predictions)
+    batch_size = max(p.shape[0] for p in predictions)
+    sizes = [max_jets**partons for partons in num_partons]
+
+    if isinstance(predictions, np.ndarray) and predictions.dtype == np.float32:
+        # all the targets have the same shape: only a view is needed
+        flat_predictions = np.ascontiguousarray(
+            predictions.reshape((len(predictions), batch_size, -1))
+        )
+    else:
+        flat_predictions = np.full(
+            (len(predictions), batch_size, max(sizes)),
+            -np.float32(np.inf),
+            dtype=np.float32,
+        )
+        for i, prediction in enumerate(predictions):
+            flat_predictions[i, : prediction.shape[0], : sizes[i]] = prediction.reshape(
+                (prediction.shape[0], -1)
+            )
+
+    output = np.empty((len(predictions), batch_size, num_partons.max()), np.int64)
+    _extract_predictions(
+        flat_predictions, num_partons, max_jets, output, numba.get_num_threads()
+    )
+    return [result[:, :partons] for result, partons in zip(output, num_partons)]
+
+
+## Closed-form selector for two 2-parton targets (e.g. the two Higgs bosons in HH4b)
+# Among all the disjoint (H1 pair, H2 pair) assignments, the greedy algorithm above
+# selects the one containing the highest entry of both targets and, for the other
+# target, the highest entry compatible with it. The compatible entries of every pair
+# are precomputed, so that each event only needs two scans without any allocation.
+# The k best assignments are obtained by repeating the selection on a per-thread copy
+# of the event, after removing the pairs already assigned.
+
+MAX_PAIRING_JETS = 8
+
+
+@lru_cache(maxsize=None)
+def compute_pairing_table(max_jets):
+    """
+    Enumerate, for every pair of jets, the pairs of the other target disjoint from it.
+
+    Returns:
+    numpy.ndarray: (max_jets**2, (max_jets - 1)**2) array. Row i * max_jets + j holds
+        the flat indices k * max_jets + l with k, l not in (i, j), in increasing
+        order and padded with -1.
+    """
+    table = np.full((max_jets * max_jets, (max_jets - 1) ** 2), -1, dtype=np.int64)
+    for i in range(max_jets):
+        for j in range(max_jets):
+            compatible = [
+                k * max_jets + l
+                for k in range(max_jets)
+                for l in range(max_jets)
+                if k not in (i, j) and l not in (i, j)
+            ]
+            table[i * max_jets + j, : len(compatible)] = compatible
+    return table
+
+
+@njit(
+    numba.types.UniTuple(TInt64, 3)(TFloat32[:, :], TInt64[:, ::1]), cache=True
+)
+def select_pairing(predictions, table):
+    # Highest entry among both targets, the first one in case of ties. As in
+    # maximal_prediction, a target with a NaN entry is skipped and a non-finite
+    # maximum leaves both targets unassigned.
+    best_value = -np.float32(np.inf)
+    best_target = -1
+    best_pair = -1
+    for target in range(predictions.shape[0]):
+        pair = np.argmax(predictions[target])
+        value = predictions[target, pair]
+        if value > best_value:
+            best_value = value
+            best_target = target
+            best_pair = pair
+
+    if best_target == -1 or not np.isfinite(best_value):
+        return -1, -1, -1
+
+    # Highest entry of the other target among the compatible pairs, with the same
+    # treatment of the NaN and non-finite entries
+    other_value = -np.float32(np.inf)
+    other_pair = -1
+    for pair in table[best_pair]:
+        if pair < 0:
+            break
+        value = predictions[1 - best_target, pair]
+        if np.isnan(value):
+            return best_target, best_pair, -1
+        if value > other_value:
+            other_value = value
+            other_pair = pair
+
+    if not np.isfinite(other_value):
+        other_pair = -1
+
+    return best_target, best_pair, other_pair
+
+
+@njit(
+    TResults(TFloat32[:, :, ::1], TInt64[:, ::1], TInt64), parallel=True, cache=True
+)
+def _extract_pairings(predictions, table, max_jets):
+    num_events = predictions.shape[1]
+    output = np.full((2, num_events, 2), -2, np.int64)
+
+    for batch in numba.prange(num_events):
+        best_target, best_pair, other_pair = select_pairing(
+            predictions[:, batch, :], table
+        )
+        if best_target == -1:
+            continue
+        output[best_target, batch, 0] = best_pair // max_jets
+        output[best_target, batch, 1] = best_pair % max_jets
+        if other_pair != -1:
+            output[1 - best_target, batch, 0] = other_pair // max_jets
+            output[1 - best_target, batch, 1] = other_pair % max_jets
+
+    return output
+
+
+@njit(
+    numba.types.Tuple((TInt64[:, :, :, ::1], numba.types.float64[:, ::1]))(
+        TFloat32[:, :, ::1], TInt64[:, ::1], TInt64, TInt64, TInt64
+    ),
+    parallel=True,
+    cache=True,
+)
+def _extract_topk_pairings(predictions, table, max_jets, k, num_threads):
+    num_events = predictions.shape[1]
+    size = predictions.shape[2]
+    assignments = np.full((k, num_events, 2, 2), -2, np.int64)
+    probabilities = np.zeros((k, num_events), np.float64)
+
+    # The events are split in one block per thread, each with its own scratch copy
+    num_blocks = max(1, min(num_threads, num_events))
+    block_size = (num_events + num_blocks - 1) // num_blocks
+
+    for block in numba.prange(num_blocks):
+        scratch = np.empty((2, size), np.float32)
+        for batch in range(
+            block * block_size, min(num_events, (block + 1) * block_size)
+        ):
+            scratch[:, :] = predictions[:, batch, :]
+            for rank in range(k):
+                best_target, best_pair, other_pair = select_pairing(scratch, table)
+                if best_target == -1:
+                    break
+
+                for side in range(2):
+                    target = best_target if side == 0 else 1 - best_target
+                    pair = best_pair if side == 0 else other_pair
+                    if pair < 0:
+                        continue
+                    assignments[rank, batch, target, 0] = pair // max_jets
+                    assignments[rank, batch, target, 1] = pair % max_jets
+                    probabilities[rank, batch] += scratch[target, pair]
+
+                # remove the selected pairs, in both orders, from both targets
+                for side in range(2):
+                    pair = best_pair if side == 0 else other_pair
+                    if pair < 0:
+                        continue
+                    flipped = (pair % max_jets) * max_jets + pair // max_jets
+                    scratch[:, pair] = 0
+                    scratch[:, flipped] = 0
+
+    return assignments, probabilities
+
+
+def extract_pairings(predictions):
+    """
+    Drop-in replacement of extract_predictions for two 2-parton targets.
+
+    Parameters:
+    predictions (numpy.ndarray or list): assignment probabilities with shape
+        (2, n_events, max_jets, max_jets).
+
+    Returns:
+    list: one (n_events, 2) array of jet indices per target, identical to the output
+        of extract_predictions. Other target configurations, or more than
+        MAX_PAIRING_JETS jets, fall back to extract_predictions.
+    """
+    shapes = {p.shape for p in predictions}
+    if len(predictions) != 2 or len(shapes) != 1:
+        return extract_predictions(predictions)
+    (shape,) = shapes
+    if len(shape) != 3 or shape[1] != shape[2] or shape[1] > MAX_PAIRING_JETS:
+        return extract_predictions(predictions)
+
+    max_jets = shape[1]
+    flat_predictions = np.ascontiguousarray(
+        np.asarray(predictions, dtype=np.float32).reshape((2, shape[0], -1))
+    )
+    results = _extract_pairings(
+        flat_predictions, compute_pairing_table(max_jets), max_jets
+    )
+    return [result for result in results]
+
+
+def extract_topk_predictions(predictions, k):
+    """
+    Extract the k best disjoint assignments of two 2-parton targets in one pass.
+
+    The first assignment is the one of extract_predictions. Each following one is
+    the greedy assignment after setting to zero, in both targets, the probabilities
+    of the pairs already selected. The input predictions are not modified.
+
+    Parameters:
+    predictions (numpy.ndarray or list): assignment probabilities with shape
+        (2, n_events, max_jets, max_jets).
+    k (int): number of assignments to extract.
+
+    Returns:
+    numpy.ndarray: (k, n_events, 2, 2) jet indices of each assignment, ordered as
+        (rank, event, target, parton).
+    numpy.ndarray: (k, n_events) sum of the probabilities of the two targets.
+    """
+    predictions = np.asarray(predictions, dtype=np.float32)
+    if (
+        predictions.ndim != 4
+        or predictions.shape[0] != 2
+        or predictions.shape[2] != predictions.shape[3]
+        or predictions.shape[2] > MAX_PAIRING_JETS
+    ):
+        raise ValueError(
+            "extract_topk_predictions requires two 2-parton targets with shape "
+            f"(2, n_events, N, N) and N <= {MAX_PAIRING_JETS}, got {predictions.shape}"
+        )
+
+    max_jets = predictions.shape[2]
+    flat_predictions = np.ascontiguousarray(
+        predictions.reshape((2, predictions.shape[1], -1))
+    )
+    return _extract_topk_pairings(
+        flat_predictions,
+        compute_pairing_table(max_jets),
+        max_jets,
+        k,
+        numba.get_num_threads(),
+    )
@@ -1,9 +1,11 @@
 import awkward as ak
 import numpy as np
 import sys
+from numba import njit
 
 sys.path.append("../")
 from utils.basic_functions import add_fields
+from utils.fourvec import PTETAPHIM_FIELDS, sum_ptetaphim, zip_ptetaphim
 
 
 def reconstruct_higgs_from_provenance(matched_jets_higgs):
@@ -25,71 +27,108 @@ def reconstruct_higgs_from_provenance(matched_jets_higgs):
     return higgs_lead, higgs_sub, jets_ordered
 
 
-def reconstruct_higgs_from_idx(jet_collection, idx_collection):
-    # NOTE: idx_collection is referred to the index of the jets in the JetGood collection
-    # and is not the index of the jets in the Jet
-    higgs_1 = ak.unflatten(
-        jet_collection[np.arange(len(idx_collection)), idx_collection[:, 0, 0]]
-        + jet_collection[np.arange(len(idx_collection)), idx_collection[:, 0, 1]],
-        1,
-    )
-    higgs_2 = ak.unflatten(
-        jet_collection[np.arange(len(idx_collection)), idx_collection[:, 1, 0]]
-        + jet_collection[np.arange(len(idx_collection)), idx_collection[:, 1, 1]],
-        1,
-    )
+@njit(cache=True)
+def _reconstruct_higgs_from_idx(jet_offsets, pt, eta, phi, mass, idx_collection):
+    num_events = idx_collection.shape[0]
+    # flat indices of the jets, ordered as (leading H: jet1, jet2, subleading H: jet1, jet2)
+    jets_order = np.empty((num_events, 4), np.int64)
+    # (leading, subleading) x (pt, eta, phi, mass) of the Higgs candidates
+    higgs = np.empty((2, 4, num_events), np.float64)
+
+    for iev in range(num_events):
+        start = jet_offsets[iev]
+        num_jets = jet_offsets[iev + 1] - start
+        for h in range(2):
+            jet_1 = idx_collection[iev, h, 0]
+            jet_2 = idx_collection[iev, h, 1]
+            # negative indices count from the last jet, as in awkward
+            jet_1 = start + (jet_1 + num_jets if jet_1 < 0 else jet_1)
+            jet_2 = start + (jet_2 + num_jets if jet_2 < 0 else jet_2)
+            (
+                higgs[h, 0, iev],
+                higgs[h, 1, iev],
+                higgs[h, 2, iev],
+                higgs[h, 3, iev],
+            ) = sum_ptetaphim(
+                pt[jet_1],
+                eta[jet_1],
+                phi[jet_1],
+                mass[jet_1],
+                pt[jet_2],
+                eta[jet_2],
+                phi[jet_2],
+                mass[jet_2],
+            )
+            # the jets of each candidate are ordered in pt
+            if pt[jet_1] > pt[jet_2]:
+                jets_order[iev, 2 * h] = jet_1
+                jets_order[iev, 2 * h + 1] = jet_2
+            else:
+                jets_order[iev, 2 * h] = jet_2
+                jets_order[iev, 2 * h + 1] = jet_1
+
+        # the candidates are ordered in pt, the second one leading in case of a tie
+        if not higgs[0, 0, iev] > higgs[1, 0, iev]:
+            for var in range(4):
+                higgs[0, var, iev], higgs[1, var, iev] = (
+                    higgs[1, var, iev],
+                    higgs[0, var, iev],
+                )
+            for j in range(2):
+                jets_order[iev, j], jets_order[iev, j + 2] = (
+                    jets_order[iev, j + 2],
+                    jets_order[iev, j],
+                )
+
+    return jets_order, higgs
 
 
-    higgs_leading_index = ak.where(higgs_1.pt > higgs_2.pt, 0, 1)
-
-    higgs_lead = ak.where(higgs_leading_index == 0, higgs_1, higgs_2)
-    higgs_sub = ak.where(higgs_leading_index == 0, higgs_2, higgs_1)
-
-    higgs_leading_index_expanded = higgs_leading_index[:, np.newaxis] * np.ones((2, 2))
-    # order idx according to the higgs candidate
-    idx_ordered = ak.where(
-        higgs_leading_index_expanded == 0, idx_collection, idx_collection[:, ::-1]
+def reconstruct_higgs_from_idx(jet_collection, idx_collection):
+    """
+    Higgs candidates from the jet pairings of SPANet.
+
+    The 4-vectors of the candidates and the order of the jets are computed in a
+    single pass over the flat jet buffers, and the jets are gathered with all
+    their fields at the end.
+
+    Parameters:
+    jet_collection (ak.Array): jets (JetGood) of the events.
+    idx_collection (numpy.ndarray): (n_events, 2, 2) indices of the jets of the
+        two Higgs candidates. NOTE: they are referred to the index of the jets in the
+        JetGood collection and not in the Jet one.
+
+    Returns:
+    ak.Array: leading Higgs candidate in pt.
+    ak.Array: subleading Higgs candidate.
+    ak.Array: the four jets, ordered by candidate and by pt inside each candidate.
+    """
+    counts = ak.to_numpy(ak.num(jet_collection, axis=1))
+    idx_collection = np.ascontiguousarray(idx_collection, dtype=np.int64)
+    # the kernel does not check the bounds, an index out of the jets of an event
+    # would read the jets of the next one
+    counts_per_idx = counts[:, np.newaxis, np.newaxis]
+    out_of_range = (idx_collection >= counts_per_idx) | (idx_collection < -counts_per_idx)
+    if np.any(out_of_range):
+        event = np.flatnonzero(out_of_range.any(axis=(1, 2)))[0]
+        raise IndexError(
+            f"Jet indices {idx_collection[event].tolist()} out of range for event "
+            f"{event} with {counts[event]} jets"
+        )
+
+    jet_offsets = np.concatenate([[0], np.cumsum(counts)])
+    jets_flat = ak.flatten(jet_collection)
+    pt, eta, phi, mass = (ak.to_numpy(jets_flat[field]) for field in PTETAPHIM_FIELDS)
+    jets_order, higgs = _reconstruct_higgs_from_idx(
+        jet_offsets, pt, eta, phi, mass, idx_collection
     )
 
-    higgs1_jet1 = ak.unflatten(
-        ak.where(
-            jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 0, 0]].pt
-            > jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 0, 1]].pt,
-            jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 0, 0]],
-            jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 0, 1]],
-        ),1
+    higgs_lead, higgs_sub = (
+        zip_ptetaphim(candidate, dtype=pt.dtype, behavior=jet_collection.behavior)
+        for candidate in higgs
     )
-    higgs1_jet2 = ak.unflatten(
-        ak.where(
-            jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 0, 0]].pt
-            > jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 0, 1]].pt,
-            jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 0, 1]],
-            jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 0, 0]],
-        ),1
-    )
-    higgs2_jet1 = ak.unflatten(
-        ak.where(
-            jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 1, 0]].pt
-            > jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 1, 1]].pt,
-            jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 1, 0]],
-            jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 1, 1]],
-        ),1
-    )
-    higgs2_jet2 = ak.unflatten(
-        ak.where(
-            jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 1, 0]].pt
-            > jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 1, 1]].pt,
-            jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 1, 1]],
-            jet_collection[np.arange(len(idx_collection)), idx_ordered[:, 1, 0]],
-        ),1
-    )
-
     jets_ordered = ak.with_name(
-        ak.concatenate([higgs1_jet1, higgs1_jet2, higgs2_jet1, higgs2_jet2], axis=1),
+        ak.unflatten(jets_flat[jets_order.ravel()], np.full(len(jets_order), 4)),
         name="PtEtaPhiMCandidate",
     )
 
-    higgs_lead = add_fields(ak.flatten(higgs_lead))
-    higgs_sub = add_fields(ak.flatten(higgs_sub))
-
     return higgs_lead, higgs_sub, jets_ordered
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def _file_sha256(path, mtime):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def file_sha256(path):
+    """SHA-256 of a file, computed once per process and modification time."""
+    return _file_sha256(os.path.abspath(path), os.path.getmtime(path))
+
+
+def spanet_cache_key(
+    metadata,
+    model_path,
+    max_num_jets,
+    input_version,
+    event_ids,
+    variation=None,
+    input_buffers=(),
+):
+    """
+    Key of the SPANet predictions of a chunk.
+
+    Parameters:
+    metadata (dict): events.metadata of the chunk.
+    model_path (str): path of the onnx model.
+    max_num_jets (int): number of jets given to the model.
+    input_version (int): version of the definition of the input features.
+    event_ids (numpy.ndarray): event numbers of the events after the preselection,
+        so that a change of the preselection does not reuse stale predictions.
+    variation (str): systematic variation of the chunk.
+    input_buffers (list): numpy arrays of the input features, e.g. from
+        get_feature_buffers, so that a change of the jet selection or calibration
+        keeping the same events does not reuse stale predictions.
+
+    Returns:
+    str: hexadecimal key.
+    """
+    sha = hashlib.sha256()
+    for item in (
+        metadata.get("fileuuid", metadata.get("filename")),
+        metadata.get("entrystart"),
+        metadata.get("entrystop"),
+        file_sha256(model_path),
+        max_num_jets,
+        input_version,
+        variation,
+    ):
+        sha.update(repr(item).encode())
+    for array in (event_ids, *input_buffers):
+        array = np.ascontiguousarray(array)
+        sha.update(repr((array.dtype.str, array.shape)).encode())
+        sha.update(array.tobytes())
+    return sha.hexdigest()
+
+
+def load_cached_pairings(cache_dir, key):
+    """
+    Load the SPANet pairings of a chunk.
+
+    Returns:
+    tuple: (pairing_predictions, best_pairing_probability,
+        second_best_pairing_probability), or None if they are not in the cache.
+    """
+    path = os.path.join(cache_dir, f"{key}.npz")
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as cached:
+            return (
+                cached["pairing_predictions"],
+                cached["best_pairing_probability"],
+                cached["second_best_pairing_probability"],
+            )
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        # corrupted or incomplete file, the predictions are recomputed
+        return None
+
+
+def save_cached_pairings(
+    cache_dir,
+    key,
+    pairing_predictions,
+    best_pairing_probability,
+    second_best_pairing_probability,
+):
+    """Store the SPANet pairings of a chunk, atomically with respect to other workers."""
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(
+                f,
+                pairing_predictions=pairing_predictions,
+                best_pairing_probability=best_pairing_probability,
+                second_best_pairing_probability=second_best_pairing_probability,
+            )
+        os.replace(tmp_path, os.path.join(cache_dir, f"{key}.npz"))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
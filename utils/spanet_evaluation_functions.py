@@ -1,158 +1,371 @@
 import numpy as np
 import awkward as ak
+import numba
+from numba import njit
+import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append("../")
-from utils.prediction_selection import extract_predictions
+from utils.prediction_selection import extract_topk_predictions
+from utils.inference_session import resolve_shape
 
+# Input features of the SPANet models, with the transformation applied to each of them
+SPANET_INPUT_FIELDS = ["pt", "eta", "phi", "btagPNetB"]
+SPANET_INPUT_TRANSFORMS = {"pt": "log1p"}
+# to be increased at every change of the inputs, it invalidates the cached predictions
+SPANET_INPUT_VERSION = 1
 
-def get_pairing_information(session, input_name, output_name, events, max_num_jets):
+PADDED_FEATURE_TRANSFORMS = {"identity": 0, "log1p": 1}
 
-    pt = np.array(
-        np.log(
-            ak.to_numpy(
-                ak.fill_none(
-                    ak.pad_none(events.JetGood.pt, max_num_jets, clip=True),
-                    value=0,
-                ),
-                allow_missing=True,
+
+@njit(cache=True)
+def fill_padded_feature(content, offsets, transform, output, feature):
+    num_events, max_len = output.shape[0], output.shape[1]
+    # padded entries are filled with zeros before the transformation
+    pad_value = np.float32(0)
+    if transform == 1:
+        pad_value = np.log(pad_value + np.float32(1))
+
+    for event in range(num_events):
+        start = offsets[event]
+        length = min(offsets[event + 1] - start, max_len)
+        for i in range(length):
+            value = np.float32(content[start + i])
+            if transform == 1:
+                value = np.log(value + np.float32(1))
+            output[event, i, feature] = value
+        for i in range(length, max_len):
+            output[event, i, feature] = pad_value
+
+
+def get_feature_buffers(collection, fields):
+    """
+    Numpy buffers of the features of a jagged collection, before the padding and
+    the transformations: the number of objects per event and the flat content of
+    each field.
+    """
+    return [ak.to_numpy(ak.num(collection, axis=1))] + [
+        ak.to_numpy(ak.flatten(collection[field], axis=1)) for field in fields
+    ]
+
+
+def build_padded_features(collection, fields, max_len, transforms=None, out=None):
+    """
+    Build the padded input tensor of a jagged collection in a single pass per field.
+
+    Parameters:
+    collection (ak.Array): jagged collection, e.g. events.JetGood.
+    fields (list): fields of the collection to use as features, in order.
+    max_len (int): number of objects per event, the others are dropped.
+    transforms (dict): transformation of each field, among PADDED_FEATURE_TRANSFORMS.
+    out (tuple): preallocated (features, mask) arrays to fill, e.g. the input
+        buffers of an InferenceSessionHolder.
+
+    Returns:
+    numpy.ndarray: (n_events, max_len, n_features) float32 features, zero padded.
+    numpy.ndarray: (n_events, max_len) bool mask of the existing objects.
+    """
+    transforms = transforms or {}
+    for field, transform in transforms.items():
+        if transform not in PADDED_FEATURE_TRANSFORMS:
+            raise ValueError(
+                f"Unknown transformation {transform} for {field}, "
+                f"available: {list(PADDED_FEATURE_TRANSFORMS)}"
             )
-            + 1
-        ),
-        dtype=np.float32,
-    )
 
-    eta = np.array(
-        ak.to_numpy(
-            ak.fill_none(
-                ak.pad_none(events.JetGood.eta, max_num_jets, clip=True),
-                value=0,
-            ),
-            allow_missing=True,
-        ),
-        dtype=np.float32,
+    counts = ak.to_numpy(ak.num(collection, axis=1))
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    if out is None:
+        features = np.empty((len(counts), max_len, len(fields)), dtype=np.float32)
+        mask = np.empty((len(counts), max_len), dtype=np.bool_)
+    else:
+        features, mask = out
+
+    for feature, field in enumerate(fields):
+        content = ak.to_numpy(ak.flatten(collection[field], axis=1))
+        fill_padded_feature(
+            content,
+            offsets,
+            PADDED_FEATURE_TRANSFORMS[transforms.get(field, "identity")],
+            features,
+            feature,
+        )
+
+    np.less(np.arange(max_len)[np.newaxis, :], counts[:, np.newaxis], out=mask)
+
+    return features, mask
+
+
+# Rough ratio between the ONNX Runtime activations and the size of the
+# input and output tensors of a SPANet model, used to estimate the memory per event
+INFERENCE_MEMORY_FACTOR = 64
+
+MEMORY_UNITS = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3}
+
+
+def parse_memory(memory):
+    """Convert a memory size, in bytes or as a string like "2GB", to bytes."""
+    if isinstance(memory, str):
+        memory = memory.strip().upper()
+        for unit in ("KB", "MB", "GB", "B"):
+            if memory.endswith(unit):
+                return int(float(memory[: -len(unit)]) * MEMORY_UNITS[unit])
+    return int(memory)
+
+
+def get_inference_batch_size(
+    session, num_events, max_num_jets, batch_size=None, max_memory=None
+):
+    """
+    Number of events per session.run call.
+
+    Parameters:
+    session (InferenceSessionHolder): session of the model.
+    num_events (int): number of events to evaluate.
+    max_num_jets (int): number of jets per event.
+    batch_size (int): maximum number of events per call, None for no limit.
+    max_memory (int or str): memory ceiling of a call, e.g. "2GB", None for no limit.
+
+    Returns:
+    int: number of events per call.
+    """
+    inference_batch_size = max(num_events, 1)
+    if batch_size:
+        inference_batch_size = min(inference_batch_size, int(batch_size))
+    if max_memory:
+        event_size = sum(
+            np.prod(resolve_shape(tensor, 1, max_num_jets))
+            * np.dtype(np.float32).itemsize
+            for tensor in session.inputs + session.outputs
+        )
+        event_memory = max(int(event_size) * INFERENCE_MEMORY_FACTOR, 1)
+        inference_batch_size = min(
+            inference_batch_size, max(parse_memory(max_memory) // event_memory, 1)
+        )
+    return inference_batch_size
+
+
+def _add_value(timing, stage, seconds):
+    timing[stage] = timing.get(stage, 0.0) + seconds
+
+
+def _add_time(timing, stage, start):
+    _add_value(timing, stage, time.perf_counter() - start)
+
+
+def get_spanet_input_buffers(session, num_events, max_num_jets):
+    """Input buffers of the SPANet model: the jet features and the jet mask."""
+    return session.get_input_buffers(
+        [
+            (num_events, max_num_jets, len(SPANET_INPUT_FIELDS)),
+            (num_events, max_num_jets),
+        ]
     )
 
-    phi = np.array(
-        ak.to_numpy(
-            ak.fill_none(
-                ak.pad_none(events.JetGood.phi, max_num_jets, clip=True),
-                value=0,
-            ),
-            allow_missing=True,
-        ),
-        dtype=np.float32,
+
+def get_pairing_information(
+    session,
+    events,
+    max_num_jets,
+    batch_size=None,
+    max_memory=None,
+    timing=None,
+    inputs=None,
+):
+    """
+    Evaluate the SPANet model on the JetGood collection.
+
+    Parameters:
+    session (InferenceSessionHolder): session of the model.
+    events (ak.Array): events with the JetGood collection.
+    max_num_jets (int): number of jets given to the model.
+    batch_size (int): maximum number of events per session.run call.
+    max_memory (int or str): memory ceiling of a session.run call.
+    timing (dict): if given, the seconds spent in the feature build and in the
+        inference are added to it.
+    inputs (tuple): input arrays already built, e.g. shared by several models.
+
+    Returns:
+    numpy.ndarray: (2, n_events, max_num_jets, max_num_jets) assignment probabilities.
+    list: all the outputs of the model.
+    The arrays are views of the session buffers, overwritten by the next call.
+    """
+    timing = {} if timing is None else timing
+    start = time.perf_counter()
+    num_events = len(events)
+    if inputs is None:
+        inputs = get_spanet_input_buffers(session, num_events, max_num_jets)
+        build_padded_features(
+            events.JetGood,
+            SPANET_INPUT_FIELDS,
+            max_num_jets,
+            SPANET_INPUT_TRANSFORMS,
+            out=inputs,
+        )
+    inference_batch_size = get_inference_batch_size(
+        session, num_events, max_num_jets, batch_size, max_memory
     )
+    _add_time(timing, "feature_build", start)
 
-    btag = np.array(
-        ak.to_numpy(
-            ak.fill_none(
-                ak.pad_none(events.JetGood.btagPNetB, max_num_jets, clip=True),
-                value=0,
-            ),
-            allow_missing=True,
-        ),
-        dtype=np.float32,
+    start = time.perf_counter()
+    result = session.run(inputs, max_num_jets, inference_batch_size)
+    _add_time(timing, "inference", start)
+    return result
+
+
+def get_best_pairings(assignment_probability):
+
+    # extract the best and second best jet assignments from
+    # the (2, n_events, N, N) predicted probabilities, without modifying them
+    assignments, pairing_probabilities_sum = extract_topk_predictions(
+        assignment_probability, 2
     )
 
-    mask = np.array(
-        ak.to_numpy(
-            ak.fill_none(
-                ak.pad_none(
-                    ak.ones_like(events.JetGood.pt),
-                    max_num_jets,
-                    clip=True,
-                ),
-                value=0,
-            ),
-            allow_missing=True,
-        ),
-        dtype=np.bool_,
+    # the second best assignment is the best one after setting to zero the
+    # probabilities of the best jet pairs, in both orders and on both targets
+    predictions_best = assignments[0]
+    best_pairing_probabilities_sum = pairing_probabilities_sum[0]
+    second_best_pairing_probabilities_sum = pairing_probabilities_sum[1]
+
+    return (
+        predictions_best,
+        best_pairing_probabilities_sum,
+        second_best_pairing_probabilities_sum,
     )
 
-    inputs = np.stack((pt, eta, phi, btag), axis=-1)
-    inputs_complete = {input_name[0]: inputs, input_name[1]: mask}
 
-    outputs = session.run(output_name, inputs_complete)
+def get_spanet_models(spanet_model):
+    """
+    Models to evaluate, by tag.
 
-    return outputs
+    Parameters:
+    spanet_model (str, list or dict): path of a model, list of paths tagged by their
+        file name, or dict of paths by tag. None for no model.
 
+    Returns:
+    dict: tag -> path of the model. A single model has an empty tag.
+    """
+    if not spanet_model:
+        return {}
+    if isinstance(spanet_model, str):
+        return {"": spanet_model}
+    if isinstance(spanet_model, dict):
+        return dict(spanet_model)
+    return {os.path.splitext(os.path.basename(model))[0]: model for model in spanet_model}
 
-def get_best_pairings(outputs):
 
-    # extract the best jet assignment from
-    # the predicted probabilities
+def tagged_field(name, tag):
+    """Name of the field of the model with the given tag, e.g. HiggsLeading_<tag>."""
+    return f"{name}_{tag}" if tag else name
 
-    # NOTE: here the way this was implemented was changed
-    assignment_probability = np.stack((outputs[0], outputs[1]), axis=0)
-    # assignment_probability = [outputs[0], outputs[1]]
 
-    # print("\nassignment_probability", assignment_probability)
-    # swap axis
-    predictions_best = np.swapaxes(extract_predictions(assignment_probability), 0, 1)
-    # assignment_probability=np.array(assignment_probability)
+# Minimum number of micro-batches of the pipelined inference, so that the stages
+# can overlap even when no batch size or memory ceiling is given
+PIPELINE_MIN_BATCHES = 4
 
-    # get the probabilities of the best jet assignment
 
-    # NOTE: here the way this was implemented was changed
-    num_events = assignment_probability.shape[1]
-    # num_events = len(assignment_probability[0])
+def get_pairings_pipelined(
+    session,
+    events,
+    max_num_jets,
+    batch_size=None,
+    max_memory=None,
+    timing=None,
+    inputs=None,
+):
+    """
+    Evaluate the SPANet model and extract the best pairings, overlapping the stages.
 
-    range_num_events = np.arange(num_events)
-    best_pairing_probabilities = np.ndarray((2, num_events))
-    for i in range(2):
-        # print("best", i)
-        best_pairing_probabilities[i] = assignment_probability[
-            i,
-            range_num_events,
-            predictions_best[:, i, 0],
-            predictions_best[:, i, 1],
-        ]
-    best_pairing_probabilities_sum = np.sum(best_pairing_probabilities, axis=0)
-    # print("\nbest_pairing_probabilities_sum", best_pairing_probabilities_sum)
-
-    # set to zero the probabilities of the best jet assignment, the symmetrization and the same jet assignment on the other target
-    for j in range(2):
-        for k in range(2):
-            # print("set to zero", j, k)
-            assignment_probability[
-                j,
-                range_num_events,
-                predictions_best[:, j, k],
-                predictions_best[:, j, 1 - k],
-            ] = 0
-            assignment_probability[
-                1 - j,
-                range_num_events,
-                predictions_best[:, j, k],
-                predictions_best[:, j, 1 - k],
-            ] = 0
-
-    # print("\nassignment_probability new", assignment_probability)
-    # extract the second best jet assignment from
-    # the predicted probabilities
-    # swap axis
-    predictions_second_best = np.swapaxes(
-        extract_predictions(assignment_probability), 0, 1
+    While ONNX Runtime evaluates a micro-batch, the features of the next one are
+    built on a second thread and the pairings of the previous one are extracted on
+    a third. ONNX Runtime and the numba kernels release the GIL, so the stages run
+    in parallel on multi-core workers. Each of the two helper threads runs one task
+    at a time, so the parallel numba kernels are never launched concurrently.
+
+    Parameters:
+    session (InferenceSessionHolder): session of the model.
+    events (ak.Array): events with the JetGood collection.
+    max_num_jets (int): number of jets given to the model.
+    batch_size (int): maximum number of events per session.run call.
+    max_memory (int or str): memory ceiling of a session.run call.
+    timing (dict): if given, the seconds spent in each stage are added to it.
+    inputs (tuple): input arrays already built, in which case only the inference
+        and the pairing extraction are overlapped.
+
+    Returns:
+    The same arrays as get_best_pairings.
+    """
+    timing = {} if timing is None else timing
+    num_events = len(events)
+    build_inputs = inputs is None
+    if build_inputs:
+        inputs = get_spanet_input_buffers(session, num_events, max_num_jets)
+    assignment_probability, outputs = session.get_output_buffers(
+        num_events, max_num_jets
     )
+    inference_batch_size = min(
+        get_inference_batch_size(
+            session, num_events, max_num_jets, batch_size, max_memory
+        ),
+        max(-(-num_events // PIPELINE_MIN_BATCHES), 1),
+    )
+    batches = [
+        (start, min(start + inference_batch_size, num_events))
+        for start in range(0, num_events, inference_batch_size)
+    ]
 
-    # get the probabilities of the second best jet assignment
-    second_best_pairing_probabilities = np.ndarray((2, num_events))
-    for i in range(2):
-        # print("second best", i)
-        second_best_pairing_probabilities[i] = assignment_probability[
-            i,
-            range_num_events,
-            predictions_second_best[:, i, 0],
-            predictions_second_best[:, i, 1],
-        ]
-    second_best_pairing_probabilities_sum = np.sum(
-        second_best_pairing_probabilities, axis=0
+    predictions_best = np.empty((num_events, 2, 2), dtype=np.int64)
+    best_pairing_probabilities_sum = np.empty(num_events, dtype=np.float64)
+    second_best_pairing_probabilities_sum = np.empty(num_events, dtype=np.float64)
+
+    def build_batch(start, stop):
+        if not build_inputs:
+            return 0.0
+        begin = time.perf_counter()
+        build_padded_features(
+            events.JetGood[start:stop],
+            SPANET_INPUT_FIELDS,
+            max_num_jets,
+            SPANET_INPUT_TRANSFORMS,
+            out=(inputs[0][start:stop], inputs[1][start:stop]),
+        )
+        return time.perf_counter() - begin
+
+    def select_batch(start, stop):
+        begin = time.perf_counter()
+        (
+            predictions_best[start:stop],
+            best_pairing_probabilities_sum[start:stop],
+            second_best_pairing_probabilities_sum[start:stop],
+        ) = get_best_pairings(assignment_probability[:, start:stop])
+        return time.perf_counter() - begin
+
+    # numba.set_num_threads only applies to the calling thread, so the helper threads
+    # get the numba threads of the one processing the chunk, see set_numba_num_threads
+    pool_options = dict(
+        max_workers=1,
+        initializer=numba.set_num_threads,
+        initargs=(numba.get_num_threads(),),
     )
-    # print(
-    #     "\nsecond_best_pairing_probabilities_sum",
-    #     second_best_pairing_probabilities_sum,
-    # )
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(**pool_options) as feature_pool, ThreadPoolExecutor(
+        **pool_options
+    ) as pairing_pool:
+        features = [feature_pool.submit(build_batch, *batch) for batch in batches]
+        pairings = []
+        for batch, feature in zip(batches, features):
+            _add_value(timing, "feature_build", feature.result())
+            begin = time.perf_counter()
+            session.run_batch(inputs, outputs, *batch)
+            _add_time(timing, "inference", begin)
+            pairings.append(pairing_pool.submit(select_batch, *batch))
+        for pairing in pairings:
+            _add_value(timing, "pairing", pairing.result())
+    _add_time(timing, "pipeline", start_time)
 
     return (
         predictions_best,
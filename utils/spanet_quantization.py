@@ -0,0 +1,279 @@
+# Quantized variants of the SPANet models and their accuracy-regression check.
+# Produce the INT8 model and compare it with the full-precision one with
+#   python utils/spanet_quantization.py -m <model>.onnx --mode int8_dynamic
+# then select it in the workflow with the "spanet_quantization" workflow option.
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SPANET_QUANTIZATION_MODES = ("int8_dynamic", "int8_static", "fp16")
+
+
+def get_quantized_model_path(model_path, mode):
+    """Path of the quantized variant of a model, next to the original one."""
+    if mode not in SPANET_QUANTIZATION_MODES:
+        raise ValueError(
+            f"Unknown quantization {mode}, available: {SPANET_QUANTIZATION_MODES}"
+        )
+    stem, ext = os.path.splitext(model_path)
+    return f"{stem}_{mode}{ext}"
+
+
+def resolve_spanet_model(model_path, quantization=None):
+    """
+    Model to load for the given quantization mode.
+
+    Parameters:
+    model_path (str): full-precision onnx model.
+    quantization (str): one of SPANET_QUANTIZATION_MODES, None for the original model.
+
+    Returns:
+    str: path of the model.
+    """
+    if not quantization or not model_path:
+        return model_path
+    quantized_path = get_quantized_model_path(model_path, quantization)
+    if not os.path.exists(quantized_path):
+        raise FileNotFoundError(
+            f"{quantized_path} not found, create it with: python utils/spanet_quantization.py "
+            f"-m {model_path} --mode {quantization}"
+        )
+    return quantized_path
+
+
+def generate_spanet_inputs(num_events, max_num_jets, min_jets=4, seed=42):
+    """
+    Synthetic SPANet inputs, with the features of SPANET_INPUT_FIELDS.
+
+    Returns:
+    numpy.ndarray: (n_events, max_num_jets, n_features) float32 features.
+    numpy.ndarray: (n_events, max_num_jets) bool mask of the jets.
+    """
+    from utils.spanet_evaluation_functions import SPANET_INPUT_FIELDS
+
+    rng = np.random.default_rng(seed)
+    shape = (num_events, max_num_jets)
+    generators = {
+        "pt": lambda: np.log1p(20 + rng.exponential(60, shape)),
+        "eta": lambda: rng.normal(0, 1.2, shape),
+        "phi": lambda: rng.uniform(-np.pi, np.pi, shape),
+        "btagPNetB": lambda: rng.beta(0.5, 0.5, shape),
+    }
+    features = np.stack(
+        [generators[field]() for field in SPANET_INPUT_FIELDS], axis=-1
+    ).astype(np.float32)
+
+    num_jets = rng.integers(min_jets, max_num_jets + 1, size=num_events)
+    mask = np.arange(max_num_jets)[np.newaxis, :] < num_jets[:, np.newaxis]
+    features[~mask] = 0
+    return features, mask
+
+
+def _calibration_reader(input_names, inputs, batch_size=1000):
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class SpanetCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self.batches = iter(range(0, len(inputs[0]), batch_size))
+
+        def get_next(self):
+            start = next(self.batches, None)
+            if start is None:
+                return None
+            return {
+                name: array[start : start + batch_size]
+                for name, array in zip(input_names, inputs)
+            }
+
+    return SpanetCalibrationReader()
+
+
+def quantize_model(model_path, mode, output_path=None, calibration_inputs=None):
+    """
+    Write a quantized variant of a SPANet model.
+
+    Parameters:
+    model_path (str): full-precision onnx model.
+    mode (str): "int8_dynamic" (weights quantized offline, activations at run time),
+        "int8_static" (activations calibrated on calibration_inputs) or "fp16"
+        (weights and activations in half precision, inputs and outputs kept float32).
+    output_path (str): destination, by default get_quantized_model_path.
+    calibration_inputs (list): input arrays of the model, needed by int8_static.
+
+    Returns:
+    str: path of the quantized model.
+    """
+    output_path = output_path or get_quantized_model_path(model_path, mode)
+
+    if mode == "int8_dynamic":
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(model_path, output_path, weight_type=QuantType.QInt8)
+    elif mode == "int8_static":
+        import onnxruntime as ort
+        from onnxruntime.quantization import QuantFormat, quantize_static
+
+        if calibration_inputs is None:
+            raise ValueError("int8_static quantization requires calibration inputs")
+        input_names = [
+            tensor.name
+            for tensor in ort.InferenceSession(
+                model_path, providers=["CPUExecutionProvider"]
+            ).get_inputs()
+        ]
+        quantize_static(
+            model_path,
+            output_path,
+            _calibration_reader(input_names, calibration_inputs),
+            quant_format=QuantFormat.QDQ,
+        )
+    elif mode == "fp16":
+        import onnx
+        from onnxruntime.transformers.float16 import convert_float_to_float16
+
+        model = convert_float_to_float16(onnx.load(model_path), keep_io_types=True)
+        onnx.save(model, output_path)
+    else:
+        raise ValueError(
+            f"Unknown quantization {mode}, available: {SPANET_QUANTIZATION_MODES}"
+        )
+
+    return output_path
+
+
+def evaluate_model(model_path, inputs, max_num_jets, batch_size=None, repeat=3):
+    """
+    Best pairings of a model on the given inputs and its throughput.
+
+    Returns:
+    tuple: the arrays of get_best_pairings.
+    float: events per second of the inference and the pairing extraction.
+    """
+    import onnxruntime as ort
+    from utils.inference_session import InferenceSessionHolder
+    from utils.spanet_evaluation_functions import get_best_pairings
+
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    sess_options.intra_op_num_threads = 1
+    session = InferenceSessionHolder(
+        ort.InferenceSession(
+            model_path, sess_options=sess_options, providers=["CPUExecutionProvider"]
+        )
+    )
+
+    # first call outside of the timing, to allocate the buffers
+    session.run([array[:10] for array in inputs], max_num_jets)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        assignment_probability, _ = session.run(inputs, max_num_jets, batch_size)
+        pairings = get_best_pairings(assignment_probability)
+    elapsed = (time.perf_counter() - start) / repeat
+    return tuple(np.copy(array) for array in pairings), len(inputs[0]) / elapsed
+
+
+def compare_models(reference_path, quantized_path, inputs, max_num_jets, **kwargs):
+    """
+    Compare the best pairings of a quantized model with the ones of the reference.
+
+    Returns:
+    dict: throughputs, fraction of events with the same best pairing (the order of
+        the two Higgs candidates and of the jets in a pair included) and shift of
+        the best pairing probability.
+    """
+    reference, reference_rate = evaluate_model(
+        reference_path, inputs, max_num_jets, **kwargs
+    )
+    quantized, quantized_rate = evaluate_model(
+        quantized_path, inputs, max_num_jets, **kwargs
+    )
+
+    shift = quantized[1] - reference[1]
+    return {
+        "reference_rate": reference_rate,
+        "quantized_rate": quantized_rate,
+        "pairing_agreement": np.mean(
+            np.all(reference[0] == quantized[0], axis=(1, 2))
+        ),
+        "best_probability_shift_mean": np.mean(shift),
+        "best_probability_shift_std": np.std(shift),
+        "best_probability_shift_max": np.max(np.abs(shift)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Quantize a SPANet model and compare it with the full-precision one"
+    )
+    parser.add_argument("-m", "--model", required=True, help="Full-precision model")
+    parser.add_argument(
+        "--mode", choices=SPANET_QUANTIZATION_MODES, default="int8_dynamic"
+    )
+    parser.add_argument(
+        "-i",
+        "--inputs",
+        type=str,
+        default=None,
+        help="npz file with the input arrays of the model, by name "
+        "(default: synthetic events)",
+    )
+    parser.add_argument(
+        "-n", "--num-events", type=int, default=100000, help="Number of synthetic events"
+    )
+    parser.add_argument(
+        "-j", "--max-num-jets", type=int, default=5, help="Number of jets per event"
+    )
+    parser.add_argument(
+        "-b", "--batch-size", type=int, default=None, help="Events per session.run call"
+    )
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="Overwrite the quantized model"
+    )
+    args = parser.parse_args()
+
+    if args.inputs:
+        import onnxruntime as ort
+
+        with np.load(args.inputs) as cached:
+            inputs = [
+                cached[tensor.name]
+                for tensor in ort.InferenceSession(
+                    args.model, providers=["CPUExecutionProvider"]
+                ).get_inputs()
+            ]
+    else:
+        inputs = list(generate_spanet_inputs(args.num_events, args.max_num_jets))
+
+    quantized_path = get_quantized_model_path(args.model, args.mode)
+    if args.force or not os.path.exists(quantized_path):
+        quantize_model(args.model, args.mode, quantized_path, calibration_inputs=inputs)
+        print(f"quantized model written to {quantized_path}")
+
+    result = compare_models(
+        args.model,
+        quantized_path,
+        inputs,
+        args.max_num_jets,
+        batch_size=args.batch_size,
+    )
+    print(
+        f"throughput: {result['reference_rate']:.0f} -> {result['quantized_rate']:.0f} ev/s "
+        f"(x{result['quantized_rate'] / result['reference_rate']:.2f})"
+    )
+    print(f"pairing agreement: {result['pairing_agreement']:.4%}")
+    print(
+        "best_pairing_probability shift: "
+        f"mean {result['best_probability_shift_mean']:+.2e}, "
+        f"std {result['best_probability_shift_std']:.2e}, "
+        f"max |shift| {result['best_probability_shift_max']:.2e}"
+    )
+
+
+if __name__ == "__main__":
+    main()
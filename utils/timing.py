@@ -0,0 +1,179 @@
+# Per-chunk timing of the stages of the workflows, stored in the "timing" section
+# of the output. Print the percentiles of each stage with
+#   python utils/timing.py output_all.coffea
+
+import argparse
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+TIMING_METRICS = ("wall", "cpu", "peak_rss")
+
+# Stages renamed in the workflows, {old name: new name}, so that the outputs of the
+# earlier runs are summarized with the current names
+STAGE_RENAMES = {
+    # the per-parton last-copy walk was replaced by the copy tables of the chunk
+    "get_parton_last_copy": "genpart_copy_tables",
+}
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def get_peak_rss():
+    """Peak resident set size of the process, in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT / 1024**2
+
+
+class StageTiming:
+    """
+    Wall time, CPU time of the process and peak RSS of named stages.
+
+    The times of a stage entered several times are summed, and the peak RSS is the
+    one of the process at the end of the stage, so that the growth of the memory
+    can be attributed to the first stage reaching it.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._running = {}
+
+    def _get(self, name):
+        return self.stages.setdefault(name, dict.fromkeys(TIMING_METRICS, 0.0))
+
+    def start(self, name):
+        """Start timing a stage, for blocks that are not wrapped in stage()."""
+        self._running[name] = (time.perf_counter(), time.process_time())
+
+    def stop(self, name):
+        wall, cpu = self._running.pop(name)
+        stage = self._get(name)
+        stage["wall"] += time.perf_counter() - wall
+        stage["cpu"] += time.process_time() - cpu
+        stage["peak_rss"] = max(stage["peak_rss"], get_peak_rss())
+
+    @contextmanager
+    def stage(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def add(self, timing):
+        """
+        Add the wall times of a {stage: seconds} dict, e.g. of get_pairing_information.
+        The CPU time of these stages is not known, and only counted in the enclosing one.
+        """
+        peak_rss = get_peak_rss()
+        for name, seconds in timing.items():
+            stage = self.stages.setdefault(name, {"wall": 0.0, "peak_rss": 0.0})
+            stage["wall"] += seconds
+            stage["peak_rss"] = max(stage["peak_rss"], peak_rss)
+
+
+def record_timing(output, dataset, timing):
+    """
+    Add the stage timings of a chunk to the "timing" section of the output.
+
+    The timings are stored as {dataset: {stage: {metric: [value, ...]}}}, with one
+    entry per chunk, so that the lists are concatenated when the outputs of the
+    chunks and of the workers are accumulated.
+
+    Parameters:
+    output (dict): output of the processor.
+    dataset (str): dataset of the chunk.
+    timing (StageTiming or dict): timing of the stages, or seconds spent in each stage.
+    """
+    if isinstance(timing, StageTiming):
+        timing = timing.stages
+    dataset_timing = output.setdefault("timing", {}).setdefault(dataset, {})
+    for stage, metrics in timing.items():
+        if not isinstance(metrics, dict):
+            metrics = {"wall": metrics}
+        stage_timing = dataset_timing.setdefault(stage, {})
+        for metric, value in metrics.items():
+            stage_timing.setdefault(metric, []).append(value)
+
+
+def summarize_timing(timing, percentiles=(50, 90, 99)):
+    """
+    Percentiles over the chunks of each metric of each stage.
+
+    The stages of STAGE_RENAMES are summarized under their current name, together
+    with the chunks recorded with it.
+
+    Parameters:
+    timing (dict): "timing" section of the output.
+    percentiles (tuple): percentiles to compute.
+
+    Returns:
+    dict: {dataset: {stage: {metric: {"n": .., "mean": .., "total": .., "p50": ..}}}}
+    """
+    summary = {}
+    for dataset, stages in timing.items():
+        renamed = {}
+        for stage, metrics in stages.items():
+            stage_timing = renamed.setdefault(STAGE_RENAMES.get(stage, stage), {})
+            for metric, values in metrics.items():
+                stage_timing.setdefault(metric, []).extend(values)
+        for stage, metrics in renamed.items():
+            for metric, values in metrics.items():
+                values = np.asarray(values, dtype=np.float64)
+                stats = {"n": len(values), "mean": values.mean(), "total": values.sum()}
+                for percentile, value in zip(
+                    percentiles, np.percentile(values, percentiles)
+                ):
+                    stats[f"p{percentile}"] = value
+                summary.setdefault(dataset, {}).setdefault(stage, {})[metric] = stats
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Print the timing of the stages of the workflow per dataset"
+    )
+    parser.add_argument("output", help="coffea output file")
+    parser.add_argument(
+        "-m",
+        "--metric",
+        choices=TIMING_METRICS,
+        default="wall",
+        help="Metric to print, the times are in s and the peak RSS in MB",
+    )
+    parser.add_argument(
+        "-p",
+        "--percentiles",
+        type=int,
+        nargs="+",
+        default=[50, 90, 99],
+        help="Percentiles over the chunks",
+    )
+    args = parser.parse_args()
+
+    from coffea.util import load
+
+    timing = load(args.output).get("timing", {})
+    if not timing:
+        sys.exit(f"No timing section in {args.output}")
+
+    summary = summarize_timing(timing, args.percentiles)
+    columns = ["n", "mean", "total"] + [f"p{p}" for p in args.percentiles]
+    for dataset, stages in summary.items():
+        print(f"{dataset} ({args.metric})")
+        print(f"  {'stage':<28s}" + "".join(f"{column:>11s}" for column in columns))
+        for stage, metrics in stages.items():
+            if args.metric not in metrics:
+                continue
+            stats = metrics[args.metric]
+            print(
+                f"  {stage:<28s}{stats['n']:>11d}"
+                + "".join(f"{stats[column]:>11.3f}" for column in columns[1:])
+            )
+
+
+if __name__ == "__main__":
+    main()